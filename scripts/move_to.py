@@ -17,65 +17,19 @@ Options:
 """
 
 from docopt import docopt
-import yaml
-from src.config import MotorConfig, validate_yaml_dict
-
-from src.motor_control import MotorControl
-from src.motor_control import find_serial_port
-
-MOTORS_ID = {
-    "motorX": 1,
-    "motorY": 2,
-    "motorZ": 3,
-}
+from src.cli import build_motors, load_yaml, motor_direction
 
 if __name__ == "__main__":
     args = docopt(__doc__)
-    yaml_conf = args["<YAMLCONF>"]
     motor_name = args["<motorname>"]
     position_mm = float(args["<position_mm>"])
-    direction = int(args["<direction>"])
-
-    # Check that the direction is valid
-    if direction not in [0, 1]:
-        raise ValueError(f"Direction {direction} is not valid. Must be 1 or 0.")
-
-    direction = -1 if direction == 0 else 1
-    # Check that the motor name is valid
-    if motor_name not in ["motorX", "motorY", "motorZ"]:
-        raise ValueError(
-            f"Motor name {motor_name} is not valid. Must be motorX, motorY or motorZ."
-        )
-
-    # Load the YAML configuration file
-    with open(yaml_conf) as yaml_reader:
-        yaml_dict = yaml.safe_load(yaml_reader)
-
-    # Validate the YAML configuration file
-    validate_yaml_dict(yaml_dict)
-
-    # Find the motor port
-    com_port = yaml_dict["COM_port"]
-    motors_serial = find_serial_port(com_port)
+    # Check that the motor name and the direction are valid
+    direction = motor_direction(motor_name, int(args["<direction>"]))
 
-    # Create a MotorControl instance for each motor
-    motors_active = [key for key in yaml_dict if key.startswith("motor")]
-    motors = []
-    for motor_name_loop in motors_active:
-        # motor_name = f"motor{chr(88 + i)}"  # 88 is ASCII for 'X'
-        motor_config = MotorConfig(yaml_dict[motor_name_loop])
-        motor = MotorControl(
-            motors_serial,
-            motor_config,
-            motor_name=motor_name_loop,
-            motor_id=MOTORS_ID[motor_name_loop],
-        )
-        motors.append(motor)
+    yaml_dict = load_yaml(args["<YAMLCONF>"])
+    (motor,) = build_motors(yaml_dict, [motor_name])
 
-    # Move the motor to the desired position
-    for motor in motors:
-        if motor.motor_name == motor_name:
-            # Convert the position in mm to steps
-            position_steps = motor.position_to_steps(position_mm)
-            motor.move_motor(direction, position_steps)
-            motor.close()
+    # Convert the position in mm to steps and move the motor
+    position_steps = motor.position_to_steps(position_mm)
+    motor.move_motor(direction, position_steps)
+    motor.close()
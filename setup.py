@@ -1,4 +1,9 @@
 from setuptools import setup, find_packages
 import numpy
 
-setup(name="PETsyScan", packages=find_packages(), include_dirs=[numpy.get_include()])
+setup(
+    name="PETsyScan",
+    packages=find_packages(),
+    include_dirs=[numpy.get_include()],
+    entry_points={"console_scripts": ["acquire-petsys = src.cli:main"]},
+)
@@ -0,0 +1,222 @@
+import glob
+import hashlib
+import json
+import lzma
+import os
+import socket
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+ARCHIVE_EXTENSIONS = {"lzma": ".xz", "zlib": ".zz"}
+CHUNK_SIZE = 1 << 22  # bytes read at a time while (de)compressing
+ARCHIVE_WORKERS = 2  # processes compressing in the background
+ARCHIVE_NICE = 19  # niceness of the archive workers
+LOCK_TIMEOUT = 30  # seconds after which a manifest lock was left by a dead writer
+LOCK_POLL = 0.05  # seconds between attempts to take the manifest lock
+
+
+def _compressor(codec: str):
+    if codec == "lzma":
+        return lzma.LZMACompressor()
+    elif codec == "zlib":
+        return zlib.compressobj(6)
+    raise ValueError(f"Archive codec {codec} unknown.")
+
+
+def _decompressor(codec: str):
+    if codec == "lzma":
+        return lzma.LZMADecompressor()
+    elif codec == "zlib":
+        return zlib.decompressobj()
+    raise ValueError(f"Archive codec {codec} unknown.")
+
+
+def _lower_priority() -> None:
+    """Run the archive workers with the lowest CPU priority (not on Windows)."""
+    if hasattr(os, "nice"):
+        os.nice(ARCHIVE_NICE)
+
+
+def _writer_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+
+
+@contextmanager
+def _locked(file_path: str):
+    """Hold <file_path>.lock, exclusive across the processes and hosts
+    sharing the file system (queue workers restore runs at the same time)."""
+    lock = file_path + ".lock"
+    while True:
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock) > LOCK_TIMEOUT:
+                    os.remove(lock)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(LOCK_POLL)
+    try:
+        yield
+    finally:
+        os.remove(lock)
+
+
+def compress_file(file_path: str, codec: str) -> Dict[str, Any]:
+    """Compress a file next to itself, remove the original and return its manifest entry."""
+    archive_path = file_path + ARCHIVE_EXTENSIONS[codec]
+    compressor = _compressor(codec)
+    file_hash = hashlib.sha256()
+    archive_hash = hashlib.sha256()
+    with open(file_path, "rb") as f_in, open(archive_path + ".tmp", "wb") as f_out:
+        for chunk in iter(lambda: f_in.read(CHUNK_SIZE), b""):
+            file_hash.update(chunk)
+            data = compressor.compress(chunk)
+            archive_hash.update(data)
+            f_out.write(data)
+        data = compressor.flush()
+        archive_hash.update(data)
+        f_out.write(data)
+    os.replace(archive_path + ".tmp", archive_path)
+    entry = {
+        "archive": archive_path,
+        "codec": codec,
+        "size": os.path.getsize(file_path),
+        "archive_size": os.path.getsize(archive_path),
+        "sha256": file_hash.hexdigest(),
+        "archive_sha256": archive_hash.hexdigest(),
+    }
+    os.remove(file_path)
+    return entry
+
+
+def decompress_file(file_path: str, entry: Dict[str, Any]) -> None:
+    """Restore an archived file and check it against the manifest checksum."""
+    decompressor = _decompressor(entry["codec"])
+    file_hash = hashlib.sha256()
+    with open(entry["archive"], "rb") as f_in, open(file_path + ".tmp", "wb") as f_out:
+        for chunk in iter(lambda: f_in.read(CHUNK_SIZE), b""):
+            data = decompressor.decompress(chunk)
+            file_hash.update(data)
+            f_out.write(data)
+        if entry["codec"] == "zlib":
+            data = decompressor.flush()
+            file_hash.update(data)
+            f_out.write(data)
+    if file_hash.hexdigest() != entry["sha256"]:
+        os.remove(file_path + ".tmp")
+        raise IOError(
+            f"Checksum mismatch restoring {file_path} from {entry['archive']}"
+        )
+    os.replace(file_path + ".tmp", file_path)
+    os.remove(entry["archive"])
+
+
+class Archiver:
+    """Compress converted runs in a low-priority worker pool.
+
+    `archive` selects what is compressed once a run has been converted:
+    'none', 'raw' or 'all' (raw and processed output). The manifest maps every
+    archived file to its archive and checksums, and `restore` brings the raw
+    files back before a run is converted again. Several archivers (queue
+    workers) can share a manifest: each one merges its changes into the
+    manifest on disk.
+    """
+
+    def __init__(self, yaml_dict: Dict[str, Any], manifest_path: str) -> None:
+        self.mode = yaml_dict.get("archive", "none")
+        self.codec = yaml_dict.get("archive_codec", "lzma")
+        self.manifest_path = manifest_path
+        self.manifest = self._read_manifest()
+        self.pool = None
+        self.futures = {}
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        if not os.path.isfile(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def _update_manifest(
+        self, added: Dict[str, Any] = None, removed: List[str] = ()
+    ) -> None:
+        """Add and remove entries of the manifest on disk, keeping the changes
+        written meanwhile by the other archivers."""
+        with _locked(self.manifest_path):
+            self.manifest = self._read_manifest()
+            self.manifest.update(added or {})
+            for file_path in removed:
+                self.manifest.pop(file_path, None)
+            # temporary file private to the writer
+            tmp_path = f"{self.manifest_path}.{_writer_id()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.manifest, f, indent=1)
+            os.replace(tmp_path, self.manifest_path)
+
+    def submit(self, file_dir: str, processed_files: List[str]) -> None:
+        """Queue the raw files of a converted run (and its output if 'all') for compression."""
+        if self.mode == "none":
+            return
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                max_workers=ARCHIVE_WORKERS, initializer=_lower_priority
+            )
+        files = [
+            f
+            for f in glob.glob(file_dir + ".*")
+            if not f.endswith(tuple(ARCHIVE_EXTENSIONS.values()))
+        ]
+        if self.mode == "all":
+            files += processed_files
+        for file_path in files:
+            self.futures[file_path] = self.pool.submit(
+                compress_file, file_path, self.codec
+            )
+        self.collect(wait=False)
+
+    def collect(self, wait: bool = True) -> None:
+        """Add the finished compressions to the manifest."""
+        finished = {}
+        for file_path, future in list(self.futures.items()):
+            if wait or future.done():
+                finished[file_path] = future.result()
+                del self.futures[file_path]
+        self._update_manifest(finished)
+
+    def restore(self, file_dir: str) -> None:
+        """Decompress the archived raw files of a run if they are needed again."""
+        self._restore(file_dir + ".")
+
+    def restore_processed(self, processed_name: str) -> None:
+        """Decompress the archived processed output of a run ('all'), read by
+        the report, resort and TimeIndex."""
+        self._restore(processed_name)
+
+    def _restore(self, prefix: str) -> None:
+        # with the files archived and restored by the other archivers
+        self.manifest = self._read_manifest()
+        archived = set(self.manifest) | set(self.futures)
+        added, restored = {}, []
+        for file_path in [f for f in archived if f.startswith(prefix)]:
+            if file_path in self.futures:
+                added[file_path] = self.futures.pop(file_path).result()
+            entry = added.get(file_path) or self.manifest[file_path]
+            if not os.path.exists(file_path):
+                print(f"Restoring {file_path} from {entry['archive']}")
+                decompress_file(file_path, entry)
+                restored.append(file_path)
+        if added or restored:
+            self._update_manifest(added, restored)
+
+    def close(self) -> None:
+        """Wait for the pending compressions."""
+        if self.pool is not None:
+            self.collect(wait=True)
+            self.pool.shutdown()
+            self.pool = None
@@ -0,0 +1,200 @@
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import yaml
+
+from src.config import (
+    MOTORS_ID,
+    MotorConfig,
+    get_ref_params,
+    validate_yaml_dict,
+)
+from src.motor_control import MotionModel, MotorControl
+from src.multiplex import setup_multiplexing
+from src.plan import ScanPlan, compile_scan, validate_plan
+from src.settings import BiasSettings, DiscSettings
+from src.utils import format_duration
+
+BIAS_CHANGE_COST = 60  # seconds assumed for the SiPMs to settle after a bias change
+SETTINGS_LOAD_COST = 10  # seconds to load the settings tables of another setup
+SETTINGS_KEYS = [
+    "config_directory",
+    "bias_file",
+    "FEM",
+    "FEBD",
+    "BIAS_board",
+    "ref_det_febd",
+]
+
+
+class BatchJob(NamedTuple):
+    """One scan of a batch, validated and compiled."""
+
+    yaml_file: str
+    yaml_dict: Dict[str, Any]
+    plan: ScanPlan
+
+
+class JobState(NamedTuple):
+    """Hardware state at the start or end of a job, to cost the transitions."""
+
+    steps: Dict[str, int]  # motor name -> absolute steps
+    over_voltage: float
+    settings: tuple
+
+
+HOME_STATE = JobState(steps={}, over_voltage=None, settings=None)
+
+
+def settings_key(yaml_dict: Dict[str, Any]) -> tuple:
+    """Parameters that select the settings tables and the reference detector."""
+    # ref_det_febd may be a list of ports, keys must be hashable
+    return tuple(
+        tuple(yaml_dict[key]) if isinstance(yaml_dict[key], list) else yaml_dict[key]
+        for key in SETTINGS_KEYS
+    )
+
+
+def load_jobs(yaml_files: List[str]) -> List[BatchJob]:
+    """Read, validate and compile every scan before the batch starts."""
+    jobs = []
+    for yaml_file in yaml_files:
+        with open(yaml_file) as yaml_reader:
+            yaml_dict = yaml.safe_load(yaml_reader)
+        validate_yaml_dict(yaml_dict)
+        plan = compile_scan(yaml_dict)
+        validate_plan(plan, yaml_dict)
+        jobs.append(BatchJob(yaml_file, yaml_dict, plan))
+
+    petsys_directories = {job.yaml_dict["petsys_directory"] for job in jobs}
+    assert (
+        len(petsys_directories) == 1
+    ), f"All the scans of a batch must use the same petsys_directory: {petsys_directories}"
+    log_files = [job.plan.log_file for job in jobs]
+    assert len(set(log_files)) == len(
+        log_files
+    ), "Two scans of the batch write the same log file, change their out_name"
+    return jobs
+
+
+def _models(job: BatchJob) -> Dict[str, MotionModel]:
+    names = list(job.plan.motor_names)
+    if job.plan.sweep_motor:
+        names.append(job.plan.sweep_motor)
+    return {name: MotionModel(MotorConfig(job.yaml_dict[name])) for name in names}
+
+
+def start_state(job: BatchJob) -> JobState:
+    """State the job needs before its first point."""
+    plan = job.plan
+    steps = dict(zip(plan.motor_names, plan.points[0].step_targets))
+    if plan.sweep_motor:
+        # the sweep motor is moved to its start position before the scan
+        sweep_config = MotorConfig(job.yaml_dict[plan.sweep_motor])
+        steps[plan.sweep_motor] = MotionModel(sweep_config).steps(sweep_config.start)
+    return JobState(steps, plan.points[0].over_voltage, settings_key(job.yaml_dict))
+
+
+def end_state(job: BatchJob) -> JobState:
+    """State the job leaves after its last point."""
+    plan = job.plan
+    steps = dict(zip(plan.motor_names, plan.points[-1].step_targets))
+    if plan.sweep_motor:
+        # the sweeps alternate direction, an odd number of them ends at the far end
+        sweep_config = MotorConfig(job.yaml_dict[plan.sweep_motor])
+        position = sweep_config.end if len(plan.points) % 2 else sweep_config.start
+        steps[plan.sweep_motor] = MotionModel(sweep_config).steps(position)
+    return JobState(steps, plan.points[-1].over_voltage, settings_key(job.yaml_dict))
+
+
+def transition_cost(state: JobState, job: BatchJob) -> float:
+    """Predicted seconds to take the hardware from `state` to the start of `job`."""
+    target = start_state(job)
+    models = _models(job)
+    # motors not used yet are still at HOME
+    cost = sum(
+        models[name].move_time(steps - state.steps.get(name, 0))
+        for name, steps in target.steps.items()
+    )
+    if state.over_voltage is not None and state.over_voltage != target.over_voltage:
+        cost += BIAS_CHANGE_COST
+    if state.settings is not None and state.settings != target.settings:
+        cost += SETTINGS_LOAD_COST
+    return cost
+
+
+def order_jobs(jobs: List[BatchJob]) -> List[Tuple[BatchJob, float]]:
+    """Order the jobs greedily by the cheapest transition from the previous one.
+
+    Returns the jobs with the predicted transition cost before each of them.
+    Ties keep the order given on the command line.
+    """
+    state = HOME_STATE
+    remaining = list(jobs)
+    ordered = []
+    while remaining:
+        costs = [transition_cost(state, job) for job in remaining]
+        best = costs.index(min(costs))
+        job = remaining.pop(best)
+        ordered.append((job, costs[best]))
+        state = end_state(job)
+    return ordered
+
+
+def print_batch(ordered_jobs: List[Tuple[BatchJob, float]]) -> None:
+    """Print the batch order and its predictions."""
+    print(f"Batch of {len(ordered_jobs)} scans:")
+    total = 0.0
+    for i, (job, cost) in enumerate(ordered_jobs):
+        print(
+            f"{i}\t{job.yaml_file}\t{len(job.plan.points)} points\t"
+            f"{format_duration(job.plan.predicted_duration)}\t"
+            f"transition {cost:.1f} s"
+        )
+        total += cost + job.plan.predicted_duration
+    print(f"Predicted batch duration: {format_duration(total)}")
+
+
+def load_settings(
+    yaml_dict: Dict[str, Any], cache: Dict[tuple, tuple]
+) -> Tuple[BiasSettings, DiscSettings]:
+    """Settings objects of a job, loaded once per setup and shared by the batch."""
+    key = settings_key(yaml_dict)
+    if key not in cache:
+        bias_ref_params, disc_ref_params = get_ref_params(yaml_dict)
+        cache[key] = (
+            BiasSettings(yaml_dict, bias_ref_params),
+            DiscSettings(yaml_dict, disc_ref_params),
+        )
+    bias_settings, disc_settings = cache[key]
+    # the tables are shared, the scan parameters are the job's
+    bias_settings.dictionary = yaml_dict
+    disc_settings.dictionary = yaml_dict
+    if yaml_dict.get("bias_sweep"):
+        bias_settings.set_fixedvoltages()
+    disc_settings.set_fixedthresholds()
+    setup_multiplexing(disc_settings, yaml_dict)
+    return bias_settings, disc_settings
+
+
+def session_motors(
+    motors_serial, job: BatchJob, session: Dict[str, MotorControl]
+) -> List[MotorControl]:
+    """Motors of a job, homed once per batch and reconfigured for every job.
+
+    The sweep motor, if any, is the last one.
+    """
+    names = list(job.plan.motor_names)
+    if job.plan.sweep_motor:
+        names.append(job.plan.sweep_motor)
+    motors = []
+    for name in names:
+        motor_config = MotorConfig(job.yaml_dict[name])
+        if name in session:
+            session[name].reconfigure(motor_config)
+        else:
+            session[name] = MotorControl(
+                motors_serial, motor_config, motor_name=name, motor_id=MOTORS_ID[name]
+            )
+            session[name].find_home()
+        motors.append(session[name])
+    return motors
@@ -0,0 +1,114 @@
+import json
+import os
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
+
+from src.output import run_size
+
+if TYPE_CHECKING:
+    from src.settings import Commands
+
+# bias changes and their measured settle times, kept in out_directory
+SETTLE_FILE = "bias_settle.json"
+PROBE_SUFFIX = "_bias_probe"  # raw files of the settling probes, deleted afterwards
+SETTLE_PROBE_TIME = 1.0  # seconds of each probe acquisition
+SETTLE_TOLERANCE = 0.05  # relative rate change between probes considered settled
+SETTLE_MAX_PROBES = 10
+
+
+def ramp_order(voltages: List[float], ramp: str, pass_index: int) -> List[float]:
+    """Over-voltages of one pass of the scan in the order they are applied.
+
+    'up' and 'down' ramp monotonically every pass, 'serpentine' goes up and
+    down on alternate passes so no pass starts with a large step.
+    """
+    ascending = sorted(voltages)
+    if ramp == "down" or (ramp == "serpentine" and pass_index % 2 == 1):
+        return ascending[::-1]
+    return ascending
+
+
+def _settle_path(yaml_dict: Dict[str, Any]) -> str:
+    return os.path.join(yaml_dict["out_directory"], SETTLE_FILE)
+
+
+def load_settle_times(yaml_dict: Dict[str, Any]) -> List[Dict[str, float]]:
+    """Bias changes measured in past scans, oldest first."""
+    try:
+        with open(_settle_path(yaml_dict)) as f:
+            return json.load(f)["changes"]
+    except (FileNotFoundError, ValueError, KeyError):
+        return []
+
+
+def save_settle_time(
+    yaml_dict: Dict[str, Any], v_from: float, v_to: float, seconds: float, probes: int
+) -> None:
+    """Add a measured bias change to the settle times."""
+    changes = load_settle_times(yaml_dict)
+    changes.append({"from": v_from, "to": v_to, "seconds": seconds, "probes": probes})
+    with open(_settle_path(yaml_dict) + ".tmp", "w") as f:
+        json.dump({"changes": changes}, f, indent=1)
+    os.replace(_settle_path(yaml_dict) + ".tmp", _settle_path(yaml_dict))
+
+
+def predict_settle_time(yaml_dict: Dict[str, Any], v_from: float, v_to: float) -> float:
+    """Seconds to settle after a bias change, from the settle times per volt
+    measured so far, or the shortest probing (two probes) if none."""
+    changes = load_settle_times(yaml_dict)
+    volts = sum(abs(change["to"] - change["from"]) for change in changes)
+    if volts > 0:
+        seconds = sum(change["seconds"] for change in changes)
+        return seconds / volts * abs(v_to - v_from)
+    return 2 * yaml_dict.get("settle_probe_time", SETTLE_PROBE_TIME)
+
+
+class BiasSettling:
+    """Wait for the detectors to settle after a bias change.
+
+    Short probe acquisitions are taken until the raw data rate of two
+    consecutive probes differs by less than settle_tolerance, and the time
+    it took is added to SETTLE_FILE.
+    """
+
+    def __init__(self, yaml_dict: Dict[str, Any], petsys_commands: "Commands") -> None:
+        self.yaml_dict = yaml_dict
+        self.petsys_commands = petsys_commands
+        self.probe_time = yaml_dict.get("settle_probe_time", SETTLE_PROBE_TIME)
+        self.tolerance = yaml_dict.get("settle_tolerance", SETTLE_TOLERANCE)
+        self.max_probes = yaml_dict.get("settle_max_probes", SETTLE_MAX_PROBES)
+        self.probe_name = yaml_dict["out_name"] + PROBE_SUFFIX
+
+    def probe_rate(self) -> float:
+        """Raw bytes per second of one probe acquisition."""
+        out_directory = self.yaml_dict["out_directory"]
+        self.petsys_commands.acquire_data(
+            self.probe_name, self.probe_time, out_directory
+        )
+        file_dir = os.path.join(out_directory, self.probe_name)
+        rate = run_size(file_dir) / self.probe_time
+        for extension in [".rawf", ".idxf"]:
+            if os.path.isfile(file_dir + extension):
+                os.remove(file_dir + extension)
+        return rate
+
+    def settle(self, v_from: float, v_to: float) -> Tuple[float, bool]:
+        """Probe until the rate is stable, returns the seconds and if it settled."""
+        start = time.time()
+        rates = [self.probe_rate()]
+        settled = False
+        while len(rates) < self.max_probes:
+            rates.append(self.probe_rate())
+            if abs(rates[-1] - rates[-2]) <= self.tolerance * rates[-2]:
+                settled = True
+                break
+        seconds = time.time() - start
+        if settled:
+            print(f"Bias settled {v_from} -> {v_to} V in {seconds:.1f} s")
+            save_settle_time(self.yaml_dict, v_from, v_to, seconds, len(rates))
+        else:
+            print(
+                f"Bias {v_from} -> {v_to} V not settled after {len(rates)} probes "
+                f"(last rates {rates[-2]:.0f}, {rates[-1]:.0f} B/s), continuing."
+            )
+        return seconds, settled
@@ -0,0 +1,113 @@
+import os
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from src.records import binary_output, data_files, yaml_record_dtype
+from src.settings import Commands
+from src.table_cache import load_cached_tables
+
+CHUNK_RECORDS = 1 << 20  # records calibrated at a time
+# calibration columns and their value for channels missing in the table
+CALIBRATION_DEFAULTS = {"energy_gain": 1.0, "energy_offset": 0.0, "time_offset": 0}
+
+
+def flat_channel_id(
+    port_id: np.ndarray,
+    slave_id: np.ndarray,
+    chip_id: np.ndarray,
+    channel_id: np.ndarray,
+) -> np.ndarray:
+    """Absolute channel ID, as written by the PETsys converters."""
+    return ((port_id * 32 + slave_id) * 64 + chip_id) * 64 + channel_id
+
+
+class Calibration:
+    """Per-channel energy and time calibration as dense lookup arrays.
+
+    The source is a TSV like disc_settings.tsv (#portID, slaveID, chipID,
+    channelID) with any of the columns energy_gain, energy_offset and
+    time_offset (ps). Calibrated energy is energy * gain + offset and the time
+    offset is subtracted. The arrays are indexed by the absolute channel ID,
+    with a last entry holding the defaults for channels beyond the table.
+    """
+
+    def __init__(self, tables: Dict[str, np.ndarray]) -> None:
+        self.energy_gain = tables["energy_gain"]
+        self.energy_offset = tables["energy_offset"]
+        self.time_offset = tables["time_offset"]
+        self.size = self.energy_gain.size - 1
+
+    @staticmethod
+    def compile(table_file: str) -> Dict[str, np.ndarray]:
+        """Dense lookup arrays of a calibration table."""
+        print(f"Compiling calibration table {table_file}")
+        df = pd.read_csv(table_file, sep="\t")
+        df = df.rename(columns={"#portID": "portID"})
+        ids = flat_channel_id(
+            df["portID"].to_numpy(np.int64),
+            df["slaveID"].to_numpy(np.int64),
+            df["chipID"].to_numpy(np.int64),
+            df["channelID"].to_numpy(np.int64),
+        )
+        size = int(ids.max()) + 1 if ids.size else 0
+        tables = {}
+        for column, default in CALIBRATION_DEFAULTS.items():
+            dtype = np.int64 if column == "time_offset" else np.float32
+            table = np.full(size + 1, default, dtype=dtype)
+            if column in df:
+                table[ids] = df[column].to_numpy(dtype)
+            tables[column] = table
+        return tables
+
+    @classmethod
+    def load(cls, table_file: str) -> "Calibration":
+        """Compiled calibration, from the cache unless the table changed."""
+        return cls(load_cached_tables(table_file, cls.compile))
+
+    def apply(self, records: np.ndarray) -> None:
+        """Calibrate the events of structured records in place."""
+        for name in records.dtype.names:
+            if not name.startswith("channel_id"):
+                continue
+            suffix = name[len("channel_id") :]
+            # channels beyond the table take the defaults of the last entry
+            ids = np.minimum(records[name], self.size)
+            records["energy" + suffix] = (
+                records["energy" + suffix] * self.energy_gain[ids]
+                + self.energy_offset[ids]
+            )
+            records["time" + suffix] -= self.time_offset[ids]
+
+
+def calibrate_file(file_path: str, dtype: np.dtype, calibration: Calibration) -> int:
+    """Calibrate a binary file chunk by chunk, returns the records calibrated."""
+    calibrated = 0
+    with open(file_path, "rb") as f_in, open(file_path + ".tmp", "wb") as f_out:
+        while True:
+            records = np.fromfile(f_in, dtype=dtype, count=CHUNK_RECORDS)
+            if records.size == 0:
+                break
+            calibration.apply(records)
+            records.tofile(f_out)
+            calibrated += records.size
+    os.replace(file_path + ".tmp", file_path)
+    return calibrated
+
+
+def calibrate_run(
+    petsys_commands: Commands, full_out_name: str, out_directory: str = None
+) -> None:
+    """Apply the calibration_file of the YAML to the processed output of a run."""
+    yaml_dict = petsys_commands.dictionary
+    if not yaml_dict.get("calibration_file"):
+        return
+    if not binary_output(yaml_dict):
+        print("Calibration needs binary output, processed output kept as is.")
+        return
+    calibration = Calibration.load(yaml_dict["calibration_file"])
+    dtype = yaml_record_dtype(yaml_dict)
+    processed_name = petsys_commands.processed_name(full_out_name, out_directory)
+    for file_path in data_files(processed_name):
+        calibrate_file(file_path, dtype, calibration)
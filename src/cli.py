@@ -0,0 +1,126 @@
+"""Acquire and process PETsys scans and drive the scan motors.
+
+Usage:
+    acquire-petsys scan YAMLCONF [-m MODE]
+    acquire-petsys process YAMLCONF
+    acquire-petsys plan YAMLCONF
+    acquire-petsys home YAMLCONF
+    acquire-petsys move YAMLCONF MOTOR POSITION DIRECTION
+    acquire-petsys ping YAMLCONF
+
+Arguments:
+    YAMLCONF   File with all parameters to take into account in the scan.
+    MOTOR      Name of the motor to move. Must be motorX, motorY or motorZ.
+    POSITION   Distance to move the motor, in millimeters or degrees.
+    DIRECTION  Direction to move the motor. Must be 1 (forward) or 0 (backward).
+
+Options:
+    -h --help  Show this screen.
+    -m MODE    Mode to run the scan. Can be 'acquire', 'process' or 'both' [default: both]
+
+The batch, multi, queue, worker, resort, report and monitor commands are run with main.py.
+"""
+
+from typing import Any, Dict, List
+
+import yaml
+from docopt import docopt
+
+from src.config import MOTORS_ID, MotorConfig, validate_yaml_dict
+
+# Only the modules of the subcommand run are imported: pandas, numpy and
+# pyserial take most of the start-up time and the motor commands need none
+# of them but pyserial.
+
+
+def load_yaml(yaml_conf: str) -> Dict[str, Any]:
+    """Read and validate a YAML configuration file."""
+    with open(yaml_conf) as yaml_reader:
+        yaml_dict = yaml.safe_load(yaml_reader)
+    validate_yaml_dict(yaml_dict)
+    return yaml_dict
+
+
+def build_motors(
+    yaml_dict: Dict[str, Any],
+    motor_names: List[str] = None,
+    motors_serial=None,
+    while_timer: int = None,
+) -> list:
+    """MotorControl of every motor in motor_names (all the motors of the YAML by
+    default), sharing one serial connection."""
+    from src.motor_control import MotorControl, find_serial_port
+
+    if motor_names is None:
+        motor_names = [key for key in yaml_dict if key in MOTORS_ID]
+    if motors_serial is None:
+        if not yaml_dict["COM_port"]:
+            print(
+                "No COM port specified in the YAML file. Finding the first available serial port."
+            )
+        motors_serial = find_serial_port(yaml_dict["COM_port"])
+    motors = []
+    for motor_name in motor_names:
+        if while_timer is None:
+            motor_config = MotorConfig(yaml_dict[motor_name])
+        else:
+            motor_config = MotorConfig(yaml_dict[motor_name], while_timer)
+        motors.append(
+            MotorControl(
+                motors_serial,
+                motor_config,
+                motor_name=motor_name,
+                motor_id=MOTORS_ID[motor_name],
+            )
+        )
+    return motors
+
+
+def motor_direction(motor_name: str, direction: int) -> int:
+    """Check a manual move and return its direction as 1 or -1."""
+    if direction not in [0, 1]:
+        raise ValueError(f"Direction {direction} is not valid. Must be 1 or 0.")
+    if motor_name not in MOTORS_ID:
+        raise ValueError(
+            f"Motor name {motor_name} is not valid. Must be motorX, motorY or motorZ."
+        )
+    return -1 if direction == 0 else 1
+
+
+def main(argv: List[str] = None) -> None:
+    args = docopt(__doc__, argv=argv)
+    yaml_conf = args["YAMLCONF"]
+
+    if args["scan"] or args["process"]:
+        from src import scan_main
+
+        mode = "process" if args["process"] else args["-m"]
+        scan_main.main([yaml_conf, "-m", mode])
+        return
+
+    yaml_dict = load_yaml(yaml_conf)
+    if args["plan"]:
+        from src.plan import compile_scan, print_plan, validate_plan
+
+        scan_plan = compile_scan(yaml_dict)
+        validate_plan(scan_plan, yaml_dict)
+        print_plan(scan_plan)
+    elif args["home"]:
+        for motor in build_motors(yaml_dict):
+            motor.find_home()
+    elif args["move"]:
+        motor_name = args["MOTOR"]
+        direction = motor_direction(motor_name, int(args["DIRECTION"]))
+        (motor,) = build_motors(yaml_dict, [motor_name])
+        motor.move_motor(direction, motor.position_to_steps(float(args["POSITION"])))
+        motor.close()
+    elif args["ping"]:
+        for motor in build_motors(yaml_dict):
+            motor.pingLED()
+            print(f"LED pinged for {motor.motor_name}")
+            print(f"Pinging LED again for {motor.motor_name}")
+            motor.pingLED()
+
+
+if __name__ == "__main__":
+    main()
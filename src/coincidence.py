@@ -0,0 +1,184 @@
+import os
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from src.config import get_ref_params
+from src.records import DATA_EXTENSION, binary_output, data_files, record_dtype
+from src.settings import Commands
+
+CHUNK_RECORDS = 1 << 20  # singles read at a time
+COINCIDENCE_WINDOW = 20.0  # ns, default pairing window
+RESORTED_SUFFIX = "_coincResorted"
+PS_PER_NS = 1000  # PETsys times are in ps
+
+
+def local_chip(channel_id: np.ndarray) -> np.ndarray:
+    """ASIC of an absolute channel ID, within its FEB/D port."""
+    return (channel_id // 64) % 64
+
+
+def detector_id(channel_id: np.ndarray, num_asics: int) -> np.ndarray:
+    """Detector of an absolute channel ID, num_asics ASICs per detector."""
+    return (channel_id // 64) // num_asics
+
+
+class CoincidenceRules:
+    """Which pairs of singles make a coincidence.
+
+    Both singles must be on different detectors and, if given, inside the
+    energy window. With a reference detector (ref_det_febd in the YAML) exactly
+    one of them must be on it.
+    """
+
+    def __init__(
+        self,
+        num_asics: int,
+        ref_chips: List[int] = None,
+        energy_window: Tuple[float, float] = None,
+    ) -> None:
+        self.num_asics = num_asics
+        self.ref_chips = np.array(ref_chips or [], dtype=np.int64)
+        self.energy_window = energy_window
+
+    @classmethod
+    def from_yaml(cls, yaml_dict: Dict[str, Any]) -> "CoincidenceRules":
+        _, disc_params = get_ref_params(yaml_dict)
+        return cls(
+            2 if yaml_dict["FEM"] == "FEM128" else 4,
+            disc_params,
+            yaml_dict.get("energy_window"),
+        )
+
+    def accept(self, singles: np.ndarray, first: np.ndarray, second: np.ndarray):
+        """Mask of the pairs (first[k], second[k]) of singles that are kept."""
+        channels = singles["channel_id"].astype(np.int64)
+        mask = detector_id(channels[first], self.num_asics) != detector_id(
+            channels[second], self.num_asics
+        )
+        if self.ref_chips.size:
+            ref = np.isin(local_chip(channels), self.ref_chips)
+            mask &= ref[first] != ref[second]
+        if self.energy_window is not None:
+            energy = singles["energy"]
+            inside = (energy >= self.energy_window[0]) & (
+                energy <= self.energy_window[1]
+            )
+            mask &= inside[first] & inside[second]
+        return mask
+
+
+def window_pairs(times: np.ndarray, count: int, window: int) -> Tuple[np.ndarray, ...]:
+    """Pairs (i, j), i < count and i < j, of time sorted singles with
+    times[j] - times[i] <= window."""
+    ends = np.searchsorted(times, times[:count] + window, side="right")
+    partners = ends - np.arange(count) - 1
+    first = np.repeat(np.arange(count), partners)
+    # position of every pair among the partners of its first single
+    offsets = np.arange(first.size) - np.repeat(
+        np.cumsum(partners) - partners, partners
+    )
+    return first, first + 1 + offsets
+
+
+def _read_singles(file_paths: List[str], dtype: np.dtype) -> Iterator[np.ndarray]:
+    """Singles of the files in chunks, the files in the order of their first time."""
+
+    def first_time(file_path: str) -> int:
+        first = np.fromfile(file_path, dtype=dtype, count=1)
+        return int(first["time"][0]) if first.size else 0
+
+    for file_path in sorted(file_paths, key=first_time):
+        with open(file_path, "rb") as f:
+            while True:
+                chunk = np.fromfile(f, dtype=dtype, count=CHUNK_RECORDS)
+                if chunk.size == 0:
+                    break
+                yield chunk
+
+
+def build_coincidences(
+    chunks: Iterator[np.ndarray],
+    out_dtype: np.dtype,
+    rules: CoincidenceRules,
+    window_ns: float = COINCIDENCE_WINDOW,
+) -> Iterator[np.ndarray]:
+    """Pair the singles of a time ordered stream of chunks.
+
+    The singles of the last `window_ns` of a chunk may pair with the next one,
+    so they are carried over and paired once the following chunk is read.
+    Disorder within a chunk is sorted out; the chunks themselves must follow
+    each other in time, as the converter writes them.
+    """
+    window = int(window_ns * PS_PER_NS)
+    carry = None
+    chunks = iter(chunks)
+    chunk = next(chunks, None)
+    while chunk is not None:
+        next_chunk = next(chunks, None)
+        singles = chunk if carry is None else np.concatenate([carry, chunk])
+        singles = singles[np.argsort(singles["time"], kind="stable")]
+        times = singles["time"]
+        if next_chunk is None:
+            count = singles.size
+        else:
+            # singles whose partners could be in the next chunk wait for it
+            count = int(np.searchsorted(times, times[-1] - window, side="left"))
+        first, second = window_pairs(times, count, window)
+        keep = rules.accept(singles, first, second)
+        first, second = first[keep], second[keep]
+
+        coincidences = np.zeros(first.size, dtype=out_dtype)
+        for suffix, events in (("1", first), ("2", second)):
+            for name in ("time", "energy", "channel_id"):
+                coincidences[name + suffix] = singles[name][events]
+            if "mh_n" + suffix in out_dtype.names:
+                coincidences["mh_n" + suffix] = 1
+        yield coincidences
+        carry = singles[count:]
+        chunk = next_chunk
+
+
+def resorted_name(full_out_name: str, out_directory: str = None) -> str:
+    """Binary file of the coincidences re-sorted from the singles of a run."""
+    out_base = (
+        os.path.join(out_directory, os.path.basename(full_out_name))
+        if out_directory
+        else full_out_name
+    )
+    return out_base + RESORTED_SUFFIX + DATA_EXTENSION
+
+
+def resort_run(
+    petsys_commands: Commands,
+    full_out_name: str,
+    out_directory: str = None,
+    window_ns: float = COINCIDENCE_WINDOW,
+    rules: CoincidenceRules = None,
+) -> int:
+    """Build the coincidences of a run from its singles output, without the
+    converter. Returns the number of coincidences written."""
+    yaml_dict = petsys_commands.dictionary
+    assert (
+        yaml_dict["data_type"] == "singles"
+    ), "Coincidences can only be re-sorted from 'singles' output"
+    assert binary_output(yaml_dict), "Re-sorting needs binary output"
+    if rules is None:
+        rules = CoincidenceRules.from_yaml(yaml_dict)
+    dtype = record_dtype("singles", yaml_dict["data_compact"])
+    out_dtype = record_dtype("coincidence", yaml_dict["data_compact"])
+    processed_name = petsys_commands.processed_name(full_out_name, out_directory)
+    out_path = resorted_name(full_out_name, out_directory)
+    written = 0
+    with open(out_path + ".tmp", "wb") as f:
+        for coincidences in build_coincidences(
+            _read_singles(data_files(processed_name), dtype),
+            out_dtype,
+            rules,
+            window_ns,
+        ):
+            coincidences.tofile(f)
+            written += coincidences.size
+    os.replace(out_path + ".tmp", out_path)
+    print(f"{written} coincidences re-sorted into {out_path}")
+    return written
@@ -1,9 +1,16 @@
-from typing import Dict, Any, Tuple
-
-from src.settings import BiasSettings, DiscSettings
-from .reader import read_bias_map
+from typing import TYPE_CHECKING, Dict, Any, Tuple
 import os
 
+# pandas and numpy are only loaded by the commands using the settings
+if TYPE_CHECKING:
+    from src.settings import BiasSettings, DiscSettings
+
+MOTORS_ID = {
+    "motorX": 1,
+    "motorY": 2,
+    "motorZ": 3,
+}
+
 
 class MotorConfig:
     def __init__(self, config: Dict[str, Any], while_timer: int = 300) -> None:
@@ -22,12 +29,13 @@ class MotorConfig:
 class ScanConfig:
     def __init__(
         self,
-        bias_settings: BiasSettings,
-        disc_settings: DiscSettings,
+        bias_settings: "BiasSettings",
+        disc_settings: "DiscSettings",
         yaml_dict: Dict[str, Any],
         log_file: str,
         iterables: list,
         motors: list = None,
+        sweep_motor=None,
     ) -> None:
         self.bias_settings = bias_settings
         self.disc_settings = disc_settings
@@ -35,20 +43,29 @@ class ScanConfig:
         self.log_file = log_file
         self.iterables = iterables
         self.motors = motors
+        # motor swept at constant speed during each acquisition (continuous scan)
+        self.sweep_motor = sweep_motor
 
 
 def get_ref_params(yaml_dict: Dict[str, Any]) -> Tuple[list, list]:
-    bias_map_dict = read_bias_map(yaml_dict["bias_file"])
+    from src.reader import BiasMap
+
+    bias_map = BiasMap.load(yaml_dict["bias_file"])
     FEM = yaml_dict["FEM"]
     FEBD = yaml_dict["FEBD"]
     BIAS_board = yaml_dict["BIAS_board"]
-    # ref detector if there is some
+    # ref detector if there is some, on one port or a list of ports
     ref_det_febd = yaml_dict["ref_det_febd"]
     if ref_det_febd != -1:
+        ports = ref_det_febd if isinstance(ref_det_febd, list) else [ref_det_febd]
         # bias_params: list of tuples consisting of [(slotID, channelID)]
-        bias_params = bias_map_dict[FEBD][BIAS_board][ref_det_febd]
+        bias_params = [
+            tuple(pair) for pair in bias_map.channels(FEBD, BIAS_board, ports).tolist()
+        ]
         num_ASICs = 2 if FEM == "FEM128" else 4
-        disc_params = [ref_det_febd * num_ASICs, ref_det_febd * num_ASICs + 1]
+        disc_params = [
+            chip for port in ports for chip in [port * num_ASICs, port * num_ASICs + 1]
+        ]
         return bias_params, disc_params
     else:
         return [], []
@@ -81,6 +98,12 @@ def validate_yaml_dict(yaml_dict: Dict[str, Any]) -> None:
         isinstance(i, int) for i in yaml_dict["ref_det_ths"]
     ), "Todos los elementos en ref_det_ths deben ser flotantes"
     assert isinstance(yaml_dict["ref_det_ths"], list), "vth_t1 debe ser una lista"
+    ref_det_febd = yaml_dict["ref_det_febd"]
+    assert (isinstance(ref_det_febd, int) and not isinstance(ref_det_febd, bool)) or (
+        isinstance(ref_det_febd, list)
+        and ref_det_febd
+        and all(isinstance(i, int) and not isinstance(i, bool) for i in ref_det_febd)
+    ), "ref_det_febd debe ser un int o una lista de ints"
     assert yaml_dict["mode"] in ["qdc", "tot"], "mode debe ser 'qdc' o 'tot'"
     assert yaml_dict["hw_trigger"] in [
         True,
@@ -149,6 +172,139 @@ def validate_yaml_dict(yaml_dict: Dict[str, Any]) -> None:
     # Validate number of motors
     if "num_motors" in yaml_dict:
         assert yaml_dict["num_motors"] in [1, 2, 3], "'num_motors' should be 1, 2, or 3"
+    # Validate output striping and disk guard parameters
+    for key in ["raw_directories", "processed_directories"]:
+        if key in yaml_dict:
+            assert isinstance(yaml_dict[key], list), f"'{key}' should be a list"
+            assert all(
+                isinstance(d, str) for d in yaml_dict[key]
+            ), f"All elements in '{key}' should be strings"
+    for key in ["expected_rate", "max_write_rate"]:
+        if key in yaml_dict:
+            assert isinstance(
+                yaml_dict[key], (int, float)
+            ), f"'{key}' should be a number"
+            assert yaml_dict[key] >= 0, f"'{key}' should be >= 0"
+    if "min_rate_fraction" in yaml_dict:
+        assert isinstance(
+            yaml_dict["min_rate_fraction"], (int, float)
+        ), "'min_rate_fraction' should be a number"
+        assert (
+            0 <= yaml_dict["min_rate_fraction"] <= 1
+        ), "'min_rate_fraction' should be between 0 and 1"
+    # Validate live stream parameters
+    for key in ["stream_slots", "stream_chunk"]:
+        if key in yaml_dict:
+            assert (
+                isinstance(yaml_dict[key], int) and yaml_dict[key] > 0
+            ), f"'{key}' should be a positive integer"
+    # Validate threshold multiplexing parameters
+    if yaml_dict.get("multiplex_threshold"):
+        assert yaml_dict["multiplex_threshold"] in [
+            "vth_t1",
+            "vth_t2",
+            "vth_e",
+        ], "'multiplex_threshold' should be 'vth_t1', 'vth_t2' or 'vth_e'"
+        assert (
+            len(yaml_dict[yaml_dict["multiplex_threshold"]]) > 1
+        ), "The multiplexed threshold list should have more than one value"
+    if "multiplex_strategy" in yaml_dict:
+        assert yaml_dict["multiplex_strategy"] in [
+            "channel",
+            "chip",
+        ], "'multiplex_strategy' should be 'channel' or 'chip'"
+    # Validate bias sweep parameters
+    if "bias_sweep" in yaml_dict:
+        assert isinstance(
+            yaml_dict["bias_sweep"], bool
+        ), "'bias_sweep' should be a boolean"
+    if "bias_ramp" in yaml_dict:
+        assert yaml_dict["bias_ramp"] in [
+            "up",
+            "down",
+            "serpentine",
+        ], "'bias_ramp' should be 'up', 'down' or 'serpentine'"
+    for key in ["settle_probe_time", "settle_tolerance"]:
+        if key in yaml_dict:
+            assert isinstance(
+                yaml_dict[key], (int, float)
+            ), f"'{key}' should be a number"
+            assert yaml_dict[key] > 0, f"'{key}' should be > 0"
+    if "settle_max_probes" in yaml_dict:
+        assert (
+            isinstance(yaml_dict["settle_max_probes"], int)
+            and yaml_dict["settle_max_probes"] >= 2
+        ), "'settle_max_probes' should be an integer >= 2"
+    # Validate archive parameters
+    if "archive" in yaml_dict:
+        assert yaml_dict["archive"] in [
+            "none",
+            "raw",
+            "all",
+        ], "'archive' should be 'none', 'raw' or 'all'"
+    if "archive_codec" in yaml_dict:
+        assert yaml_dict["archive_codec"] in [
+            "lzma",
+            "zlib",
+        ], "'archive_codec' should be 'lzma' or 'zlib'"
+    # Validate processing parameters
+    if "energy_window" in yaml_dict:
+        assert (
+            isinstance(yaml_dict["energy_window"], list)
+            and len(yaml_dict["energy_window"]) == 2
+        ), "'energy_window' should be a list [min, max]"
+        assert (
+            yaml_dict["energy_window"][0] < yaml_dict["energy_window"][1]
+        ), "'energy_window' min should be lower than max"
+    if yaml_dict.get("calibration_file"):
+        assert os.path.isfile(
+            yaml_dict["calibration_file"]
+        ), "'calibration_file' does not exist"
+    if "decimation_seed" in yaml_dict:
+        assert isinstance(
+            yaml_dict["decimation_seed"], int
+        ), "'decimation_seed' should be an int"
+    if "process_workers" in yaml_dict:
+        assert isinstance(
+            yaml_dict["process_workers"], int
+        ), "'process_workers' should be an int"
+        assert yaml_dict["process_workers"] >= 1, "'process_workers' should be >= 1"
+    if "text_to_binary" in yaml_dict:
+        assert isinstance(
+            yaml_dict["text_to_binary"], bool
+        ), "'text_to_binary' should be True or False"
+    if "text_workers" in yaml_dict:
+        assert (
+            isinstance(yaml_dict["text_workers"], int)
+            and yaml_dict["text_workers"] >= 1
+        ), "'text_workers' should be an int >= 1"
+    if "report_energy_range" in yaml_dict:
+        assert (
+            isinstance(yaml_dict["report_energy_range"], list)
+            and len(yaml_dict["report_energy_range"]) == 2
+        ), "'report_energy_range' should be a list [min, max]"
+    # Validate metrics parameters
+    if "metrics_port" in yaml_dict:
+        assert isinstance(
+            yaml_dict["metrics_port"], int
+        ), "'metrics_port' should be an int"
+        assert (
+            0 <= yaml_dict["metrics_port"] < 65536
+        ), "'metrics_port' should be a valid port"
+    # Validate continuous scan parameters
+    if yaml_dict.get("continuous_motor"):
+        assert yaml_dict["continuous_motor"] in [
+            "motorX",
+            "motorY",
+            "motorZ",
+        ], "'continuous_motor' should be motorX, motorY or motorZ"
+        assert (
+            yaml_dict["continuous_motor"] in yaml_dict
+        ), f"'{yaml_dict['continuous_motor']}' parameters are missing"
+        assert isinstance(
+            yaml_dict["continuous_bin"], float
+        ), "'continuous_bin' should be a float"
+        assert yaml_dict["continuous_bin"] > 0, "'continuous_bin' should be > 0"
     # Validate motor parameters
     for motor in ["motorX", "motorY", "motorZ"]:
         if motor in yaml_dict:
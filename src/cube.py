@@ -0,0 +1,115 @@
+import json
+import os
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from src.config import MotorConfig
+from src.motor_control import array_of_positions
+from src.plan import SETTINGS_KEYS, ScanPlan, ScanPoint, get_iterables
+
+QUANTITIES = ["raw_bytes", "lost_percent", "live_time", "counts", "rate"]
+CUBE_SUFFIX = "_cube.dat"
+SIDECAR_SUFFIX = "_cube.json"
+
+
+def cube_axes(yaml_dict: Dict[str, Any], plan: ScanPlan) -> List[Tuple[str, list]]:
+    """Axes of the scan: stepped motor positions, iteration and settings."""
+    axes = []
+    for name in plan.motor_names:
+        config = MotorConfig(yaml_dict[name])
+        positions = array_of_positions(config.start, config.end, config.step_size)
+        axes.append((name, [float(position) for position in positions]))
+    for name, values in zip(["iteration"] + SETTINGS_KEYS, get_iterables(yaml_dict)):
+        axes.append((name, [float(value) for value in values]))
+    return axes
+
+
+class ResultCube:
+    """Per-point results of a scan in a memory-mapped N-D array.
+
+    The array has one axis per motor position, iteration and setting, plus a
+    last axis with the QUANTITIES; points not measured yet are NaN. It lives
+    in <out_name>_cube.dat with the axes in <out_name>_cube.json, is flushed
+    after every update so it can be read during the scan, and is reopened
+    as it is when a scan with the same axes is resumed.
+    """
+
+    def __init__(self, path_base: str, axes: List[Tuple[str, list]] = None) -> None:
+        self.data_file = path_base + CUBE_SUFFIX
+        self.sidecar_file = path_base + SIDECAR_SUFFIX
+        sidecar = None
+        if os.path.isfile(self.sidecar_file) and os.path.isfile(self.data_file):
+            with open(self.sidecar_file) as f:
+                sidecar = json.load(f)
+        mode = "r+"
+        if axes is None:
+            # reader of an existing cube, possibly while the scan runs
+            assert sidecar is not None, f"No result cube in {self.data_file}"
+            axes = sidecar["axes"]
+            mode = "r"
+        self.axes = [(name, list(values)) for name, values in axes]
+        self.quantities = QUANTITIES
+        shape = tuple(len(values) for _, values in self.axes) + (len(QUANTITIES),)
+        if sidecar is not None and [list(a) for a in sidecar["axes"]] == [
+            list(a) for a in self.axes
+        ]:
+            self.data = np.memmap(
+                self.data_file, dtype=np.float64, mode=mode, shape=shape
+            )
+        else:
+            self.data = np.memmap(
+                self.data_file, dtype=np.float64, mode="w+", shape=shape
+            )
+            self.data[:] = np.nan
+            self.data.flush()
+            with open(self.sidecar_file + ".tmp", "w") as f:
+                json.dump({"axes": self.axes, "quantities": QUANTITIES}, f, indent=1)
+            os.replace(self.sidecar_file + ".tmp", self.sidecar_file)
+        self.points_by_name = {}
+
+    @classmethod
+    def for_scan(cls, yaml_dict: Dict[str, Any], plan: ScanPlan) -> "ResultCube":
+        cube = cls(
+            os.path.join(yaml_dict["out_directory"], plan.out_name),
+            cube_axes(yaml_dict, plan),
+        )
+        cube.points_by_name = {point.full_out_name: point for point in plan.points}
+        return cube
+
+    def index(self, point: ScanPoint) -> tuple:
+        """Position of a scan point in the cube (without the quantity axis)."""
+        values = list(point.positions) + [
+            point.iteration,
+            point.over_voltage,
+            point.vth_t1,
+            point.vth_t2,
+            point.vth_e,
+        ]
+        return tuple(
+            int(np.argmin(np.abs(np.array(axis) - value)))
+            for (_, axis), value in zip(self.axes, values)
+        )
+
+    def update(self, point: ScanPoint, **values: float) -> None:
+        """Write some quantities of a point and flush them to disk."""
+        index = self.index(point)
+        for quantity, value in values.items():
+            self.data[index + (self.quantities.index(quantity),)] = value
+        self.data.flush()
+
+    def update_run(self, full_out_name: str, **values: float) -> None:
+        """update() for the run written to `full_out_name` (any directory)."""
+        point = self.points_by_name.get(os.path.basename(full_out_name))
+        if point is not None:
+            self.update(point, **values)
+
+    def value(self, full_out_name: str, quantity: str) -> float:
+        point = self.points_by_name.get(os.path.basename(full_out_name))
+        if point is None:
+            return np.nan
+        return float(self.data[self.index(point) + (self.quantities.index(quantity),)])
+
+    def get(self, quantity: str) -> np.ndarray:
+        """N-D view of one quantity over the scan axes."""
+        return self.data[..., self.quantities.index(quantity)]
@@ -0,0 +1,126 @@
+import os
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+from src.records import binary_output, data_files, yaml_record_dtype
+from src.settings import Commands
+
+CHUNK_RECORDS = 1 << 20  # records held in memory at a time
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, spreads the bits of x uniformly."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def grouped(dtype: np.dtype) -> bool:
+    """If the records are the hits of groups (group output with mh_n/mh_j)."""
+    return "mh_j" in dtype.names
+
+
+def keep_mask(
+    records: np.ndarray,
+    fraction: int,
+    seed: int = 0,
+    energy_window: Tuple[float, float] = None,
+) -> np.ndarray:
+    """Records kept by the decimation.
+
+    An event is kept if the hash of its first time and channel falls in the
+    first `fraction` percent, so the selection is the same whatever the
+    chunking, file splitting or order of the records. With an energy window
+    every event of the record must be inside it. The hits of a group are
+    kept or dropped together, by the hash of its first hit and the energy of
+    all of them; the records must start with the first hit of a group.
+    """
+    suffix = "1" if "time1" in records.dtype.names else ""
+    key = records["time" + suffix].astype(np.uint64) ^ (
+        records["channel_id" + suffix].astype(np.uint64) << np.uint64(40)
+    )
+    mask = _mix(key ^ np.uint64(seed)) % np.uint64(100) < np.uint64(fraction)
+    inside = np.ones(records.size, dtype=bool)
+    if energy_window is not None:
+        for name in records.dtype.names:
+            if name.startswith("energy"):
+                inside &= (records[name] >= energy_window[0]) & (
+                    records[name] <= energy_window[1]
+                )
+    if not grouped(records.dtype) or records.size == 0:
+        return mask & inside
+    starts = records["mh_j"] == 0
+    starts[0] = True
+    first_hits = np.flatnonzero(starts)
+    group_kept = mask[first_hits] & np.logical_and.reduceat(inside, first_hits)
+    return group_kept[np.cumsum(starts) - 1]
+
+
+def decimate_file(
+    file_path: str,
+    out_path: str,
+    dtype: np.dtype,
+    fraction: int,
+    seed: int = 0,
+    energy_window: Tuple[float, float] = None,
+) -> Tuple[int, int]:
+    """Copy the kept records of a binary file chunk by chunk.
+
+    Returns the number of records read and kept.
+    """
+    read, kept = 0, 0
+    carry = np.empty(0, dtype=dtype)
+    with open(file_path, "rb") as f_in, open(out_path, "wb") as f_out:
+        while True:
+            chunk = np.fromfile(f_in, dtype=dtype, count=CHUNK_RECORDS)
+            records = np.concatenate([carry, chunk]) if carry.size else chunk
+            if records.size == 0:
+                break
+            carry = records[:0]
+            if grouped(dtype) and chunk.size:
+                # the last group may go on in the next chunk
+                first_hits = np.flatnonzero(records["mh_j"] == 0)
+                last = first_hits[-1] if first_hits.size else 0
+                records, carry = records[:last], records[last:]
+            selected = records[keep_mask(records, fraction, seed, energy_window)]
+            selected.tofile(f_out)
+            read += records.size
+            kept += selected.size
+    return read, kept
+
+
+def decimation_enabled(yaml_dict: Dict[str, Any]) -> bool:
+    return yaml_dict["fraction"] < 100 or "energy_window" in yaml_dict
+
+
+def decimate_run(
+    petsys_commands: Commands, full_out_name: str, out_directory: str = None
+) -> None:
+    """Reduce the processed output of a run in place to `fraction` percent of
+    its events, within `energy_window` if given."""
+    yaml_dict = petsys_commands.dictionary
+    if not decimation_enabled(yaml_dict):
+        return
+    if not binary_output(yaml_dict):
+        print("Decimation needs binary output, processed output kept as is.")
+        return
+    dtype = yaml_record_dtype(yaml_dict)
+    processed_name = petsys_commands.processed_name(full_out_name, out_directory)
+    read, kept = 0, 0
+    for file_path in data_files(processed_name):
+        file_read, file_kept = decimate_file(
+            file_path,
+            file_path + ".tmp",
+            dtype,
+            yaml_dict["fraction"],
+            yaml_dict.get("decimation_seed", 0),
+            yaml_dict.get("energy_window"),
+        )
+        os.replace(file_path + ".tmp", file_path)
+        read += file_read
+        kept += file_kept
+    if read:
+        print(f"Decimation kept {kept} of {read} events ({100 * kept / read:.1f}%)")
@@ -0,0 +1,62 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List
+
+MAX_CONCURRENT_TASKS = 4  # a point runs at most move, settings, log and settle at once
+
+
+class TaskGraph:
+    """Tasks with dependencies, each started in a thread as soon as the tasks it
+    depends on are done.
+
+    Task names are unique strings; a dependency on a name never added counts as
+    done. The first task raising stops the graph: nothing else is started, the
+    running tasks are waited for and the exception is raised by run().
+    """
+
+    def __init__(self) -> None:
+        self.tasks: Dict[str, Callable[[], None]] = {}
+        self.dependencies: Dict[str, List[str]] = {}
+
+    def add(
+        self, name: str, function: Callable[[], None], after: List[str] = ()
+    ) -> str:
+        assert name not in self.tasks, f"Task '{name}' added twice"
+        self.tasks[name] = function
+        self.dependencies[name] = [dep for dep in after if dep is not None]
+        return name
+
+    def run(self, max_workers: int = MAX_CONCURRENT_TASKS) -> None:
+        # number of unfinished dependencies of every task and their dependents
+        waiting = {name: 0 for name in self.tasks}
+        dependents: Dict[str, List[str]] = {name: [] for name in self.tasks}
+        for name, deps in self.dependencies.items():
+            for dep in deps:
+                if dep in self.tasks:
+                    waiting[name] += 1
+                    dependents[dep].append(name)
+        # tasks start in the order they were added
+        ready = [name for name in self.tasks if waiting[name] == 0]
+        running: Dict[Future, str] = {}
+        started = 0
+        error = None
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while ready or running:
+                if error is None:
+                    for name in ready:
+                        running[pool.submit(self.tasks[name])] = name
+                    started += len(ready)
+                ready = []
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is not None and error is None:
+                        error = future.exception()
+                    for dependent in dependents[name]:
+                        waiting[dependent] -= 1
+                        if waiting[dependent] == 0:
+                            ready.append(dependent)
+        if error is not None:
+            raise error
+        assert started == len(self.tasks), "Cyclic dependencies between the tasks"
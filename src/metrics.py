@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+METRICS_PREFIX = "acquire_petsys_"
+
+
+class ScanMetrics:
+    """Live status of a running scan.
+
+    The status is written as JSON to `status_file` on every update and, if
+    `port` is not 0, served in Prometheus text format on
+    http://localhost:<port>/metrics (JSON on any other path).
+    """
+
+    def __init__(self, status_file: str, port: int = 0) -> None:
+        self.status_file = status_file
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.status = {
+            "point_index": 0,
+            "total_points": 0,
+            "eta_seconds": 0.0,
+            "lost_percent": 0.0,
+            "retries": 0,
+            "raw_check_failures": 0,
+            "acquire_queue": 0,
+            "process_queue": 0,
+            "bytes_written": 0,
+            "acquisition_seconds": 0.0,
+            "duty_cycle": 0.0,
+            "motor_positions": {},
+        }
+        self.server = None
+        if port:
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            print(f"Scan metrics served on http://localhost:{port}/metrics")
+
+    def _handler(self):
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path == "/metrics":
+                    body = metrics.prometheus().encode()
+                    content_type = "text/plain; version=0.0.4"
+                else:
+                    body = json.dumps(metrics.snapshot()).encode()
+                    content_type = "application/json"
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass  # keep the scan console clean
+
+        return MetricsHandler
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Copy of the current status."""
+        with self.lock:
+            return json.loads(json.dumps(self.status))
+
+    def _write(self, values: Dict[str, Any]) -> None:
+        """Set status values and write the status file, with the lock held."""
+        self.status.update(values)
+        elapsed = time.time() - self.start_time
+        if elapsed > 0:
+            self.status["duty_cycle"] = self.status["acquisition_seconds"] / elapsed
+        self.status["last_update"] = time.time()
+        with open(self.status_file + ".tmp", "w") as f:
+            json.dump(self.status, f, indent=1)
+        os.replace(self.status_file + ".tmp", self.status_file)
+
+    def update(self, **values) -> None:
+        """Set status values and write the status file."""
+        with self.lock:
+            self._write(values)
+
+    def increment(self, key: str, amount: float = 1) -> None:
+        """Add `amount` to a status value."""
+        # read and written under one lock, concurrent increments all count
+        with self.lock:
+            self._write({key: self.status[key] + amount})
+
+    def prometheus(self) -> str:
+        """Status in Prometheus text exposition format."""
+        status = self.snapshot()
+        lines = []
+        for key, value in status.items():
+            if key == "motor_positions":
+                lines.append(f"# TYPE {METRICS_PREFIX}motor_position gauge")
+                for motor_name, position in value.items():
+                    lines.append(
+                        f'{METRICS_PREFIX}motor_position{{motor="{motor_name}"}} {position}'
+                    )
+            elif isinstance(value, (int, float)):
+                metric_type = (
+                    "counter" if key in ["retries", "raw_check_failures"] else "gauge"
+                )
+                lines.append(f"# TYPE {METRICS_PREFIX}{key} {metric_type}")
+                lines.append(f"{METRICS_PREFIX}{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> None:
+        """Stop the HTTP endpoint."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -1,18 +1,139 @@
 import serial
 import sys
 import glob
-import numpy as np
 import logging
 import time
+import math
 import os
+from typing import TYPE_CHECKING
 
 from src.config import MotorConfig
 
+# numpy is only loaded when the positions are computed
+if TYPE_CHECKING:
+    import numpy as np
+
 # Constants
 STEPS_PER_REV = 200  # for a 1.8° stepper motor
 BAUDRATE = 9600
 TIMEOUT = 5
 __WHILE_TIMEOUT = 300  # 5 minutes timeout for while loops unused
+MOTION_TIMEOUT_FACTOR = 1.5  # safety factor applied to the predicted motion time
+# seconds added to the predicted motion time (serial latency, end-stop back-off)
+MOTION_TIMEOUT_MARGIN = 10
+
+
+def position_to_steps(
+    position: float, motor_type: str, relation: float, microstep: int
+) -> int:
+    """Convert the position (mm or degrees) into absolute steps."""
+    if motor_type == "linear":
+        target_revs = position / relation
+    elif motor_type == "rotatory":
+        degrees_per_rev = 360
+        target_revs = (
+            position / degrees_per_rev * relation
+        )  # looks like there is a 10:1 gear ratio in the rotor motor
+    else:
+        raise ValueError(f"Motor type {motor_type} unknown.")
+    return int(target_revs * STEPS_PER_REV * microstep)
+
+
+def steps_to_position(
+    steps: int, motor_type: str, relation: float, microstep: int
+) -> float:
+    """Convert absolute steps into the position (mm or degrees)."""
+    revs = steps / (STEPS_PER_REV * microstep)
+    if motor_type == "linear":
+        return revs * relation
+    elif motor_type == "rotatory":
+        return revs * 360 / relation
+    raise ValueError(f"Motor type {motor_type} unknown.")
+
+
+def array_of_positions(start: float, end: float, step_size: float) -> "np.ndarray":
+    """Create an array of absolute positions (mm or degrees)."""
+    # numpy is slow to import, interactive motor commands don't need it
+    import numpy as np
+
+    if start == end:
+        return np.array([start])
+    return np.arange(start, end + step_size, step_size)
+
+
+def trapezoidal_move_time(steps: int, max_speed: float, acceleration: float) -> float:
+    """Predict the duration (s) of a move of `steps` with a trapezoidal profile.
+
+    AccelStepper accelerates at `acceleration` (steps/s^2) up to `max_speed`
+    (steps/s), cruises and decelerates again. Moves too short to reach
+    `max_speed` follow a triangular profile.
+    """
+    steps = abs(steps)
+    if steps == 0:
+        return 0.0
+    ramp_steps = max_speed**2 / acceleration  # steps spent accelerating + decelerating
+    if steps <= ramp_steps:
+        return 2 * math.sqrt(steps / acceleration)
+    return 2 * max_speed / acceleration + (steps - ramp_steps) / max_speed
+
+
+class MotionModel:
+    """Motion-time model of one axis built from its MotorConfig.
+
+    Steps are driver (micro)steps, the same units used by MOVE and MOVETO, so
+    `microstep` enters through the position to steps conversion. The firmware
+    runs every move with AccelStepper.run(), which ramps to `max_speed`;
+    `speed` is only used for constant-velocity moves.
+    """
+
+    def __init__(self, motor_config: MotorConfig) -> None:
+        self.motor_type = motor_config.type
+        self.relation = motor_config.relation
+        self.microstep = motor_config.microstep
+        self.speed = motor_config.speed
+        self.max_speed = motor_config.max_speed
+        self.acceleration = motor_config.acceleration
+
+    def steps(self, position: float) -> int:
+        """Absolute steps of a position (mm or degrees)."""
+        return position_to_steps(
+            position, self.motor_type, self.relation, self.microstep
+        )
+
+    def position(self, steps: int) -> float:
+        """Position (mm or degrees) of absolute steps."""
+        return steps_to_position(steps, self.motor_type, self.relation, self.microstep)
+
+    def move_time(self, steps: int) -> float:
+        """Predicted time (s) to move `steps` relative steps."""
+        return trapezoidal_move_time(steps, self.max_speed, self.acceleration)
+
+    def steps_at(self, elapsed: float, steps: int) -> float:
+        """Predicted steps travelled `elapsed` seconds into a move of `steps`."""
+        total = abs(steps)
+        duration = self.move_time(total)
+        if elapsed <= 0 or total == 0:
+            return 0.0
+        if elapsed >= duration:
+            return float(steps)
+        # peak speed is max_speed unless the profile is triangular
+        peak_speed = min(self.max_speed, math.sqrt(total * self.acceleration))
+        ramp_time = peak_speed / self.acceleration
+        if elapsed < ramp_time:
+            travelled = self.acceleration * elapsed**2 / 2
+        elif elapsed < duration - ramp_time:
+            travelled = peak_speed * ramp_time / 2 + peak_speed * (elapsed - ramp_time)
+        else:
+            travelled = total - self.acceleration * (duration - elapsed) ** 2 / 2
+        return math.copysign(travelled, steps)
+
+    def constant_speed_time(self, steps: int) -> float:
+        """Time (s) to move `steps` at the constant `speed`."""
+        return abs(steps) / self.speed
+
+    def timeout(self, steps: int) -> float:
+        """Timeout (s) for a move command: predicted time plus margin."""
+        return self.move_time(steps) * MOTION_TIMEOUT_FACTOR + MOTION_TIMEOUT_MARGIN
 
 
 class MotorControl:
@@ -68,7 +189,9 @@ class MotorControl:
         self.motor_end = motor_config.end
         self.motor_step_size = motor_config.step_size
         self.while_timeout = motor_config.while_timeout
+        self.motion_model = MotionModel(motor_config)
         self.current_position = self.motor_start  # Initialize at start position
+        self.current_steps = None  # Absolute steps, unknown until homed
         self.total_steps_required = 0
         self.steps_moved = 0
         self.motor_name = motor_name
@@ -77,16 +200,30 @@ class MotorControl:
         self.set_speed(motor_config.speed)
         self.set_max_speed(motor_config.max_speed)
 
-    def _write_command(self, command: bytes) -> None:
-        """Write a command to the serial port and wait for an 'F' response."""
+    def reconfigure(self, motor_config: MotorConfig) -> None:
+        """Apply the configuration of another scan keeping the homed position."""
+        current_steps = self.current_steps
+        self.configure_motor(motor_config, self.motor_name, self.motor_id)
+        self.current_steps = current_steps
+        if current_steps is not None:
+            self.current_position = self.motion_model.position(current_steps)
+
+    def _write_command(self, command: bytes, timeout: float = None) -> None:
+        """Write a command to the serial port and wait for an 'F' response.
+
+        `timeout` defaults to the configured while_timeout; motion commands
+        pass the one predicted by the motion model.
+        """
+        if timeout is None:
+            timeout = self.while_timeout
         try:
             self.ser.write(command)
-            self.logger.debug(f"Sent command: {command}")
+            self.logger.debug(f"Sent command: {command} (timeout {timeout:.1f} s)")
             # Wait for an 'F', make it sequential
             start_time = time.time()
             response = ""
             while not response.endswith("F"):
-                if time.time() - start_time > self.while_timeout:
+                if time.time() - start_time > timeout:
                     self.logger.error("Timeout waiting for response")
                     raise TimeoutError("Timeout waiting for response from motor")
                 response += self.ser.read_until(b"F").decode().strip()
@@ -114,12 +251,14 @@ class MotorControl:
         """Set the maximum speed."""
         command = self._format_command("SET_MAX_SPEED", self.motor_id, max_speed)
         self._write_command(command)
+        self.motion_model.max_speed = max_speed
         self.logger.info(f"Motor {self.motor_name} max speed set to {max_speed}")
 
     def set_acceleration(self, acceleration: int) -> None:
         """Set the acceleration."""
         command = self._format_command("SET_ACCEL", self.motor_id, acceleration)
         self._write_command(command)
+        self.motion_model.acceleration = acceleration
         self.logger.info(f"Motor {self.motor_name} acceleration set to {acceleration}")
 
     def move_motor(self, direction: int, steps: int) -> None:
@@ -128,13 +267,22 @@ class MotorControl:
             f"Moving {self.motor_name} {'forward' if direction > 0 else 'backward'} by {steps} steps..."
         )
         command = self._format_command("MOVE", self.motor_id, direction, steps)
-        self._write_command(command)
+        self._write_command(command, self.motion_model.timeout(steps))
+        if self.current_steps is not None:
+            self.current_steps += direction * steps
 
     def move_motor_to(self, steps: int) -> None:
         """Send move to command (mm or degrees) to the specified motor."""
         print(f"Moving {self.motor_name} to {steps} steps...")
         command = self._format_command("MOVETO", self.motor_id, steps)
-        self._write_command(command)
+        # Without a known origin the move length is unknown, keep the flat timeout
+        if self.current_steps is None:
+            self._write_command(command)
+        else:
+            self._write_command(
+                command, self.motion_model.timeout(steps - self.current_steps)
+            )
+        self.current_steps = steps
 
     def stop_motor(self) -> None:
         """Send stop command to a specified motor."""
@@ -152,8 +300,10 @@ class MotorControl:
             "MOVE", self.motor_id, -1, 1000000
         )  # Move motor to the home position
         print(f"Searching for {self.motor_name} to HOME position...")
+        # The distance to the end-stop is unknown, keep the flat timeout
         self._write_command(command)
         self.current_position = 0.0
+        self.current_steps = 0
         self.steps_moved = 0  # Reset step count after moving to home position
 
         # Send the SET_ZERO command to set absolute position to 0
@@ -172,28 +322,13 @@ class MotorControl:
     def position_to_steps(self, position: float) -> int:
         """Convert the position (mm or degrees) into steps."""
         self.current_position = position  # Update current position
-        if self.motor_type == "linear":
-            target_revs = position / self.motor_relation
-        elif self.motor_type == "rotatory":
-            degrees_per_rev = 360
-            target_revs = (
-                position / degrees_per_rev * self.motor_relation
-            )  # looks like there is a 10:1 gear ratio in the rotor motor
-        else:
-            raise ValueError(f"Motor type {self.motor_type} unknown.")
-        target_steps = int(target_revs * STEPS_PER_REV * self.motor_microstep)
-        return target_steps
+        return self.motion_model.steps(position)
 
-    def array_of_positions(self) -> np.array:
+    def array_of_positions(self) -> "np.ndarray":
         """Create an array of absolute positions (mm or degrees)."""
-        if self.motor_start == self.motor_end:
-            return np.array([self.motor_start])
-        positions = np.arange(
-            self.motor_start,
-            self.motor_end + self.motor_step_size,
-            self.motor_step_size,
+        return array_of_positions(
+            self.motor_start, self.motor_end, self.motor_step_size
         )
-        return positions
 
     def close(self) -> None:
         """Close the serial connection."""
@@ -0,0 +1,205 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+from src.cli import load_yaml
+from src.metrics import ScanMetrics
+from src.plan import ScanPlan, compile_scan, validate_plan
+from src.utils import format_duration
+
+# every system is scanned by its own scan process, so each has its own
+# working directory (petsys_directory) and nothing is shared but the files
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATUS_PERIOD = 5.0  # seconds between updates of the combined status
+MULTI_STATUS_FILE = "multi_status.json"
+# status values added over the systems, the others take the worst system
+SUMMED_KEYS = [
+    "point_index",
+    "total_points",
+    "retries",
+    "raw_check_failures",
+    "acquire_queue",
+    "process_queue",
+    "bytes_written",
+]
+MAX_KEYS = ["eta_seconds", "lost_percent"]
+
+
+class SystemRun:
+    """One PETsys system of a multi-system run, validated and compiled."""
+
+    def __init__(self, yaml_file: str, yaml_dict: Dict[str, Any], plan: ScanPlan):
+        self.yaml_file = os.path.abspath(yaml_file)
+        self.yaml_dict = yaml_dict
+        self.plan = plan
+        self.name = yaml_dict["out_name"]
+        out_base = os.path.join(yaml_dict["out_directory"], yaml_dict["out_name"])
+        self.status_file = os.path.abspath(out_base + "_status.json")
+        self.output_file = out_base + "_multi.log"
+        self.process = None
+
+    def start(self, mode: str) -> None:
+        """Start the scan of the system in its own process."""
+        if not os.path.isdir(self.yaml_dict["out_directory"]):
+            os.makedirs(self.yaml_dict["out_directory"])
+        if os.path.isfile(self.status_file):
+            os.remove(self.status_file)  # from a previous scan
+        with open(self.output_file, "w") as output:
+            self.process = subprocess.Popen(
+                # the log files were confirmed by the controller: a log
+                # still there was kept, so it is appended to
+                [
+                    sys.executable,
+                    "-m",
+                    "src.scan_main",
+                    self.yaml_file,
+                    "-m",
+                    mode,
+                    "--append-log",
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=output,
+                stderr=subprocess.STDOUT,
+                text=True,
+                env=self._environment(),
+            )
+
+    @staticmethod
+    def _environment() -> Dict[str, str]:
+        """Environment of a scan process, with this package importable."""
+        pythonpath = os.environ.get("PYTHONPATH")
+        return dict(
+            os.environ,
+            PYTHONPATH=PACKAGE_ROOT + (os.pathsep + pythonpath if pythonpath else ""),
+        )
+
+    def status(self) -> Dict[str, Any]:
+        """Last status written by the scan of the system, empty if none yet."""
+        try:
+            with open(self.status_file) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def state(self) -> str:
+        if self.process is None:
+            return "waiting"
+        returncode = self.process.poll()
+        if returncode is None:
+            return "running"
+        return "done" if returncode == 0 else f"failed ({returncode})"
+
+
+def load_systems(yaml_files: List[str]) -> List[SystemRun]:
+    """Read, validate and compile every system before any of them starts."""
+    systems = []
+    for yaml_file in yaml_files:
+        yaml_dict = load_yaml(yaml_file)
+        plan = compile_scan(yaml_dict)
+        validate_plan(plan, yaml_dict)
+        systems.append(SystemRun(yaml_file, yaml_dict, plan))
+
+    # the systems run at the same time, they cannot share what they write
+    for key in ["config_directory", "petsys_directory"]:
+        values = [os.path.abspath(system.yaml_dict[key]) for system in systems]
+        assert len(set(values)) == len(
+            values
+        ), f"Two systems use the same {key}, they would overwrite each other"
+    log_files = [os.path.abspath(system.plan.log_file) for system in systems]
+    assert len(set(log_files)) == len(
+        log_files
+    ), "Two systems write the same log file, change their out_name"
+    names = [system.name for system in systems]
+    assert len(set(names)) == len(names), "Two systems have the same out_name"
+    motor_ports = [
+        system.yaml_dict["COM_port"]
+        for system in systems
+        if system.yaml_dict["flag_motor"]
+    ]
+    assert len(motor_ports) <= 1 or (
+        all(motor_ports) and len(set(motor_ports)) == len(motor_ports)
+    ), "Systems with motors need their own COM_port"
+    return systems
+
+
+def print_systems(systems: List[SystemRun]) -> None:
+    print(f"{len(systems)} systems scanned at the same time:")
+    for system in systems:
+        print(
+            f"  {system.name}: {len(system.plan.points)} points, "
+            f"{format_duration(system.plan.predicted_duration)}, "
+            f"petsys_directory {system.yaml_dict['petsys_directory']}"
+        )
+
+
+def combine_status(statuses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Status of all the systems as one scan: the counts are added, the ETA is
+    the one of the last system to finish."""
+    combined = {
+        key: sum(status.get(key, 0) for status in statuses) for key in SUMMED_KEYS
+    }
+    for key in MAX_KEYS:
+        combined[key] = max((status.get(key, 0.0) for status in statuses), default=0.0)
+    # the duty cycle of the combined status is the mean one of the systems
+    combined["acquisition_seconds"] = sum(
+        status.get("acquisition_seconds", 0.0) for status in statuses
+    ) / max(len(statuses), 1)
+    return combined
+
+
+def progress_line(systems: List[SystemRun], statuses: List[Dict[str, Any]]) -> str:
+    parts = []
+    for system, status in zip(systems, statuses):
+        state = system.state()
+        if state != "running":
+            parts.append(f"{system.name} {state}")
+            continue
+        part = f"{system.name} {status.get('point_index', 0)}/{len(system.plan.points)}"
+        if status.get("process_queue"):
+            part += f", {status['process_queue']} to process"
+        parts.append(part + f", ETA {format_duration(status.get('eta_seconds', 0))}")
+    return " | ".join(parts)
+
+
+def run_systems(
+    systems: List[SystemRun],
+    mode: str,
+    port: int = 0,
+    period: float = STATUS_PERIOD,
+) -> bool:
+    """Scan all the systems at the same time and follow them until they finish.
+
+    Each system writes its output to <out_name>_multi.log and its status as
+    usual; the combined status is written to multi_status.json (and served
+    on `port` if not 0). Returns if all the systems finished successfully.
+    """
+    metrics = ScanMetrics(os.path.abspath(MULTI_STATUS_FILE), port)
+    try:
+        for system in systems:
+            system.start(mode)
+            print(f"{system.name} started, output in {system.output_file}")
+        reported = set()
+        while True:
+            running = [s for s in systems if s.state() == "running"]
+            statuses = [system.status() for system in systems]
+            metrics.update(systems_running=len(running), **combine_status(statuses))
+            for system in systems:
+                state = system.state()
+                if state not in ["running", "waiting"] and system.name not in reported:
+                    reported.add(system.name)
+                    print(f"{system.name} {state}, output in {system.output_file}")
+            if not running:
+                break
+            print(progress_line(systems, statuses))
+            time.sleep(period)
+    except KeyboardInterrupt:
+        for system in systems:
+            if system.state() == "running":
+                system.process.terminate()
+        raise
+    finally:
+        metrics.close()
+    return all(system.state() == "done" for system in systems)
@@ -0,0 +1,153 @@
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from src.calibration import flat_channel_id
+from src.records import binary_output, data_files, yaml_record_dtype
+from src.settings import Commands, DiscSettings
+
+CHUNK_RECORDS = 1 << 20  # records counted at a time
+GROUPS_SUFFIX = "_groups.tsv"
+STRATEGIES = ["channel", "chip"]
+
+
+def assign_groups(
+    disc_df: pd.DataFrame, ref_chips: List[int], num_groups: int, strategy: str
+) -> np.ndarray:
+    """Group of every row of disc_settings.tsv, -1 for the reference detector.
+
+    'channel' interleaves the channels of every chip (channelID modulo the
+    number of groups), so each group samples every chip; 'chip' gives whole
+    ASICs to the groups in turn, for setups where the channels of a chip
+    are not equivalent.
+    """
+    chips = flat_channel_id(
+        disc_df["#portID"].to_numpy(np.int64),
+        disc_df["slaveID"].to_numpy(np.int64),
+        disc_df["chipID"].to_numpy(np.int64),
+        0,
+    )
+    if strategy == "channel":
+        groups = disc_df["channelID"].to_numpy(np.int64) % num_groups
+    else:
+        # rank of the chip among the chips of the setup
+        groups = np.unique(chips, return_inverse=True)[1] % num_groups
+    groups = np.where(disc_df["chipID"].isin(ref_chips).to_numpy(), -1, groups)
+    assert set(range(num_groups)) <= set(
+        groups.tolist()
+    ), f"Not enough channels for {num_groups} threshold groups with strategy '{strategy}'"
+    return groups
+
+
+def group_table_path(yaml_dict: Dict[str, Any]) -> str:
+    return os.path.join(
+        yaml_dict["out_directory"], yaml_dict["out_name"] + GROUPS_SUFFIX
+    )
+
+
+def setup_multiplexing(disc_settings: DiscSettings, yaml_dict: Dict[str, Any]) -> None:
+    """Give each channel group its threshold of the multiplexed list and write
+    the group table of the scan."""
+    key = yaml_dict.get("multiplex_threshold")
+    if not key:
+        return
+    thresholds = yaml_dict[key]
+    groups = assign_groups(
+        disc_settings.disc_df,
+        list(disc_settings.disc_ref_params),
+        len(thresholds),
+        yaml_dict.get("multiplex_strategy", "channel"),
+    )
+    disc_settings.set_group_thresholds(key, groups, thresholds)
+    table = disc_settings.disc_df[["#portID", "slaveID", "chipID", "channelID"]].copy()
+    table["group"] = groups
+    table[key] = disc_settings.disc_df[key]
+    if not os.path.isdir(yaml_dict["out_directory"]):
+        os.makedirs(yaml_dict["out_directory"])
+    table.to_csv(group_table_path(yaml_dict), index=False, sep="\t")
+    print(
+        f"{key} multiplexed in {len(thresholds)} channel groups: "
+        + ", ".join(f"{t} ({np.sum(groups == g)} ch)" for g, t in enumerate(thresholds))
+    )
+
+
+class GroupTable:
+    """Channel groups of a multiplexed scan as a lookup array indexed by the
+    absolute channel ID (-1 for channels in no group)."""
+
+    def __init__(self, table_file: str) -> None:
+        df = pd.read_csv(table_file, sep="\t")
+        self.key = df.columns[-1]
+        ids = flat_channel_id(
+            df["#portID"].to_numpy(np.int64),
+            df["slaveID"].to_numpy(np.int64),
+            df["chipID"].to_numpy(np.int64),
+            df["channelID"].to_numpy(np.int64),
+        )
+        groups = df["group"].to_numpy(np.int64)
+        self.num_groups = int(groups.max()) + 1
+        # the last entry is for channels beyond the table
+        self.lookup = np.full(int(ids.max()) + 2, -1, dtype=np.int64)
+        self.lookup[ids] = groups
+        self.channels = np.bincount(groups[groups >= 0], minlength=self.num_groups)
+        self.thresholds = [
+            int(df.loc[df["group"] == g, self.key].iloc[0])
+            for g in range(self.num_groups)
+        ]
+
+    def groups(self, channel_ids: np.ndarray) -> np.ndarray:
+        """Group of every channel ID."""
+        return self.lookup[np.minimum(channel_ids, self.lookup.size - 1)]
+
+
+def demultiplex_file(file_path: str, dtype: np.dtype, table: GroupTable) -> np.ndarray:
+    """Events per group of a binary file, every single of a coincidence counted."""
+    counts = np.zeros(table.num_groups + 1, dtype=np.int64)
+    channel_fields = [name for name in dtype.names if name.startswith("channel_id")]
+    with open(file_path, "rb") as f:
+        while True:
+            records = np.fromfile(f, dtype=dtype, count=CHUNK_RECORDS)
+            if records.size == 0:
+                break
+            for name in channel_fields:
+                # events out of the groups (reference detector) in the last bin
+                groups = table.groups(records[name].astype(np.int64))
+                counts += np.bincount(
+                    np.where(groups < 0, table.num_groups, groups),
+                    minlength=table.num_groups + 1,
+                )
+    return counts[:-1]
+
+
+def demultiplex_run(
+    petsys_commands: Commands,
+    full_out_name: str,
+    out_directory: str = None,
+    live_time: float = None,
+) -> None:
+    """Counts and per-channel rate of every threshold group of a processed run,
+    written to <processed name>_groups.tsv."""
+    yaml_dict = petsys_commands.dictionary
+    if not yaml_dict.get("multiplex_threshold"):
+        return
+    if not binary_output(yaml_dict):
+        print("Demultiplexing needs binary output, groups not counted.")
+        return
+    table = GroupTable(group_table_path(yaml_dict))
+    dtype = yaml_record_dtype(yaml_dict)
+    processed_name = petsys_commands.processed_name(full_out_name, out_directory)
+    counts = np.zeros(table.num_groups, dtype=np.int64)
+    for file_path in data_files(processed_name):
+        counts += demultiplex_file(file_path, dtype, table)
+    if not live_time or np.isnan(live_time):
+        live_time = yaml_dict["time"]
+    with open(processed_name + GROUPS_SUFFIX, "w") as f:
+        f.write(f"group\t{table.key}\tchannels\tcounts\trate_per_channel\n")
+        for g in range(table.num_groups):
+            # groups have different sizes, compare them per channel
+            rate = counts[g] / table.channels[g] / live_time
+            f.write(
+                f"{g}\t{table.thresholds[g]}\t{table.channels[g]}\t{counts[g]}\t{rate:.6g}\n"
+            )
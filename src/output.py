@@ -0,0 +1,135 @@
+import glob
+import os
+import shutil
+import time
+from typing import Any, Dict, List
+
+RAW_BYTES_PER_EVENT = 8  # approximate size of one event in the raw PETsys files
+CAPACITY_MARGIN = 1.2  # free space required relative to the predicted data size
+PROCESSED_RATIO = 1.0  # processed bytes per raw byte assumed for the capacity check
+THROTTLE_INTERVAL = 1.0  # seconds between write bandwidth samples
+
+
+def get_raw_directories(yaml_dict: Dict[str, Any]) -> List[str]:
+    """Directories the raw data is striped across, out_directory by default."""
+    return yaml_dict.get("raw_directories") or [yaml_dict["out_directory"]]
+
+
+def get_processed_directories(yaml_dict: Dict[str, Any]) -> List[str]:
+    """Directories the processed data is striped across, next to the raw data by default."""
+    return yaml_dict.get("processed_directories") or []
+
+
+def run_size(file_dir: str) -> int:
+    """Size in bytes of the raw files (.rawf, .idxf) of a run."""
+    return sum(os.path.getsize(f) for f in glob.glob(file_dir + ".*"))
+
+
+def free_bytes(directory: str) -> int:
+    """Free bytes on the disk holding `directory` (or its closest existing parent)."""
+    while not os.path.exists(directory):
+        directory = os.path.dirname(os.path.normpath(directory))
+    return shutil.disk_usage(directory).free
+
+
+def device_id(directory: str) -> int:
+    """Identifier of the device holding `directory`, to group stripes on one disk."""
+    while not os.path.exists(directory):
+        directory = os.path.dirname(os.path.normpath(directory))
+    return os.stat(directory).st_dev
+
+
+class OutputManager:
+    """Place raw and processed output and guard the disk capacity and bandwidth."""
+
+    def __init__(self, yaml_dict: Dict[str, Any]) -> None:
+        self.raw_directories = get_raw_directories(yaml_dict)
+        self.processed_directories = get_processed_directories(yaml_dict)
+        self.expected_rate = yaml_dict.get("expected_rate", 0)  # events/s
+        # MB/s written on the raw disks above which processing waits, 0 to disable
+        self.max_write_rate = yaml_dict.get("max_write_rate", 0) * 1e6
+        self.run_bytes = []
+        self.run_times = []
+
+    def bytes_per_point(self, acq_time: float) -> float:
+        """Raw bytes expected for one acquisition, learned from the completed runs."""
+        if self.run_times and sum(self.run_times) > 0:
+            return sum(self.run_bytes) / sum(self.run_times) * acq_time
+        return self.expected_rate * acq_time * RAW_BYTES_PER_EVENT
+
+    def record_run(self, file_dir: str, acq_time: float) -> int:
+        """Add a completed run to the size estimate and return its size."""
+        size = run_size(file_dir)
+        self.run_bytes.append(size)
+        self.run_times.append(acq_time)
+        return size
+
+    def check_capacity(self, file_dirs: List[str], acq_time: float) -> None:
+        """Check that every disk can hold its share of raw and processed data."""
+        bytes_per_point = self.bytes_per_point(acq_time)
+        if bytes_per_point == 0:
+            print(
+                "Unknown data rate, disk capacity not checked (set expected_rate in the YAML)"
+            )
+            return
+        needed = {}
+        free = {}
+        for i, file_dir in enumerate(file_dirs):
+            directories = [os.path.dirname(file_dir)]
+            sizes = [bytes_per_point]
+            if self.processed_directories:
+                directories.append(self.processed_directory(i))
+                sizes.append(bytes_per_point * PROCESSED_RATIO)
+            else:
+                sizes[0] += bytes_per_point * PROCESSED_RATIO
+            for directory, size in zip(directories, sizes):
+                device = device_id(directory)
+                needed[device] = needed.get(device, 0) + size * CAPACITY_MARGIN
+                free[device] = free_bytes(directory)
+        for device, size in needed.items():
+            assert (
+                free[device] >= size
+            ), f"Not enough disk space: {size / 1e9:.2f} GB needed, {free[device] / 1e9:.2f} GB free"
+        print(
+            f"Disk capacity checked: {sum(needed.values()) / 1e9:.2f} GB needed "
+            f"on {len(needed)} disk(s)"
+        )
+
+    def raw_directory(self, planned_dir: str, acq_time: float) -> str:
+        """Planned raw directory, or another stripe if its disk is too full for a point."""
+        needed = self.bytes_per_point(acq_time) * CAPACITY_MARGIN
+        candidates = [planned_dir] + [
+            d
+            for d in self.raw_directories
+            if os.path.normpath(d) != os.path.normpath(planned_dir)
+        ]
+        for directory in candidates:
+            if free_bytes(directory) >= needed:
+                if directory != planned_dir:
+                    print(f"Disk of {planned_dir} is full, writing to {directory}")
+                return directory
+        raise OSError(
+            f"No space left for {needed / 1e9:.2f} GB in any of {self.raw_directories}"
+        )
+
+    def processed_directory(self, index: int) -> str:
+        """Directory for the processed output of the index-th run, None to keep it next to the raw data."""
+        if not self.processed_directories:
+            return None
+        return self.processed_directories[index % len(self.processed_directories)]
+
+    def write_rate(self) -> float:
+        """Bytes per second currently written on the raw disks."""
+        directories = {device_id(d): d for d in self.raw_directories}.values()
+        used = sum(shutil.disk_usage(d).used for d in directories)
+        time.sleep(THROTTLE_INTERVAL)
+        return (
+            sum(shutil.disk_usage(d).used for d in directories) - used
+        ) / THROTTLE_INTERVAL
+
+    def throttle(self) -> None:
+        """Wait while the raw disks are written faster than max_write_rate."""
+        if not self.max_write_rate:
+            return
+        while self.write_rate() > self.max_write_rate:
+            print("Disk write bandwidth saturated, waiting before processing...")
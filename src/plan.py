@@ -0,0 +1,303 @@
+import json
+import os
+from itertools import product
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from src.bias import predict_settle_time, ramp_order
+from src.config import MOTORS_ID, MotorConfig
+from src.motor_control import MotionModel, array_of_positions
+from src.output import RAW_BYTES_PER_EVENT, get_raw_directories
+from src.utils import format_duration
+
+ACQ_OVERHEAD = 5  # seconds of DAQ start-up and pauses around each acquisition
+CONTINUOUS_LEAD_IN = 5  # seconds the DAQ runs before a sweep starts
+CONTINUOUS_LEAD_OUT = 2  # seconds the DAQ keeps running after a sweep ends
+SETTINGS_KEYS = ["over_voltage", "vth_t1", "vth_t2", "vth_e"]
+# value in the scan points of the threshold multiplexed over channel groups
+MULTIPLEXED = -1
+
+
+class ScanPoint(NamedTuple):
+    """One acquisition of the scan, fully resolved before touching the hardware."""
+
+    index: int
+    position_index: int  # -1 when no motors are used
+    iteration: int
+    over_voltage: float
+    vth_t1: int
+    vth_t2: int
+    vth_e: int
+    positions: Tuple[float, ...]
+    step_targets: Tuple[int, ...]
+    full_out_name: str
+    file_dir: str
+    settings_diff: Dict[
+        str, Any
+    ]  # settings that change with respect to the previous point
+    motion_time: float  # predicted motion before the point
+    sleep_after: float
+
+
+class ScanPlan(NamedTuple):
+    """Immutable, serializable list of scan points and its predictions."""
+
+    out_name: str
+    log_file: str
+    motor_names: Tuple[str, ...]
+    sweep_motor: str  # "" if there is no continuous scan
+    acq_time: float
+    split_time: float
+    points: Tuple[ScanPoint, ...]
+    predicted_duration: float
+    predicted_bytes: int  # 0 if unknown
+
+    def save(self, file_path: str) -> None:
+        """Write the plan as JSON."""
+        plan_dict = self._asdict()
+        plan_dict["points"] = [point._asdict() for point in self.points]
+        with open(file_path, "w") as f:
+            json.dump(plan_dict, f, indent=1)
+
+    @classmethod
+    def load(cls, file_path: str) -> "ScanPlan":
+        """Read a plan written with save."""
+        with open(file_path) as f:
+            plan_dict = json.load(f)
+        plan_dict["motor_names"] = tuple(plan_dict["motor_names"])
+        plan_dict["points"] = tuple(
+            ScanPoint(
+                **{
+                    **point,
+                    "positions": tuple(point["positions"]),
+                    "step_targets": tuple(point["step_targets"]),
+                }
+            )
+            for point in plan_dict["points"]
+        )
+        return cls(**plan_dict)
+
+
+def get_iterables(yaml_dict: Dict[str, Any]) -> list:
+    """List of the scanned parameters, in loop order.
+
+    The multiplexed threshold takes all its values in every acquisition, so it
+    is not scanned.
+    """
+    multiplexed = yaml_dict.get("multiplex_threshold")
+    return [range(yaml_dict["iterations"]), yaml_dict["over_voltage"]] + [
+        [MULTIPLEXED] if key == multiplexed else yaml_dict[key]
+        for key in ["vth_t1", "vth_t2", "vth_e"]
+    ]
+
+
+def get_log_file(yaml_dict: Dict[str, Any]) -> str:
+    """Path of the scan log file."""
+    return os.path.join(yaml_dict["out_directory"], yaml_dict["out_name"] + ".log")
+
+
+def get_motor_names(yaml_dict: Dict[str, Any]) -> List[str]:
+    """Motors stepped between points, in the order given in the YAML."""
+    if not yaml_dict["flag_motor"]:
+        return []
+    sweep_motor = yaml_dict.get("continuous_motor", "")
+    return [key for key in yaml_dict if key in MOTORS_ID and key != sweep_motor]
+
+
+def continuous_split_time(yaml_dict: Dict[str, Any]) -> float:
+    """--splitTime (s) that slices a sweep into `continuous_bin` wide position bins."""
+    model = MotionModel(MotorConfig(yaml_dict[yaml_dict["continuous_motor"]]))
+    velocity = abs(model.position(model.speed) - model.position(0))  # per second
+    return yaml_dict["continuous_bin"] / velocity
+
+
+def sweep_time(motor_config: MotorConfig) -> float:
+    """Predicted duration (s) of a sweep from start to end at constant `speed`."""
+    model = MotionModel(motor_config)
+    model.max_speed = model.speed
+    return model.move_time(
+        model.steps(motor_config.end) - model.steps(motor_config.start)
+    )
+
+
+def compile_scan(yaml_dict: Dict[str, Any]) -> ScanPlan:
+    """Expand the YAML configuration into the ordered list of scan points."""
+    out_name = yaml_dict["out_name"]
+    iterables = get_iterables(yaml_dict)
+    time_sleep = (
+        yaml_dict["time_between_iterations"] if yaml_dict["iterations"] > 1 else 0
+    )
+
+    sweep_motor = (
+        yaml_dict.get("continuous_motor", "") if yaml_dict["flag_motor"] else ""
+    )
+    if sweep_motor:
+        acq_time = (
+            CONTINUOUS_LEAD_IN
+            + sweep_time(MotorConfig(yaml_dict[sweep_motor]))
+            + CONTINUOUS_LEAD_OUT
+        )
+        split_time = continuous_split_time(yaml_dict)
+    else:
+        acq_time = yaml_dict["time"]
+        split_time = yaml_dict["split_time"]
+
+    motor_names = get_motor_names(yaml_dict)
+    motor_configs = [MotorConfig(yaml_dict[name]) for name in motor_names]
+    models = [MotionModel(config) for config in motor_configs]
+    if yaml_dict["flag_motor"]:
+        position_matrix = enumerate(
+            product(
+                *[
+                    array_of_positions(c.start, c.end, c.step_size)
+                    for c in motor_configs
+                ]
+            )
+        )
+    else:
+        position_matrix = [(-1, ())]
+    pos_ini = yaml_dict.get("pos_ini", 0)
+
+    raw_directories = get_raw_directories(yaml_dict)
+    points = []
+    current_steps = [0] * len(models)  # motors start at home
+    previous_settings = {}
+    bias_ramp = yaml_dict.get("bias_ramp", "up")
+    ramp_pass = 0  # over-voltage passes so far, for the serpentine ramp
+    for position_index, positions in position_matrix:
+        if 0 <= position_index < pos_ini:
+            continue
+        positions = tuple(float(position) for position in positions)
+        step_targets = tuple(
+            model.steps(position) for model, position in zip(models, positions)
+        )
+        motion_time = sum(
+            model.move_time(target - steps)
+            for model, target, steps in zip(models, step_targets, current_steps)
+        )
+        current_steps = list(step_targets)
+
+        iteration = -1
+        for it in iterables[0]:
+            voltages = iterables[1]
+            if yaml_dict.get("bias_sweep"):
+                voltages = ramp_order(voltages, bias_ramp, ramp_pass)
+                ramp_pass += 1
+            for v, t1, t2, e in product(voltages, *iterables[2:]):
+                v_bias = v + yaml_dict["break_voltage"]
+                labels = ["mux" if t == MULTIPLEXED else t for t in [t1, t2, e]]
+                if position_index >= 0:
+                    # Include the motor position in the file name
+                    full_out_name = out_name + "_pos{}_it{}_{}V_{}T1_{}T2_{}E".format(
+                        position_index, it, v_bias, *labels
+                    )
+                else:
+                    full_out_name = out_name + "_it{}_{}V_{}T1_{}T2_{}E".format(
+                        it, v_bias, *labels
+                    )
+                full_out_name += f"_{int(yaml_dict['time'])}s"
+
+                settings = dict(zip(SETTINGS_KEYS, [v, t1, t2, e]))
+                settings_diff = {
+                    key: value
+                    for key, value in settings.items()
+                    if previous_settings.get(key) != value
+                }
+                previous_settings = settings
+
+                # sleep between iterations, when it changes
+                sleep_after = time_sleep if iteration != it else 0
+                iteration = it
+
+                points.append(
+                    ScanPoint(
+                        index=len(points),
+                        position_index=position_index,
+                        iteration=it,
+                        over_voltage=v,
+                        vth_t1=t1,
+                        vth_t2=t2,
+                        vth_e=e,
+                        positions=positions,
+                        step_targets=step_targets,
+                        full_out_name=full_out_name,
+                        # stripe the runs across the raw data directories
+                        file_dir=os.path.join(
+                            raw_directories[len(points) % len(raw_directories)],
+                            full_out_name,
+                        ),
+                        settings_diff=settings_diff,
+                        motion_time=motion_time,
+                        sleep_after=sleep_after,
+                    )
+                )
+                motion_time = 0.0
+
+    predicted_duration = sum(
+        acq_time + ACQ_OVERHEAD + point.motion_time + point.sleep_after
+        for point in points
+    )
+    if yaml_dict.get("bias_sweep"):
+        previous_voltage = 0.0  # bias off before the scan
+        for point in points:
+            if "over_voltage" in point.settings_diff:
+                predicted_duration += predict_settle_time(
+                    yaml_dict, previous_voltage, point.over_voltage
+                )
+                previous_voltage = point.over_voltage
+    predicted_bytes = int(
+        yaml_dict.get("expected_rate", 0) * acq_time * RAW_BYTES_PER_EVENT * len(points)
+    )
+    return ScanPlan(
+        out_name=out_name,
+        log_file=get_log_file(yaml_dict),
+        motor_names=tuple(motor_names),
+        sweep_motor=sweep_motor,
+        acq_time=acq_time,
+        split_time=split_time,
+        points=tuple(points),
+        predicted_duration=predicted_duration,
+        predicted_bytes=predicted_bytes,
+    )
+
+
+def validate_plan(plan: ScanPlan, yaml_dict: Dict[str, Any]) -> None:
+    """Check the compiled plan before starting the scan."""
+    assert plan.points, "The scan has no points (check pos_ini and the scan lists)"
+    out_names = [point.full_out_name for point in plan.points]
+    assert len(set(out_names)) == len(
+        out_names
+    ), "Repeated output names in the scan, some runs would be overwritten"
+    for point in plan.points:
+        assert all(
+            target >= 0 for target in point.step_targets
+        ), f"Point {point.index} is behind the HOME position: {point.positions}"
+    if plan.sweep_motor:
+        sweep_config = yaml_dict[plan.sweep_motor]
+        assert (
+            sweep_config["start"] != sweep_config["end"]
+        ), f"'{plan.sweep_motor}' start and end must differ for a continuous scan"
+        assert plan.split_time > 0, "The continuous scan bins must be > 0 s"
+
+
+def print_plan(plan: ScanPlan) -> None:
+    """Print the scan points and the predictions of the plan."""
+    print(f"Scan plan '{plan.out_name}': {len(plan.points)} points")
+    for point in plan.points:
+        positions = "\t".join(
+            f"{name}={position:g}"
+            for name, position in zip(plan.motor_names, point.positions)
+        )
+        print(
+            f"{point.index}\t{point.full_out_name}\t{positions}\t"
+            f"{point.settings_diff}\tmotion {point.motion_time:.1f} s"
+        )
+    if plan.sweep_motor:
+        print(
+            f"Each point sweeps {plan.sweep_motor}, split every {plan.split_time:.3f} s"
+        )
+    print(f"Acquisition time per point: {plan.acq_time:.1f} s")
+    print(f"Predicted scan duration: {format_duration(plan.predicted_duration)}")
+    if plan.predicted_bytes:
+        print(f"Predicted raw data size: {plan.predicted_bytes / 1e9:.2f} GB")
+    else:
+        print("Predicted raw data size: unknown (set expected_rate in the YAML)")
@@ -0,0 +1,111 @@
+import heapq
+import json
+import os
+import threading
+from typing import Any, Dict, List
+
+from src.output import device_id, run_size
+
+# per-byte conversion speed of past runs, kept in out_directory
+SPEED_FILE = "conversion_speed.json"
+
+
+def _speed_path(yaml_dict: Dict[str, Any]) -> str:
+    return os.path.join(yaml_dict["out_directory"], SPEED_FILE)
+
+
+def _speed_key(yaml_dict: Dict[str, Any]) -> str:
+    """The conversion speed depends on the output requested."""
+    return f"{yaml_dict['data_type']}_{yaml_dict['data_format']}_{yaml_dict['data_compact']}"
+
+
+def load_conversion_speed(yaml_dict: Dict[str, Any]) -> float:
+    """Raw bytes converted per second in past runs, 0 if unknown."""
+    try:
+        with open(_speed_path(yaml_dict)) as f:
+            history = json.load(f).get(_speed_key(yaml_dict))
+    except (FileNotFoundError, ValueError):
+        return 0.0
+    if not history or history["seconds"] <= 0:
+        return 0.0
+    return history["bytes"] / history["seconds"]
+
+
+def save_conversion_speed(
+    yaml_dict: Dict[str, Any], converted_bytes: int, seconds: float
+) -> None:
+    """Add the conversions of this run to the stored speed."""
+    if seconds <= 0:
+        return
+    speeds = {}
+    if os.path.isfile(_speed_path(yaml_dict)):
+        with open(_speed_path(yaml_dict)) as f:
+            speeds = json.load(f)
+    history = speeds.setdefault(_speed_key(yaml_dict), {"bytes": 0, "seconds": 0.0})
+    history["bytes"] += converted_bytes
+    history["seconds"] += seconds
+    with open(_speed_path(yaml_dict) + ".tmp", "w") as f:
+        json.dump(speeds, f, indent=1)
+    os.replace(_speed_path(yaml_dict) + ".tmp", _speed_path(yaml_dict))
+
+
+def _pick(pending: List[str], devices: Dict[str, int], device: int) -> str:
+    """Largest pending run on `device`, or the largest one if the disk has none left."""
+    for file_dir in pending:
+        if devices[file_dir] == device:
+            break
+    else:
+        file_dir = pending[0]
+    pending.remove(file_dir)
+    return file_dir
+
+
+class ProcessingScheduler:
+    """Hand out the runs to the conversion workers.
+
+    Runs are taken largest first (longest-processing-time first) so the big
+    runs do not finish last on a single worker, and every worker sticks to one
+    disk while it has runs left so the reads of several workers do not
+    interleave on the same device.
+    """
+
+    def __init__(self, file_dirs: List[str], workers: int) -> None:
+        self.sizes = {file_dir: run_size(file_dir) for file_dir in file_dirs}
+        self.devices = {
+            file_dir: device_id(os.path.dirname(file_dir) or ".")
+            for file_dir in file_dirs
+        }
+        self.pending = sorted(file_dirs, key=lambda f: self.sizes[f], reverse=True)
+        device_bytes = {}
+        for file_dir, device in self.devices.items():
+            device_bytes[device] = device_bytes.get(device, 0) + self.sizes[file_dir]
+        # spread the workers over the disks, the busiest disks first
+        device_order = sorted(device_bytes, key=device_bytes.get, reverse=True) or [0]
+        self.affinity = [device_order[i % len(device_order)] for i in range(workers)]
+        self.lock = threading.Lock()
+
+    def next_run(self, worker: int) -> str:
+        """Next run for a worker, None when all are handed out."""
+        with self.lock:
+            if not self.pending:
+                return None
+            return _pick(self.pending, self.devices, self.affinity[worker])
+
+    def total_bytes(self) -> int:
+        return sum(self.sizes.values())
+
+    def predict_makespan(self, speed: float) -> float:
+        """Seconds until the last worker finishes at `speed` bytes/s, 0 if unknown."""
+        if speed <= 0:
+            return 0.0
+        pending = list(self.pending)
+        # simulate the workers: (time the worker is free, worker)
+        free_at = [(0.0, worker) for worker in range(len(self.affinity))]
+        makespan = 0.0
+        while pending:
+            start, worker = heapq.heappop(free_at)
+            file_dir = _pick(pending, self.devices, self.affinity[worker])
+            end = start + self.sizes[file_dir] / speed
+            makespan = max(makespan, end)
+            heapq.heappush(free_at, (end, worker))
+        return makespan
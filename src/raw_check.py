@@ -0,0 +1,92 @@
+import os
+from typing import Any, Dict, List, Tuple
+
+from src.output import RAW_BYTES_PER_EVENT
+from src.plan import ScanPoint
+
+MIN_RATE_FRACTION = 0.5  # lowest rate accepted if only expected_rate is set
+
+
+def read_index(index_file: str) -> List[Tuple[int, int]]:
+    """(start, end) byte offsets in the .rawf of the steps of a PETsys .idxf.
+
+    Returns an empty list if the index cannot be read as text.
+    """
+    steps = []
+    try:
+        with open(index_file) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2:
+                    steps.append((int(fields[0]), int(fields[1])))
+    except (UnicodeDecodeError, ValueError):
+        return []
+    return steps
+
+
+class RawCheck:
+    """Quick check of the raw files of a point right after the acquisition.
+
+    A run is rejected when its raw data is missing, empty or shorter than its
+    index. If min_rate_fraction or expected_rate is set, it is also rejected
+    when its rate (raw bytes per second) falls below min_rate_fraction of the
+    reference: the same point (position and settings) in the previous
+    iteration, else expected_rate. Other positions are never compared, the
+    rate changes along a scan.
+    """
+
+    def __init__(self, yaml_dict: Dict[str, Any], acq_time: float) -> None:
+        self.acq_time = acq_time
+        self.check_rate = (
+            "min_rate_fraction" in yaml_dict or "expected_rate" in yaml_dict
+        )
+        self.min_rate_fraction = yaml_dict.get("min_rate_fraction", MIN_RATE_FRACTION)
+        self.expected_rate = yaml_dict.get("expected_rate", 0) * RAW_BYTES_PER_EVENT
+        self.point_rates = {}  # (positions, settings) -> bytes/s
+
+    @staticmethod
+    def _settings(point: ScanPoint) -> tuple:
+        return (point.over_voltage, point.vth_t1, point.vth_t2, point.vth_e)
+
+    def reference_rate(self, point: ScanPoint) -> float:
+        """Rate the point is expected to reach, 0 if unknown or not checked."""
+        if not self.check_rate:
+            return 0
+        return self.point_rates.get(
+            (point.positions, self._settings(point)), self.expected_rate
+        )
+
+    def check(self, point: ScanPoint, file_dir: str) -> Dict[str, Any]:
+        """Check the raw files of a point, returns ok, the rate and the reason."""
+        raw_file = file_dir + ".rawf"
+        index_file = file_dir + ".idxf"
+        raw_bytes = os.path.getsize(raw_file) if os.path.isfile(raw_file) else 0
+        rate = raw_bytes / self.acq_time if self.acq_time else 0
+        result = {"ok": False, "rate": rate, "reason": ""}
+        if raw_bytes == 0:
+            result["reason"] = "no raw data"
+            return result
+        if not os.path.isfile(index_file) or os.path.getsize(index_file) == 0:
+            result["reason"] = "empty index"
+            return result
+        steps = read_index(index_file)
+        if steps and max(end for _, end in steps) > raw_bytes:
+            result["reason"] = (
+                f"truncated raw data ({raw_bytes} of {max(end for _, end in steps)} bytes)"
+            )
+            return result
+        reference = self.reference_rate(point)
+        if reference and rate < self.min_rate_fraction * reference:
+            result["reason"] = (
+                f"rate {rate / 1e3:.1f} kB/s below {self.min_rate_fraction:.0%} "
+                f"of the expected {reference / 1e3:.1f} kB/s"
+            )
+            return result
+        result["ok"] = True
+        return result
+
+    def accept(self, point: ScanPoint, rate: float) -> None:
+        """Use the final run of a point as reference for the next iteration,
+        also when it was kept after giving up so a real rate change is not
+        rejected again."""
+        self.point_rates[(point.positions, self._settings(point))] = rate
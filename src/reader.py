@@ -1,5 +1,15 @@
 import csv
 import sys
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from src.table_cache import load_cached_tables
+
+
+def _dedupe(pairs: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Remove repeated (slot_ID, DAC_ch) keeping the order of the CSV."""
+    return list(dict.fromkeys(pairs))
 
 
 def read_bias_map(bias_file: str) -> dict:
@@ -54,11 +64,72 @@ def read_bias_map(bias_file: str) -> dict:
             for bias_mez in bias_map_dict[febd].keys():
                 for portID in bias_map_dict[febd][bias_mez].keys():
                     dac_chs = bias_map_dict[febd][bias_mez][portID]
-                    bias_map_dict[febd][bias_mez][portID] = list(set(dac_chs))
+                    bias_map_dict[febd][bias_mez][portID] = _dedupe(dac_chs)
         print(f"Loaded bias_map.csv...")
         return bias_map_dict
 
 
+def compile_bias_map(bias_file: str) -> Dict[str, np.ndarray]:
+    """Compile the bias map into arrays, per FEBD and BIAS board.
+
+    For every FEBD and BIAS board the (slot_ID, DAC_ch) pairs of all ports
+    are stacked in "<FEBD>/<BIAS board>/pairs"; the pairs of port p are the
+    rows offsets[p]:offsets[p + 1], offsets in "<FEBD>/<BIAS board>/offsets".
+    """
+    bias_map_dict = read_bias_map(bias_file)
+    tables = {}
+    for febd, boards in bias_map_dict.items():
+        for board, ports in boards.items():
+            # rows with port 0 in the CSV (-1 here) are not connected
+            num_ports = max(ports) + 1 if ports else 0
+            pairs = [_dedupe(ports.get(port, [])) for port in range(num_ports)]
+            lengths = [len(port_pairs) for port_pairs in pairs]
+            tables[f"{febd}/{board}/offsets"] = np.concatenate(
+                [[0], np.cumsum(lengths)]
+            ).astype(np.int64)
+            tables[f"{febd}/{board}/pairs"] = np.array(
+                [pair for port_pairs in pairs for pair in port_pairs], dtype=np.int64
+            ).reshape(-1, 2)
+    return tables
+
+
+class BiasMap:
+    """Array-backed bias map, compiled once and cached next to the CSV.
+
+    The cache is used while the CSV keeps its mtime or its content (sha256).
+    """
+
+    def __init__(self, tables: Dict[str, np.ndarray]) -> None:
+        self.tables = tables
+
+    @classmethod
+    def load(cls, bias_file: str) -> "BiasMap":
+        return cls(load_cached_tables(bias_file, compile_bias_map))
+
+    def channels(self, febd: str, board: str, ports: List[int]) -> np.ndarray:
+        """(slot_ID, DAC_ch) pairs of the ports, in one gather, shape (n, 2)."""
+        offsets = self.tables[f"{febd}/{board}/offsets"]
+        pairs = self.tables[f"{febd}/{board}/pairs"]
+        ports = np.asarray(ports, dtype=np.int64)
+        lengths = offsets[ports + 1] - offsets[ports]
+        # row of every pair: start of its port plus its position in the port
+        starts = np.repeat(offsets[ports], lengths)
+        positions = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths
+        )
+        return pairs[starts + positions]
+
+
+def pairs_mask(
+    slot_ids: np.ndarray, channel_ids: np.ndarray, pairs: np.ndarray
+) -> np.ndarray:
+    """Rows of a settings table (slotID, channelID columns) in the pairs."""
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    width = int(max(channel_ids.max(initial=0), pairs[:, 1].max(initial=0))) + 1
+    keys = np.asarray(slot_ids, dtype=np.int64) * width + channel_ids
+    return np.isin(keys, pairs[:, 0] * width + pairs[:, 1])
+
+
 if __name__ == "__main__":
     bias_file = sys.argv[1]
     read_bias_map(bias_file)
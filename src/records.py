@@ -0,0 +1,52 @@
+import glob
+from typing import Any, Dict, List
+
+import numpy as np
+
+DATA_EXTENSION = ".ldat"  # binary output of the convert_raw_to_* tools
+
+# Packed little-endian records written with --writeBinary. Times are in ps and
+# channel IDs absolute: ((portID * 32 + slaveID) * 64 + chipID) * 64 + channelID.
+SINGLE_FIELDS = [("time", "<i8"), ("energy", "<f4"), ("channel_id", "<i4")]
+# multiple-hit bookkeeping of group and coincidence events: number of hits of
+# the group and index of this hit in it. The compact output leaves it out.
+HIT_FIELDS = [("mh_n", "u1"), ("mh_j", "u1")]
+
+
+def _suffixed(fields: list, suffix: str) -> list:
+    return [(name + suffix, kind) for name, kind in fields]
+
+
+def record_dtype(data_type: str, data_compact: bool) -> np.dtype:
+    """Numpy dtype of one binary record of the given processed data type."""
+    event_fields = SINGLE_FIELDS if data_compact else HIT_FIELDS + SINGLE_FIELDS
+    if data_type == "singles":
+        return np.dtype(SINGLE_FIELDS)
+    elif data_type == "group":
+        return np.dtype(event_fields)
+    elif data_type == "coincidence":
+        return np.dtype(_suffixed(event_fields, "1") + _suffixed(event_fields, "2"))
+    raise ValueError(f"Data type {data_type} unknown.")
+
+
+def yaml_record_dtype(yaml_dict: Dict[str, Any]) -> np.dtype:
+    """Record dtype of the processed output configured in the YAML."""
+    return record_dtype(yaml_dict["data_type"], yaml_dict["data_compact"])
+
+
+def binary_output(yaml_dict: Dict[str, Any]) -> bool:
+    """If the processed runs end up as binary records, written by the converter
+    or converted from its text output (text_to_binary)."""
+    return yaml_dict["data_format"] == "binary" or (
+        yaml_dict["data_format"] == "txt" and bool(yaml_dict.get("text_to_binary"))
+    )
+
+
+def time_fields(dtype: np.dtype) -> List[str]:
+    """Time fields of a record, one per event of the record."""
+    return [name for name in dtype.names if name.startswith("time")]
+
+
+def data_files(processed_name: str) -> List[str]:
+    """Binary files of a processed run (several when split), sorted by name."""
+    return sorted(glob.glob(processed_name + "*" + DATA_EXTENSION))
@@ -0,0 +1,249 @@
+import hashlib
+import html
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple
+
+import numpy as np
+
+from src.cube import CUBE_SUFFIX, ResultCube
+from src.output import OutputManager
+from src.plan import ScanPlan
+from src.records import binary_output, data_files, yaml_record_dtype
+from src.settings import Commands
+
+REPORT_SUFFIX = "_report"  # directory of the report, next to the scan log
+SPECTRUM_BINS = 200
+CHUNK_RECORDS = 1 << 20  # records histogrammed at a time
+THRESHOLD_KEYS = ["vth_t1", "vth_t2", "vth_e"]
+
+
+class PlotJob(NamedTuple):
+    """One plot of the report and everything it is rendered from."""
+
+    kind: str
+    title: str
+    out_file: str
+    inputs: List[str]  # files the plot is rendered from
+    params: Dict[str, Any]
+
+
+def signature(job: PlotJob) -> str:
+    """Hash of the plot parameters and of the size and mtime of its inputs."""
+    inputs = [
+        (path, os.path.getsize(path), os.stat(path).st_mtime_ns)
+        for path in job.inputs
+        if os.path.exists(path)
+    ]
+    content = json.dumps([job.kind, job.params, inputs], sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _use_agg() -> None:
+    # no display in the workers
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def render_spectrum(job: PlotJob) -> None:
+    """Energy spectrum of a run, histogrammed chunk by chunk."""
+    import matplotlib.pyplot as plt
+
+    dtype = np.dtype([tuple(field) for field in job.params["dtype"]])
+    energy_fields = [name for name in dtype.names if name.startswith("energy")]
+    edges = np.linspace(*job.params["energy_range"], SPECTRUM_BINS + 1)
+    counts = np.zeros(SPECTRUM_BINS, dtype=np.int64)
+    for file_path in job.inputs:
+        with open(file_path, "rb") as f:
+            while True:
+                records = np.fromfile(f, dtype=dtype, count=CHUNK_RECORDS)
+                if records.size == 0:
+                    break
+                for name in energy_fields:
+                    counts += np.histogram(records[name], bins=edges)[0]
+    fig, ax = plt.subplots()
+    ax.stairs(counts, edges)
+    ax.set_xlabel("Energy (a.u.)")
+    ax.set_ylabel("Counts")
+    ax.set_title(job.title)
+    fig.savefig(job.out_file)
+    plt.close(fig)
+
+
+def _rate_over(cube: ResultCube, keep_axes: List[str]) -> np.ndarray:
+    """Mean rate of the cube over every axis not in keep_axes, in their order."""
+    names = [name for name, _ in cube.axes]
+    rate = np.asarray(cube.get("rate"))
+    other = tuple(i for i, name in enumerate(names) if name not in keep_axes)
+    with np.errstate(all="ignore"):
+        rate = np.nanmean(rate, axis=other) if other else rate
+    # the remaining axes keep the cube order, put them in keep_axes order
+    order = [names.index(name) for name in keep_axes]
+    source = [sorted(order).index(i) for i in order]
+    return np.moveaxis(rate, source, range(len(order)))
+
+
+def render_threshold_curve(job: PlotJob) -> None:
+    """Rate against one threshold, one curve per over-voltage."""
+    import matplotlib.pyplot as plt
+
+    cube = ResultCube(job.params["cube"])
+    axes = dict(cube.axes)
+    key = job.params["threshold"]
+    rate = _rate_over(cube, ["over_voltage", key])
+    fig, ax = plt.subplots()
+    for voltage, curve in zip(axes["over_voltage"], rate):
+        ax.plot(axes[key], curve, marker="o", label=f"OV {voltage:g} V")
+    ax.set_xlabel(key)
+    ax.set_ylabel("Rate (events/s)")
+    ax.set_yscale("log")
+    ax.legend()
+    ax.set_title(job.title)
+    fig.savefig(job.out_file)
+    plt.close(fig)
+
+
+def render_position_map(job: PlotJob) -> None:
+    """Rate over the motor positions: a curve for one motor, a heatmap for two."""
+    import matplotlib.pyplot as plt
+
+    cube = ResultCube(job.params["cube"])
+    axes = dict(cube.axes)
+    motors = job.params["motors"]
+    rate = _rate_over(cube, motors)
+    fig, ax = plt.subplots()
+    if len(motors) == 1:
+        ax.plot(axes[motors[0]], rate, marker="o")
+        ax.set_xlabel(motors[0])
+        ax.set_ylabel("Rate (events/s)")
+    else:
+        mesh = ax.pcolormesh(axes[motors[0]], axes[motors[1]], rate.T, shading="auto")
+        fig.colorbar(mesh, ax=ax, label="Rate (events/s)")
+        ax.set_xlabel(motors[0])
+        ax.set_ylabel(motors[1])
+    ax.set_title(job.title)
+    fig.savefig(job.out_file)
+    plt.close(fig)
+
+
+RENDERERS = {
+    "spectrum": render_spectrum,
+    "threshold_curve": render_threshold_curve,
+    "position_map": render_position_map,
+}
+
+
+def render(job: PlotJob) -> str:
+    RENDERERS[job.kind](job)
+    return job.out_file
+
+
+def report_jobs(
+    yaml_dict: Dict[str, Any], plan: ScanPlan, report_dir: str
+) -> List[PlotJob]:
+    """The standard plot set of a scan."""
+    petsys_commands = Commands(yaml_dict)
+    output_manager = OutputManager(yaml_dict)
+    jobs = []
+    cube_base = os.path.join(yaml_dict["out_directory"], plan.out_name)
+    if os.path.isfile(cube_base + CUBE_SUFFIX):
+        axes = dict(ResultCube(cube_base).axes)
+        for key in THRESHOLD_KEYS:
+            if len(axes[key]) > 1:
+                jobs.append(
+                    PlotJob(
+                        "threshold_curve",
+                        f"Rate vs {key}",
+                        os.path.join(report_dir, f"rate_vs_{key}.png"),
+                        [cube_base + CUBE_SUFFIX],
+                        {"cube": cube_base, "threshold": key},
+                    )
+                )
+        if plan.motor_names:
+            jobs.append(
+                PlotJob(
+                    "position_map",
+                    "Rate vs position",
+                    os.path.join(report_dir, "rate_vs_position.png"),
+                    [cube_base + CUBE_SUFFIX],
+                    {"cube": cube_base, "motors": list(plan.motor_names[:2])},
+                )
+            )
+
+    if binary_output(yaml_dict):
+        with open(plan.log_file) as f:
+            next(f)  # Skip the header
+            file_names = [line.split("\t")[0].strip() for line in f]
+        dtype = yaml_record_dtype(yaml_dict)
+        for i, full_out_name in enumerate(file_names):
+            files = data_files(
+                petsys_commands.processed_name(
+                    full_out_name, output_manager.processed_directory(i)
+                )
+            )
+            if not files:
+                continue
+            name = os.path.basename(full_out_name)
+            jobs.append(
+                PlotJob(
+                    "spectrum",
+                    name,
+                    os.path.join(report_dir, name + "_spectrum.png"),
+                    files,
+                    {
+                        "dtype": dtype.descr,
+                        "energy_range": yaml_dict.get("report_energy_range", [0, 50]),
+                    },
+                )
+            )
+    return jobs
+
+
+def write_index(report_dir: str, plan: ScanPlan, jobs: List[PlotJob]) -> str:
+    """HTML page with every plot of the report."""
+    index_file = os.path.join(report_dir, "index.html")
+    with open(index_file, "w") as f:
+        f.write(f"<html><head><title>{html.escape(plan.out_name)}</title></head>\n")
+        f.write(f"<body><h1>{html.escape(plan.out_name)}</h1>\n")
+        for kind in RENDERERS:
+            for job in [job for job in jobs if job.kind == kind]:
+                if os.path.exists(job.out_file):
+                    f.write(
+                        f"<figure><img src='{html.escape(os.path.basename(job.out_file))}'>"
+                        f"<figcaption>{html.escape(job.title)}</figcaption></figure>\n"
+                    )
+        f.write("</body></html>\n")
+    return index_file
+
+
+def make_report(yaml_dict: Dict[str, Any], plan: ScanPlan, workers: int = None) -> str:
+    """Render the plots whose inputs changed since the last report, in parallel."""
+    report_dir = os.path.splitext(plan.log_file)[0] + REPORT_SUFFIX
+    os.makedirs(report_dir, exist_ok=True)
+    manifest_file = os.path.join(report_dir, "manifest.json")
+    manifest = {}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+    jobs = report_jobs(yaml_dict, plan, report_dir)
+    signatures = {job.out_file: signature(job) for job in jobs}
+    outdated = [
+        job
+        for job in jobs
+        if not os.path.exists(job.out_file)
+        or manifest.get(job.out_file) != signatures[job.out_file]
+    ]
+    print(f"Rendering {len(outdated)} of {len(jobs)} plots")
+    if outdated:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_use_agg) as pool:
+            for out_file in pool.map(render, outdated):
+                manifest[out_file] = signatures[out_file]
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_file + ".tmp", manifest_file)
+    index_file = write_index(report_dir, plan, jobs)
+    print(f"Report written to {index_file}")
+    return index_file
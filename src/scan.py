@@ -0,0 +1,385 @@
+import math
+import os
+import threading
+import time
+from typing import Any, Dict
+
+from src.bias import BiasSettling
+from src.config import ScanConfig
+from src.cube import ResultCube
+from src.executor import TaskGraph
+from src.metrics import ScanMetrics
+from src.motor_control import MotorControl
+from src.output import RAW_BYTES_PER_EVENT, OutputManager
+from src.plan import (
+    CONTINUOUS_LEAD_IN,
+    CONTINUOUS_LEAD_OUT,
+    MULTIPLEXED,
+    ScanPlan,
+    ScanPoint,
+)
+from src.raw_check import RawCheck
+from src.settings import Commands
+from src.snapshot import record_run_settings, snapshot_settings
+from src.utils import estimate_remaining_time
+
+ACQ_ATTEMPTS = 3  # number of attempts to acquire data if it fails
+PCT_LOST_THRESHOLD = 5  # percentage of lost data to consider the acquisition successful
+TRACE_PERIOD = 0.1  # seconds between samples of the position trace
+
+
+def print_motor_position(motor: MotorControl) -> None:
+    print(f"Motor '{motor.motor_name}' moved to {motor.current_position} mm/degree")
+
+
+def write_position_trace(
+    file_dir: str,
+    motor: MotorControl,
+    origin: int,
+    target: int,
+    t_start: float,
+    t_end: float,
+    split_time: float,
+) -> None:
+    """Write the position trace of a sweep and, if split, its position bins.
+
+    The firmware only reports the end of a move, so the positions are predicted
+    with the motion model and stretched to the measured move duration. Times are
+    seconds since acquire_sipm_data was launched, not since it started taking
+    data: its start-up (configuring the ASICs) shifts the trace by a fraction
+    of a second, so positions are approximate by that much.
+    """
+    model = motor.motion_model
+    steps = target - origin
+    scale = model.move_time(steps) / (t_end - t_start) if t_end > t_start else 1.0
+
+    def position_at(t: float) -> float:
+        return model.position(origin + model.steps_at((t - t_start) * scale, steps))
+
+    trace_end = t_end + CONTINUOUS_LEAD_OUT
+    with open(file_dir + "_trace.tsv", "w") as f:
+        f.write("time_s\t" + motor.motor_name + "_mm/rev\n")
+        for i in range(int(trace_end / TRACE_PERIOD) + 1):
+            t = i * TRACE_PERIOD
+            f.write(f"{t:.3f}\t{position_at(t):.4f}\n")
+
+    if split_time > 0:
+        with open(file_dir + "_bins.tsv", "w") as f:
+            f.write("split\ttime_start_s\ttime_end_s\tpos_start\tpos_end\n")
+            for k in range(math.ceil(trace_end / split_time)):
+                t0, t1 = k * split_time, (k + 1) * split_time
+                f.write(
+                    f"{k}\t{t0:.3f}\t{t1:.3f}\t{position_at(t0):.4f}\t{position_at(t1):.4f}\n"
+                )
+
+
+def sweep_and_acquire(
+    petsys_commands: Commands,
+    motor: MotorControl,
+    full_out_name: str,
+    out_directory: str,
+    split_time: float,
+) -> Dict[str, Any]:
+    """Run one acquisition while the motor sweeps its range at constant speed.
+
+    The sweep goes towards the far end of the range, so consecutive sweeps
+    alternate direction without a return move.
+    """
+    model = motor.motion_model
+    start_steps = model.steps(motor.motor_start)
+    end_steps = model.steps(motor.motor_end)
+    origin = motor.current_steps
+    if abs(end_steps - origin) >= abs(start_steps - origin):
+        target = end_steps
+    else:
+        target = start_steps
+
+    cruise_speed = model.max_speed
+    motor.set_max_speed(model.speed)
+    acq_time = (
+        CONTINUOUS_LEAD_IN + model.move_time(target - origin) + CONTINUOUS_LEAD_OUT
+    )
+
+    result = {}
+
+    def acquire() -> None:
+        # an error of the DAQ is raised in the scan thread after the sweep
+        try:
+            result["lost_info"] = petsys_commands.acquire_data(
+                full_out_name, acq_time, out_directory
+            )
+        except BaseException as error:
+            result["error"] = error
+
+    daq = threading.Thread(target=acquire)
+    daq_launch = time.time()
+    daq.start()
+    try:
+        time.sleep(CONTINUOUS_LEAD_IN)
+        t_start = time.time() - daq_launch
+        motor.move_motor_to(target)
+        t_end = time.time() - daq_launch
+    finally:
+        daq.join()
+        motor.set_max_speed(cruise_speed)
+    if "error" in result:
+        raise result["error"]
+    motor.current_position = model.position(target)
+
+    file_dir = os.path.join(out_directory, full_out_name)
+    write_position_trace(file_dir, motor, origin, target, t_start, t_end, split_time)
+    return result["lost_info"]
+
+
+def acquire_point(
+    petsys_commands: Commands,
+    scan_config: ScanConfig,
+    point: ScanPoint,
+    split_time: float,
+    out_directory: str,
+    metrics: ScanMetrics = None,
+    raw_check: RawCheck = None,
+) -> Dict[str, Any]:
+    """Acquire one point, retrying while too much data is lost or its raw
+    data fails the raw_check."""
+    # the settings are written for the next point once this one is acquired
+    snapshot_hash = snapshot_settings(scan_config.yaml_dict)
+    attempt = 0
+    while attempt < ACQ_ATTEMPTS:
+        attempt += 1
+        if scan_config.sweep_motor is not None:
+            lost_info = sweep_and_acquire(
+                petsys_commands,
+                scan_config.sweep_motor,
+                point.full_out_name,
+                out_directory,
+                split_time,
+            )
+        else:
+            lost_info = petsys_commands.acquire_data(
+                point.full_out_name, out_directory=out_directory
+            )
+        print(f"Data lost info: {lost_info}")
+        if metrics is not None:
+            metrics.update(lost_percent=lost_info["lost_percent"])
+        if lost_info["lost_percent"] >= PCT_LOST_THRESHOLD:
+            failure = (
+                f"Lost percent {lost_info['lost_percent']}% > {PCT_LOST_THRESHOLD}%"
+            )
+        else:
+            failure = None
+            if raw_check is not None:
+                check = raw_check.check(
+                    point, os.path.join(out_directory, point.full_out_name)
+                )
+                if not check["ok"]:
+                    failure = f"Raw data check failed: {check['reason']}"
+                    if metrics is not None:
+                        metrics.increment("raw_check_failures")
+        if failure is None:
+            print(
+                f"Acquisition successful with {lost_info['lost_percent']}% data lost."
+            )
+            break
+        if attempt < ACQ_ATTEMPTS:
+            print(f"{failure} -> retrying acquisition...")
+            if metrics is not None:
+                metrics.increment("retries")
+            time.sleep(2)
+        else:
+            print(
+                f"{failure} after {ACQ_ATTEMPTS} attempts -> giving up and continuing."
+            )
+    file_dir = os.path.join(out_directory, point.full_out_name)
+    if raw_check is not None:
+        # the run kept, accepted or not, is the reference of the next iteration
+        raw_check.accept(point, raw_check.check(point, file_dir)["rate"])
+    record_run_settings(file_dir, snapshot_hash)
+    return lost_info
+
+
+def apply_settings(scan_config: ScanConfig, point: ScanPoint) -> None:
+    """Write the settings that change at this point."""
+    # the multiplexed threshold was set per channel group before the scan
+    disc_keys = [
+        key
+        for key, value in point.settings_diff.items()
+        if key.startswith("vth_") and value != MULTIPLEXED
+    ]
+    for key in disc_keys:
+        scan_config.disc_settings.set_threshold(point.settings_diff[key], key)
+    if disc_keys:
+        scan_config.disc_settings.write_disc_settings()
+    if (
+        scan_config.yaml_dict.get("bias_sweep")
+        and "over_voltage" in point.settings_diff
+    ):
+        scan_config.bias_settings.set_overvoltage(point.over_voltage)
+        scan_config.bias_settings.write_bias_settings()
+    v_bias = point.over_voltage + scan_config.yaml_dict["break_voltage"]
+    t1, t2, e = [
+        "the channel groups" if t == MULTIPLEXED else t
+        for t in [point.vth_t1, point.vth_t2, point.vth_e]
+    ]
+    print(
+        f"Setting bias to {v_bias}V, T1 to {t1}, T2 to {t2}, "
+        f"E to {e} at iteration {point.iteration}"
+    )
+
+
+def write_log_header(plan: ScanPlan) -> None:
+    """Write the header of the scan log, with the motor names if any."""
+    with open(plan.log_file, "a") as f:
+        f.write(
+            "\t".join(["file_name"] + [name + "_mm/rev" for name in plan.motor_names])
+            + "\n"
+        )
+
+
+def run_plan(
+    plan: ScanPlan,
+    scan_config: ScanConfig,
+    petsys_commands: Commands,
+    output_manager: OutputManager,
+    metrics: ScanMetrics = None,
+    cube: ResultCube = None,
+) -> None:
+    """Replay the compiled plan on the hardware."""
+    motors = scan_config.motors or []
+    write_log_header(plan)
+    if metrics is not None:
+        metrics.update(
+            total_points=len(plan.points),
+            acquire_queue=len(plan.points),
+            eta_seconds=plan.predicted_duration,
+        )
+
+    iteration_times = []
+    total_iterations = len(plan.points)
+    # predicted motion left after each point, motion is not part of the iteration times
+    remaining_motion_times = [
+        sum(p.motion_time for p in plan.points[i + 1 :])
+        for i in range(total_iterations)
+    ]
+    current_targets = [motor.current_steps for motor in motors]
+    raw_check = RawCheck(scan_config.yaml_dict, plan.acq_time)
+    state = {point.index: {} for point in plan.points}
+    settling = None
+    if scan_config.yaml_dict.get("bias_sweep"):
+        settling = BiasSettling(scan_config.yaml_dict, petsys_commands)
+
+    def move(point: ScanPoint) -> None:
+        for i, (motor, target, position) in enumerate(
+            zip(motors, point.step_targets, point.positions)
+        ):
+            if target != current_targets[i]:
+                motor.move_motor_to(target)
+                current_targets[i] = target
+            motor.current_position = position
+            print_motor_position(motor)
+        if metrics is not None:
+            metrics.update(
+                point_index=point.index,
+                motor_positions={m.motor_name: m.current_position for m in motors},
+            )
+
+    def acquire(point: ScanPoint) -> None:
+        # Record the start time of the iteration
+        state[point.index]["start_time"] = time.time()
+        # a stripe on a full disk is replaced by one with enough space
+        out_directory = output_manager.raw_directory(
+            os.path.dirname(point.file_dir), plan.acq_time
+        )
+        file_dir = os.path.join(out_directory, point.full_out_name)
+        state[point.index]["file_dir"] = file_dir
+        lost_info = acquire_point(
+            petsys_commands,
+            scan_config,
+            point,
+            plan.split_time,
+            out_directory,
+            metrics,
+            raw_check,
+        )
+        size = output_manager.record_run(file_dir, plan.acq_time)
+        if cube is not None:
+            live_time = plan.acq_time * (1 - lost_info["lost_percent"] / 100)
+            cube.update(
+                point,
+                raw_bytes=size,
+                lost_percent=lost_info["lost_percent"],
+                live_time=live_time,
+                # estimated from the raw size until the run is processed
+                rate=size / RAW_BYTES_PER_EVENT / live_time if live_time else math.nan,
+            )
+        print("------------------------------------------")
+
+    def settle(point: ScanPoint) -> None:
+        time.sleep(2)
+        if point.sleep_after:
+            print(f"Sleeping for {point.sleep_after} seconds")
+            time.sleep(point.sleep_after)
+
+    def log(point: ScanPoint) -> None:
+        with open(plan.log_file, "a") as f:
+            f.write(
+                "\t".join(
+                    [state[point.index]["file_dir"]] + [str(p) for p in point.positions]
+                )
+                + "\n"
+            )
+
+        # Record the end time of the iteration, and add it to the list
+        iteration_times.append(time.time() - state[point.index]["start_time"])
+        eta = estimate_remaining_time(
+            iteration_times,
+            total_iterations,
+            point.index + 1,
+            string_process="acquire_data",
+            extra_remaining_time=remaining_motion_times[point.index],
+        )
+        if metrics is not None:
+            metrics.update(
+                eta_seconds=eta,
+                acquire_queue=total_iterations - point.index - 1,
+                bytes_written=sum(output_manager.run_bytes),
+                acquisition_seconds=metrics.status["acquisition_seconds"]
+                + plan.acq_time,
+            )
+
+    # Only the DAQ needs the motion and the settings of its point; they run
+    # together, after the previous DAQ, while the previous point settles and
+    # is logged. A bias change is probed once the motors are in place.
+    graph = TaskGraph()
+    previous = None
+    previous_voltage = 0.0  # bias off before the scan
+    for point in plan.points:
+        i = point.index
+        previous_daq = f"daq{previous.index}" if previous else None
+        previous_settle = f"settle{previous.index}" if previous else None
+        previous_log = f"log{previous.index}" if previous else None
+        graph.add(f"move{i}", lambda p=point: move(p), [previous_daq])
+        graph.add(
+            f"settings{i}",
+            lambda p=point: apply_settings(scan_config, p),
+            [previous_daq],
+        )
+        bias_settle = None
+        if settling is not None and "over_voltage" in point.settings_diff:
+            bias_settle = graph.add(
+                f"bias{i}",
+                lambda v_from=previous_voltage, v_to=point.over_voltage: settling.settle(
+                    v_from, v_to
+                ),
+                [f"move{i}", f"settings{i}"],
+            )
+            previous_voltage = point.over_voltage
+        graph.add(
+            f"daq{i}",
+            lambda p=point: acquire(p),
+            [f"move{i}", f"settings{i}", bias_settle, previous_settle],
+        )
+        graph.add(f"settle{i}", lambda p=point: settle(p), [f"daq{i}"])
+        graph.add(f"log{i}", lambda p=point: log(p), [f"settle{i}", previous_log])
+        previous = point
+    graph.run()
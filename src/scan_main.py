@@ -0,0 +1,613 @@
+"""Run the scan with the parameters specified in the YAMLCONF file for any
+PETsys setup.
+Usage:
+    main.py YAMLCONF [-m MODE] [--plan-only] [--append-log]
+    main.py batch YAMLCONF... [-m MODE] [--plan-only]
+    main.py multi YAMLCONF... [-m MODE] [--plan-only] [--port PORT]
+    main.py queue YAMLCONF
+    main.py worker QUEUEDIR
+    main.py resort YAMLCONF [--window NS]
+    main.py report YAMLCONF
+    main.py monitor YAMLCONF
+
+Arguments:
+    YAMLCONF  File with all parameters to take into account in the scan. The
+              batch command runs several scans sharing the motors and settings,
+              ordered to minimize the motor travel and bias changes.
+              The multi command scans several independent systems (each
+              with its own petsys_directory, config_directory and motors)
+              at the same time, one process per system, with a combined
+              status in multi_status.json.
+              The queue command turns the acquired runs of a scan into
+              conversion jobs in <out_name>_queue.
+              The resort command builds the coincidences of every run from
+              its 'singles' binary output, without the PETsys converter.
+              The report command renders the plots of a scan (spectra, rate
+              curves and maps) into <out_name>_report/index.html.
+              The monitor command prints the event rate of the live stream
+              of a scan being processed (live_stream in the YAML).
+    QUEUEDIR  Queue directory drained by a worker. Any number of workers,
+              on any host sharing the file system, can drain a queue.
+
+Options:
+    -h --help     Show this screen.
+    -m MODE       Mode to run the scan. Can be 'acquire', 'process' or 'both' [default: both]
+    --plan-only   Compile and print the scan plan without touching the hardware.
+    --append-log  Append to an existing scan log instead of asking to delete it.
+    --window NS   Coincidence window (ns) of resort [default: 20]
+    --port PORT   Port serving the combined metrics of multi, 0 for none [default: 0]
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from docopt import docopt
+import pandas as pd
+from typing import Any, Dict, List
+import glob
+import os
+
+from src.archive import Archiver
+from src.calibration import calibrate_run
+from src.cube import ResultCube
+from src.coincidence import CoincidenceRules, resort_run
+from src.decimate import decimate_run
+from src.text_records import convert_text_run
+from src.time_index import index_run
+from src.batch import (
+    load_jobs,
+    load_settings,
+    order_jobs,
+    print_batch,
+    session_motors,
+)
+from src.metrics import ScanMetrics
+from src.multi import load_systems, print_systems, run_systems
+from src.stream import monitor, open_stream, tail_run
+from src.multiplex import demultiplex_run, setup_multiplexing
+from src.settings import BiasSettings
+from src.settings import DiscSettings
+from src.settings import Commands
+from src.cli import build_motors, load_yaml
+from src.config import ScanConfig, get_ref_params
+from src.plan import compile_scan, get_iterables, print_plan, validate_plan
+from src.scan import print_motor_position, run_plan
+from src.output import OutputManager
+from src.records import binary_output, data_files, yaml_record_dtype
+from src.report import make_report
+from src.processing import (
+    ProcessingScheduler,
+    load_conversion_speed,
+    save_conversion_speed,
+)
+from src.utils import estimate_remaining_time, format_duration
+from src.work_queue import WorkQueue, run_worker
+from src.motor_control import MotorControl, find_serial_port
+
+
+def confirm_file_deletion(file_path: str) -> None:
+    if os.path.exists(file_path):
+        confirm = ""
+        while confirm.lower() not in ["y", "n"]:
+            confirm = input(
+                f"The file {file_path} already exists. Do you want to delete it? (y/n): "
+            )
+            if confirm.lower() not in ["y", "n"]:
+                print("Invalid option.")
+        if confirm.lower() == "y":
+            os.remove(file_path)
+        elif confirm.lower() == "n":
+            print(f"Appending to the end of the file with new elements.")
+
+
+def process_files(
+    petsys_commands: Commands,
+    file_path: str,
+    split_time: float,
+    output_manager: OutputManager = None,
+    archiver: Archiver = None,
+    metrics: ScanMetrics = None,
+    cube: ResultCube = None,
+) -> None:
+    with open(file_path, "r") as f:
+        next(f)  # Skip the header
+        file_names = [line.split("\t")[0].strip() for line in f]
+    yaml_dict = petsys_commands.dictionary
+    workers = yaml_dict.get("process_workers", 1)
+    # the processed output keeps the striping of the log order
+    run_indexes = {full_out_name: i for i, full_out_name in enumerate(file_names)}
+    scheduler = ProcessingScheduler(file_names, workers)
+    makespan = scheduler.predict_makespan(load_conversion_speed(yaml_dict))
+    print(
+        f"Processing {len(file_names)} runs ({scheduler.total_bytes() / 1e9:.2f} GB) "
+        f"with {workers} worker(s), largest first. Predicted time: "
+        + (format_duration(makespan) if makespan else "unknown")
+    )
+    # initialize a list to store the time each iteration takes
+    iteration_times = []
+    converted_bytes = []
+    converted_times = []
+    # total number of iterations
+    total_iterations = len(file_names)
+    # the archiver and the progress are shared by the workers
+    lock = threading.Lock()
+    # the converted events are published while they are written, if asked
+    stream = open_stream(yaml_dict)
+
+    def convert_runs(worker: int) -> None:
+        while True:
+            full_out_name = scheduler.next_run(worker)
+            if full_out_name is None:
+                return
+            # Record the start time of the iteration
+            start_time = time.time()
+
+            # leave the disk bandwidth to the DAQ if it is saturated
+            processed_directory = None
+            if output_manager is not None:
+                output_manager.throttle()
+                processed_directory = output_manager.processed_directory(
+                    run_indexes[full_out_name]
+                )
+            if archiver is not None:
+                # raw files archived by a previous run are decompressed first
+                with lock:
+                    archiver.restore(full_out_name)
+            if stream is not None:
+                stop_tail = threading.Event()
+                tail = threading.Thread(
+                    target=tail_run,
+                    args=(
+                        stream,
+                        petsys_commands.processed_name(
+                            full_out_name, processed_directory
+                        ),
+                        stop_tail,
+                    ),
+                )
+                tail.start()
+            # the conversion speed is measured on the conversion alone
+            conversion_start = time.time()
+            success = petsys_commands.process_data(
+                full_out_name, split_time=split_time, out_directory=processed_directory
+            )
+            if success:
+                convert_text_run(petsys_commands, full_out_name, processed_directory)
+            conversion_seconds = time.time() - conversion_start
+            if stream is not None:
+                stop_tail.set()
+                tail.join()
+            if success:
+                # calibrated first, the energy_window of the decimation and
+                # of the coincidences is in calibrated energy
+                calibrate_run(petsys_commands, full_out_name, processed_directory)
+                # keep only `fraction` percent of the events, if asked
+                decimate_run(petsys_commands, full_out_name, processed_directory)
+                # time-range index of the (split) output
+                index_run(petsys_commands, full_out_name, processed_directory)
+                demultiplex_run(
+                    petsys_commands,
+                    full_out_name,
+                    processed_directory,
+                    (
+                        cube.value(full_out_name, "live_time")
+                        if cube is not None
+                        else None
+                    ),
+                )
+                if cube is not None and binary_output(yaml_dict):
+                    counts = (
+                        sum(
+                            os.path.getsize(f)
+                            for f in data_files(
+                                petsys_commands.processed_name(
+                                    full_out_name, processed_directory
+                                )
+                            )
+                        )
+                        // yaml_record_dtype(yaml_dict).itemsize
+                    )
+                    live_time = cube.value(full_out_name, "live_time")
+                    with lock:
+                        cube.update_run(
+                            full_out_name,
+                            counts=counts,
+                            rate=counts / live_time if live_time else float("nan"),
+                        )
+            if success and archiver is not None:
+                processed_files = glob.glob(
+                    petsys_commands.processed_name(full_out_name, processed_directory)
+                    + "*"
+                )
+                with lock:
+                    archiver.submit(full_out_name, processed_files)
+            elif not success:
+                print(f"Conversion of {full_out_name} failed, raw data kept as is.")
+
+            # Record the end time of the iteration, and add it to the list
+            end_time = time.time()
+            with lock:
+                iteration_times.append(end_time - start_time)
+                if success:
+                    converted_bytes.append(scheduler.sizes[full_out_name])
+                    converted_times.append(conversion_seconds)
+                eta = estimate_remaining_time(
+                    iteration_times,
+                    total_iterations,
+                    len(iteration_times),
+                    string_process="process_data",
+                    parallel=workers,
+                )
+            if metrics is not None:
+                metrics.update(
+                    process_queue=total_iterations - len(iteration_times),
+                    eta_seconds=eta,
+                )
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(convert_runs, range(workers)))
+    finally:
+        if stream is not None:
+            stream.close()
+    save_conversion_speed(yaml_dict, sum(converted_bytes), sum(converted_times))
+    if archiver is not None:
+        archiver.close()
+
+
+def restore_processed_output(yaml_dict: Dict[str, Any], log_file: str) -> None:
+    """Decompress the processed output archived with 'archive: all' before it
+    is read again."""
+    if yaml_dict.get("archive", "none") != "all":
+        return
+    with open(log_file) as f:
+        next(f)  # Skip the header
+        file_names = [line.split("\t")[0].strip() for line in f]
+    petsys_commands = Commands(yaml_dict)
+    output_manager = OutputManager(yaml_dict)
+    archiver = Archiver(
+        yaml_dict,
+        os.path.join(
+            yaml_dict["out_directory"], yaml_dict["out_name"] + "_archive.json"
+        ),
+    )
+    for i, full_out_name in enumerate(file_names):
+        archiver.restore_processed(
+            petsys_commands.processed_name(
+                full_out_name, output_manager.processed_directory(i)
+            )
+        )
+
+
+def move_motors_to_home_and_close(motors: List[MotorControl]) -> None:
+    for motor in motors:
+        motor.move_to_home()
+        print_motor_position(motor)
+        motor.close()
+
+
+def close_motors(motors: List[MotorControl]) -> None:
+    for motor in motors:
+        motor.close()
+
+
+def run_batch(yaml_files: List[str], mode: str, plan_only: bool = False) -> None:
+    """Run several scans with one motor session, processing each finished scan
+    while the next one is acquired."""
+    ordered_jobs = order_jobs(load_jobs(yaml_files))
+    for job, _ in ordered_jobs:
+        print_plan(job.plan)
+    print_batch(ordered_jobs)
+    if plan_only:
+        return
+    if mode not in ["acquire", "process", "both"]:
+        print("Mode [-m] not valid. You can choose 'acquire', 'process' o 'both'")
+        return
+    if mode != "process":
+        # ask everything up front, the batch runs unattended
+        for job, _ in ordered_jobs:
+            confirm_file_deletion(job.plan.log_file)
+
+    current_dir = os.getcwd()
+    os.chdir(ordered_jobs[0][0].yaml_dict["petsys_directory"])
+    settings_cache = {}
+    motor_session = {}
+    motors_serial = None
+    # a single worker keeps the conversions in order and off the DAQ's CPU
+    processing = ThreadPoolExecutor(max_workers=1)
+    pending = []
+    try:
+        for job, _ in ordered_jobs:
+            yaml_dict, scan_plan = job.yaml_dict, job.plan
+            print(f"Starting scan {job.yaml_file}")
+            if not os.path.isdir(yaml_dict["out_directory"]):
+                os.makedirs(yaml_dict["out_directory"])
+            petsys_commands = Commands(yaml_dict)
+            output_manager = OutputManager(yaml_dict)
+            archiver = Archiver(
+                yaml_dict,
+                os.path.join(
+                    yaml_dict["out_directory"], yaml_dict["out_name"] + "_archive.json"
+                ),
+            )
+            # scans overlap, so only the status files are written (no metrics_port)
+            metrics = ScanMetrics(
+                os.path.abspath(
+                    os.path.join(
+                        yaml_dict["out_directory"],
+                        yaml_dict["out_name"] + "_status.json",
+                    )
+                )
+            )
+            cube = ResultCube.for_scan(yaml_dict, scan_plan)
+
+            if mode != "process":
+                output_manager.check_capacity(
+                    [point.file_dir for point in scan_plan.points], scan_plan.acq_time
+                )
+                scan_plan.save(
+                    os.path.join(
+                        yaml_dict["out_directory"], yaml_dict["out_name"] + ".plan.json"
+                    )
+                )
+                bias_settings, disc_settings = load_settings(yaml_dict, settings_cache)
+                motors = []
+                sweep_motor = None
+                if yaml_dict["flag_motor"]:
+                    if motors_serial is None:
+                        motors_serial = find_serial_port(yaml_dict["COM_port"])
+                    motors = session_motors(motors_serial, job, motor_session)
+                    if scan_plan.sweep_motor:
+                        sweep_motor = motors[-1]
+                        sweep_motor.move_motor_to(
+                            sweep_motor.position_to_steps(sweep_motor.motor_start)
+                        )
+                        print_motor_position(sweep_motor)
+                scan_conf = ScanConfig(
+                    bias_settings,
+                    disc_settings,
+                    yaml_dict,
+                    scan_plan.log_file,
+                    get_iterables(yaml_dict),
+                    [m for m in motors if m is not sweep_motor] or None,
+                    sweep_motor,
+                )
+                run_plan(
+                    scan_plan,
+                    scan_conf,
+                    petsys_commands,
+                    output_manager,
+                    metrics,
+                    cube,
+                )
+
+            if mode != "acquire":
+                pending.append(
+                    processing.submit(
+                        process_files,
+                        petsys_commands,
+                        scan_plan.log_file,
+                        scan_plan.split_time,
+                        output_manager,
+                        archiver,
+                        metrics,
+                        cube,
+                    )
+                )
+        for future in pending:
+            future.result()
+    finally:
+        processing.shutdown()
+        close_motors(motor_session.values())
+        os.chdir(current_dir)
+
+
+def main(argv: List[str] = None) -> None:
+    pd.set_option("display.max_rows", None)
+    args = docopt(__doc__, argv=argv)
+    mode = args["-m"]
+    if args["batch"]:
+        run_batch(args["YAMLCONF"], mode, args["--plan-only"])
+        return
+    if args["worker"]:
+        run_worker(args["QUEUEDIR"])
+        return
+    if args["multi"]:
+        systems = load_systems(args["YAMLCONF"])
+        print_systems(systems)
+        if args["--plan-only"]:
+            return
+        if mode not in ["acquire", "process", "both"]:
+            print("Mode [-m] not valid. You can choose 'acquire', 'process' o 'both'")
+            return
+        if mode != "process":
+            # ask everything up front, the systems run unattended
+            for system in systems:
+                confirm_file_deletion(system.plan.log_file)
+        if not run_systems(systems, mode, int(args["--port"])):
+            print("Some systems did not finish, see their output.")
+        return
+    yaml_conf = args["YAMLCONF"][0]
+
+    yaml_dict = load_yaml(yaml_conf)
+
+    # expand the whole scan before touching the hardware
+    scan_plan = compile_scan(yaml_dict)
+    validate_plan(scan_plan, yaml_dict)
+    print_plan(scan_plan)
+    if args["--plan-only"]:
+        return
+    if args["report"]:
+        restore_processed_output(yaml_dict, scan_plan.log_file)
+        make_report(yaml_dict, scan_plan)
+        return
+    if args["monitor"]:
+        monitor(yaml_dict)
+        return
+    if args["resort"]:
+        output_manager = OutputManager(yaml_dict)
+        rules = CoincidenceRules.from_yaml(yaml_dict)
+        with open(scan_plan.log_file) as f:
+            next(f)  # Skip the header
+            file_names = [line.split("\t")[0].strip() for line in f]
+        restore_processed_output(yaml_dict, scan_plan.log_file)
+        for i, full_out_name in enumerate(file_names):
+            resort_run(
+                Commands(yaml_dict),
+                full_out_name,
+                output_manager.processed_directory(i),
+                float(args["--window"]),
+                rules,
+            )
+        return
+    if args["queue"]:
+        WorkQueue.create(
+            os.path.join(yaml_dict["out_directory"], yaml_dict["out_name"] + "_queue"),
+            yaml_dict,
+            scan_plan.log_file,
+            scan_plan.split_time,
+        )
+        return
+
+    dir_path = yaml_dict["config_directory"]
+    current_dir = os.getcwd()
+
+    # get the bias and discriminator settings if they exist, otherwise a empty list is returned
+    bias_ref_params, disc_ref_params = get_ref_params(yaml_dict)
+
+    # create the bias and discriminator settings objects with the reference detector parameters
+    bias_settings = BiasSettings(yaml_dict, bias_ref_params)
+    if yaml_dict.get("bias_sweep"):
+        bias_settings.set_fixedvoltages()
+    disc_settings = DiscSettings(yaml_dict, disc_ref_params)
+    disc_settings.set_fixedthresholds()
+    setup_multiplexing(disc_settings, yaml_dict)
+
+    petsys_commands = Commands(yaml_dict)
+    output_manager = OutputManager(yaml_dict)
+    archiver = Archiver(
+        yaml_dict,
+        os.path.join(
+            yaml_dict["out_directory"], yaml_dict["out_name"] + "_archive.json"
+        ),
+    )
+    # live status of the scan, also served over HTTP if metrics_port is set
+    metrics = ScanMetrics(
+        os.path.abspath(
+            os.path.join(
+                yaml_dict["out_directory"], yaml_dict["out_name"] + "_status.json"
+            )
+        ),
+        yaml_dict.get("metrics_port", 0),
+    )
+
+    # Create a list of iterables to iterate over
+    iterables = get_iterables(yaml_dict)
+
+    log_file = scan_plan.log_file
+
+    # Create the output directory if it doesn't exist
+    if not os.path.isdir(yaml_dict["out_directory"]):
+        os.makedirs(yaml_dict["out_directory"])
+    # per-point results over the scan axes, resumed if it exists
+    cube = ResultCube.for_scan(yaml_dict, scan_plan)
+
+    # change to the petsys directory to run the acquire_sipm_data command or process files
+    petsys_directory = yaml_dict["petsys_directory"]
+    os.chdir(petsys_directory)
+
+    split_time = scan_plan.split_time
+
+    if mode == "acquire" or mode == "both":
+        if args["--append-log"]:
+            if os.path.exists(log_file):
+                print(f"Appending to the end of {log_file}.")
+        else:
+            confirm_file_deletion(log_file)
+        output_manager.check_capacity(
+            [point.file_dir for point in scan_plan.points], scan_plan.acq_time
+        )
+        scan_plan.save(
+            os.path.join(
+                yaml_dict["out_directory"], yaml_dict["out_name"] + ".plan.json"
+            )
+        )
+
+        # Check if the motor flag is set to True
+        if not yaml_dict["flag_motor"]:
+            print("No motors will be used in this scan.")
+            no_motor_scan_conf = ScanConfig(
+                bias_settings, disc_settings, yaml_dict, log_file, iterables
+            )
+            run_plan(
+                scan_plan,
+                no_motor_scan_conf,
+                petsys_commands,
+                output_manager,
+                metrics,
+                cube,
+            )
+        else:
+            # Create a MotorControl instance for each motor
+            motors_active = list(scan_plan.motor_names)
+            if scan_plan.sweep_motor:
+                motors_active.append(scan_plan.sweep_motor)
+            print(motors_active)
+            motors = build_motors(yaml_dict, motors_active)
+            for motor in motors:
+                motor.find_home()
+            sweep_motor = None
+            if scan_plan.sweep_motor:
+                sweep_motor = motors[-1]
+                sweep_motor.move_motor_to(
+                    sweep_motor.position_to_steps(sweep_motor.motor_start)
+                )
+                print_motor_position(sweep_motor)
+            motor_scan_conf = ScanConfig(
+                bias_settings,
+                disc_settings,
+                yaml_dict,
+                log_file,
+                iterables,
+                [m for m in motors if m is not sweep_motor],
+                sweep_motor,
+            )
+            run_plan(
+                scan_plan,
+                motor_scan_conf,
+                petsys_commands,
+                output_manager,
+                metrics,
+                cube,
+            )
+            close_motors(motors)
+
+        if mode == "both":
+            process_files(
+                petsys_commands,
+                log_file,
+                split_time,
+                output_manager,
+                archiver,
+                metrics,
+                cube,
+            )
+    elif mode == "process":
+        process_files(
+            petsys_commands,
+            log_file,
+            split_time,
+            output_manager,
+            archiver,
+            metrics,
+            cube,
+        )
+    else:
+        print("Mode [-m] not valid. You can choose 'acquire', 'process' o 'both'")
+    metrics.close()
+    # change back to the original directory
+    os.chdir(current_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,9 @@ import pandas as pd
 import shutil
 from typing import Dict, Any
 
+from .reader import pairs_mask
+from .snapshot import run_config
+
 
 class BiasSettings:
     def __init__(self, dictionary: Dict[str, Any], bias_ref_params: list):
@@ -15,36 +18,24 @@ class BiasSettings:
         self.bias_df = pd.read_csv(
             self.bias_settings_path + self.bias_settings_file_name, sep="\t"
         )
+        # rows of bias_settings.tsv biasing the reference detector
+        self.ref_mask = pairs_mask(
+            self.bias_df["slotID"].to_numpy(),
+            self.bias_df["channelID"].to_numpy(),
+            list(self.bias_ref_params),
+        )
 
     def set_fixedvoltages(self) -> None:
         self.bias_df["Pre-breakdown"] = self.dictionary["prebreak_voltage"]
         self.bias_df["Breakdown"] = self.dictionary["break_voltage"]
         if self.bias_ref_params:
             ref_det_volt = self.dictionary["ref_det_volt"]
-            for slot, channel in self.bias_ref_params:
-                self.bias_df.loc[
-                    (self.bias_df["slotID"] == slot)
-                    & (self.bias_df["channelID"] == channel),
-                    "Pre-breakdown",
-                ] = ref_det_volt[0]
-                self.bias_df.loc[
-                    (self.bias_df["slotID"] == slot)
-                    & (self.bias_df["channelID"] == channel),
-                    "Breakdown",
-                ] = ref_det_volt[1]
-                self.bias_df.loc[
-                    (self.bias_df["slotID"] == slot)
-                    & (self.bias_df["channelID"] == channel),
-                    "Overvoltage",
-                ] = ref_det_volt[2]
+            self.bias_df.loc[
+                self.ref_mask, ["Pre-breakdown", "Breakdown", "Overvoltage"]
+            ] = ref_det_volt[:3]
 
     def set_overvoltage(self, voltage: float) -> None:
-        self.bias_df.loc[
-            ~self.bias_df[["slotID", "channelID"]]
-            .apply(tuple, axis=1)
-            .isin(self.bias_ref_params),
-            "Overvoltage",
-        ] = voltage
+        self.bias_df.loc[~self.ref_mask, "Overvoltage"] = voltage
 
     def write_bias_settings(self) -> None:
         new_bias_settings_path = self.dictionary["config_directory"]
@@ -91,6 +82,11 @@ class DiscSettings:
             threshold
         )
 
+    def set_group_thresholds(self, key: str, groups, thresholds: list) -> None:
+        """Threshold thresholds[g] on the rows of group g (groups < 0 untouched)."""
+        in_group = groups >= 0
+        self.disc_df.loc[in_group, key] = [thresholds[g] for g in groups[in_group]]
+
     def write_disc_settings(self) -> None:
         new_disc_settings_path = self.dictionary["config_directory"]
         new_disc_settings_file_name = "disc_settings.tsv"
@@ -107,14 +103,20 @@ class Commands:
     def __init__(self, dictionary: Dict[str, Any]):
         self.dictionary = dictionary
 
-    def acquire_data(self, full_out_name: str) -> None:
-        if not os.path.isdir(self.dictionary["out_directory"]):
-            os.makedirs(self.dictionary["out_directory"])
+    def acquire_data(
+        self, full_out_name: str, acq_time: float = None, out_directory: str = None
+    ) -> None:
+        if out_directory is None:
+            out_directory = self.dictionary["out_directory"]
+        if not os.path.isdir(out_directory):
+            os.makedirs(out_directory)
+        if acq_time is None:
+            acq_time = self.dictionary["time"]
         hw_trigger = "--enable-hw-trigger" if self.dictionary["hw_trigger"] else ""
         command = (
             f"./acquire_sipm_data --config {self.dictionary['config_directory']}config.ini "
-            f"--mode {self.dictionary['mode']} --time {self.dictionary['time']} "
-            f"-o {self.dictionary['out_directory']}{full_out_name} {hw_trigger}"
+            f"--mode {self.dictionary['mode']} --time {acq_time} "
+            f"-o {os.path.join(out_directory, full_out_name)} {hw_trigger}"
         )
         # Regex to capture "all events were lost for 1 (  0.0%) frames"
         pattern = re.compile(
@@ -149,12 +151,30 @@ class Commands:
         # print(command + "\n")
         # os.system(command)
 
-    def process_data(self, full_out_name: str, split_time: float = -1) -> None:
-        data_type_mapping = {
-            "coincidence": ("_coinc", "./convert_raw_to_coincidence"),
-            "single": ("_single", "./convert_raw_to_single"),
-            "group": ("_group", "./convert_raw_to_group"),
-        }
+    data_type_mapping = {
+        "coincidence": ("_coinc", "./convert_raw_to_coincidence"),
+        "singles": ("_single", "./convert_raw_to_singles"),
+        "group": ("_group", "./convert_raw_to_group"),
+    }
+
+    def processed_name(self, full_out_name: str, out_directory: str = None) -> str:
+        """Base name of the processed output of a run."""
+        sufix, _ = self.data_type_mapping[self.dictionary["data_type"]]
+        # processed output next to the raw data unless another directory is given
+        out_base = (
+            os.path.join(out_directory, os.path.basename(full_out_name))
+            if out_directory
+            else full_out_name
+        )
+        return (
+            out_base + sufix + "Compact"
+            if self.dictionary["data_compact"]
+            else out_base + sufix
+        )
+
+    def process_data(
+        self, full_out_name: str, split_time: float = -1, out_directory: str = None
+    ) -> bool:
         data_format_compact = (
             ["--writeTextCompact", "Compact"]
             if self.dictionary["data_compact"]
@@ -165,20 +185,18 @@ class Commands:
             "binary": f"--writeBinary{data_format_compact[1]}",
             "root": "--writeRoot",
         }
-        sufix, process_command = data_type_mapping[self.dictionary["data_type"]]
+        _, process_command = self.data_type_mapping[self.dictionary["data_type"]]
         output_format = data_format_mapping[self.dictionary["data_format"]]
-        process_out_name = (
-            full_out_name + sufix + "Compact"
-            if self.dictionary["data_compact"]
-            else full_out_name + sufix
-        )
+        if out_directory and not os.path.isdir(out_directory):
+            os.makedirs(out_directory)
+        process_out_name = self.processed_name(full_out_name, out_directory)
         split_string = f"--splitTime {split_time}" if split_time > 0 else ""
         command = (
-            f"{process_command} --config {self.dictionary['config_directory']}config.ini "
+            f"{process_command} --config {run_config(self.dictionary, full_out_name)} "
             f"-i {full_out_name} "
             f"-o {process_out_name} "
             f"--writeMultipleHits {self.dictionary['hits']} {output_format} {split_string} "
         )
 
         # print(command + "\n")
-        os.system(command)
+        return os.system(command) == 0
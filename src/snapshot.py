@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from typing import Any, Dict
+
+# settings tables written by the scan, copied into every snapshot
+SETTINGS_FILES = ["bias_settings.tsv", "disc_settings.tsv"]
+STORE_DIRECTORY = "settings_store"
+RUN_SUFFIX = "_settings.json"  # snapshot of a run, next to its raw files
+_KEY_VALUE = re.compile(r"^(\s*[^#;=\s][^=]*=\s*)(.*?)(\s*)$")
+
+
+def store_directory(yaml_dict: Dict[str, Any]) -> str:
+    return os.path.join(yaml_dict["out_directory"], STORE_DIRECTORY)
+
+
+def snapshot_config(config_directory: str) -> str:
+    """config.ini of a snapshot: the settings tables are the copies next to it
+    (%CDIR%) and every other table is the one of the config directory."""
+    config_directory = os.path.abspath(config_directory)
+    settings_paths = {
+        os.path.join(config_directory, name): name for name in SETTINGS_FILES
+    }
+    lines = []
+    with open(os.path.join(config_directory, "config.ini")) as f:
+        for line in f.read().splitlines():
+            match = _KEY_VALUE.match(line)
+            if match and match.group(2):
+                value = match.group(2).replace("%CDIR%", config_directory)
+                name = settings_paths.get(os.path.normpath(value))
+                if name is not None:
+                    value = "%CDIR%/" + name
+                line = match.group(1) + value + match.group(3)
+            lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def snapshot_settings(yaml_dict: Dict[str, Any]) -> str:
+    """Store the settings in effect (config.ini and the settings tables) and
+    return their hash. Identical settings are stored once."""
+    config_directory = yaml_dict["config_directory"]
+    contents = {"config.ini": snapshot_config(config_directory).encode()}
+    for name in SETTINGS_FILES:
+        with open(os.path.join(config_directory, name), "rb") as f:
+            contents[name] = f.read()
+    digest = hashlib.sha256()
+    for name, content in contents.items():
+        digest.update(name.encode() + b"\0" + content + b"\0")
+    snapshot_hash = digest.hexdigest()[:16]
+
+    snapshot_dir = os.path.join(store_directory(yaml_dict), snapshot_hash)
+    if not os.path.isdir(snapshot_dir):
+        # written aside and renamed, a snapshot is complete or absent
+        tmp_dir = f"{snapshot_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(tmp_dir)
+        for name, content in contents.items():
+            with open(os.path.join(tmp_dir, name), "wb") as f:
+                f.write(content)
+        try:
+            os.rename(tmp_dir, snapshot_dir)
+        except OSError:
+            # stored meanwhile by another scan
+            shutil.rmtree(tmp_dir)
+    return snapshot_hash
+
+
+def record_run_settings(file_dir: str, snapshot_hash: str) -> None:
+    """Record the snapshot a run was acquired with."""
+    with open(file_dir + RUN_SUFFIX, "w") as f:
+        json.dump({"settings": snapshot_hash}, f)
+
+
+def run_config(yaml_dict: Dict[str, Any], full_out_name: str) -> str:
+    """config.ini to convert a run with: the one of its snapshot, or the one
+    of the config directory for runs acquired without snapshot."""
+    try:
+        with open(full_out_name + RUN_SUFFIX) as f:
+            snapshot_hash = json.load(f)["settings"]
+    except (FileNotFoundError, ValueError, KeyError):
+        return os.path.join(yaml_dict["config_directory"], "config.ini")
+    config_path = os.path.join(store_directory(yaml_dict), snapshot_hash, "config.ini")
+    assert os.path.isfile(
+        config_path
+    ), f"Settings snapshot {snapshot_hash} of {full_out_name} not found in {store_directory(yaml_dict)}"
+    return config_path
@@ -0,0 +1,262 @@
+import json
+import os
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, Iterator, NamedTuple
+
+import numpy as np
+
+from src.records import binary_output, data_files, yaml_record_dtype
+
+STREAM_SLOTS = 64  # chunks held by the ring
+STREAM_CHUNK = 16384  # records per chunk
+POLL_INTERVAL = 0.05  # seconds between polls of the tailed files and of the ring
+MAGIC = 0x50455453  # "PETS"
+# int64 header: magic, slot count, slot bytes, record size, chunks written,
+# closed flag, dtype length
+HEADER_FIELDS = 7
+HEADER_BYTES = 64
+DTYPE_BYTES = 4096  # JSON description of the records
+WRITTEN, CLOSED = 4, 5
+BEING_WRITTEN = -1
+
+
+def stream_name(yaml_dict: Dict[str, Any]) -> str:
+    """Name of the shared memory of a scan's live stream."""
+    return "petsys_" + "".join(c if c.isalnum() else "_" for c in yaml_dict["out_name"])
+
+
+class Chunk(NamedTuple):
+    seq: int  # sequence number of the chunk in the stream
+    records: np.ndarray  # view on the shared memory, valid while not lapped
+
+
+class _Ring:
+    """Views on the header, slot descriptors and slots of a stream."""
+
+    def __init__(self, shm: shared_memory.SharedMemory, slots: int, slot_bytes: int):
+        self.shm = shm
+        self.header = np.ndarray(HEADER_FIELDS, dtype=np.int64, buffer=shm.buf)
+        offset = HEADER_BYTES + DTYPE_BYTES
+        # seq of the chunk in every slot (BEING_WRITTEN while it changes), records
+        self.descriptors = np.ndarray(
+            (slots, 2), dtype=np.int64, buffer=shm.buf, offset=offset
+        )
+        offset += self.descriptors.nbytes
+        self.slots = np.ndarray(
+            (slots, slot_bytes), dtype=np.uint8, buffer=shm.buf, offset=offset
+        )
+
+    @staticmethod
+    def size(slots: int, slot_bytes: int) -> int:
+        return HEADER_BYTES + DTYPE_BYTES + slots * 16 + slots * slot_bytes
+
+
+class StreamPublisher:
+    """Single producer of a shared-memory ring of event chunks.
+
+    The producer never waits: when the ring is full the oldest chunk is
+    overwritten, and consumers that fall behind skip to the oldest chunk
+    still held.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        dtype: np.dtype,
+        slots: int = STREAM_SLOTS,
+        chunk_records: int = STREAM_CHUNK,
+    ) -> None:
+        self.dtype = dtype
+        self.chunk_records = chunk_records
+        slot_bytes = chunk_records * dtype.itemsize
+        try:
+            self.shm = shared_memory.SharedMemory(
+                name=name, create=True, size=_Ring.size(slots, slot_bytes)
+            )
+        except FileExistsError:
+            # left by a scan that did not end cleanly
+            shared_memory.SharedMemory(name=name).unlink()
+            self.shm = shared_memory.SharedMemory(
+                name=name, create=True, size=_Ring.size(slots, slot_bytes)
+            )
+        self.ring = _Ring(self.shm, slots, slot_bytes)
+        self.ring.descriptors[:, 0] = BEING_WRITTEN
+        description = json.dumps(dtype.descr).encode()
+        assert len(description) <= DTYPE_BYTES, "Record description too long"
+        self.shm.buf[HEADER_BYTES : HEADER_BYTES + len(description)] = description
+        self.ring.header[:] = [
+            MAGIC,
+            slots,
+            slot_bytes,
+            dtype.itemsize,
+            0,
+            0,
+            len(description),
+        ]
+        self.lock = threading.Lock()
+        print(f"Live event stream in shared memory '{name}'")
+
+    def publish(self, records: np.ndarray) -> None:
+        """Push records, in chunks of at most chunk_records."""
+        records = np.ascontiguousarray(records, dtype=self.dtype)
+        with self.lock:
+            slots = self.ring.slots.shape[0]
+            for start in range(0, records.size, self.chunk_records):
+                chunk = records[start : start + self.chunk_records]
+                seq = int(self.ring.header[WRITTEN])
+                slot = seq % slots
+                self.ring.descriptors[slot, 0] = BEING_WRITTEN
+                self.ring.slots[slot, : chunk.nbytes] = chunk.view(np.uint8)
+                self.ring.descriptors[slot, 1] = chunk.size
+                self.ring.descriptors[slot, 0] = seq
+                self.ring.header[WRITTEN] = seq + 1
+
+    def close(self) -> None:
+        """Tell the consumers the stream ended and free the shared memory."""
+        self.ring.header[CLOSED] = 1
+        del self.ring
+        self.shm.close()
+        self.shm.unlink()
+
+
+class StreamConsumer:
+    """Reader of a stream, in another process.
+
+    Chunks are views on the shared memory (no copy). The producer may lap a
+    slow consumer and overwrite a chunk while it is read: valid(chunk) tells
+    if the chunk was still intact after reading it, and skipped chunks are
+    counted in `dropped`.
+    """
+
+    def __init__(self, name: str, from_oldest: bool = False) -> None:
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # before Python 3.13 an attached consumer would unlink the
+            # memory on exit, leave that to the producer
+            self.shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        header = np.ndarray(HEADER_FIELDS, dtype=np.int64, buffer=self.shm.buf)
+        assert header[0] == MAGIC, f"'{name}' is not a PETsys event stream"
+        slots, slot_bytes, _, written, _, description_bytes = header[1:].tolist()
+        description = bytes(
+            self.shm.buf[HEADER_BYTES : HEADER_BYTES + description_bytes]
+        )
+        self.dtype = np.dtype([tuple(field) for field in json.loads(description)])
+        self.ring = _Ring(self.shm, slots, slot_bytes)
+        self.next_seq = max(0, written - slots) if from_oldest else written
+        self.dropped = 0
+
+    def valid(self, chunk: Chunk) -> bool:
+        slot = chunk.seq % self.ring.slots.shape[0]
+        return int(self.ring.descriptors[slot, 0]) == chunk.seq
+
+    def chunks(self, timeout: float = None) -> Iterator[Chunk]:
+        """Chunks as they are published, until the stream is closed (or no
+        chunk came for `timeout` seconds)."""
+        slots = self.ring.slots.shape[0]
+        last_chunk = time.time()
+        while True:
+            written = int(self.ring.header[WRITTEN])
+            if self.next_seq >= written:
+                if self.ring.header[CLOSED]:
+                    return
+                if timeout is not None and time.time() - last_chunk > timeout:
+                    return
+                time.sleep(POLL_INTERVAL)
+                continue
+            if written - self.next_seq > slots:
+                # drop the chunks already overwritten
+                self.dropped += written - slots - self.next_seq
+                self.next_seq = written - slots
+            seq = self.next_seq
+            self.next_seq += 1
+            slot = seq % slots
+            records = int(self.ring.descriptors[slot, 1])
+            if int(self.ring.descriptors[slot, 0]) != seq:
+                self.dropped += 1
+                continue
+            view = self.ring.slots[slot, : records * self.dtype.itemsize].view(
+                self.dtype
+            )
+            last_chunk = time.time()
+            yield Chunk(seq, view)
+
+    def close(self) -> None:
+        del self.ring
+        self.shm.close()
+
+
+def tail_run(
+    publisher: StreamPublisher, processed_name: str, stop: threading.Event
+) -> None:
+    """Publish the records appended to the (split) binary output of a run
+    until `stop` is set, then the rest of it."""
+    offsets = {}
+    itemsize = publisher.dtype.itemsize
+    while True:
+        stopping = stop.is_set()
+        for file_path in data_files(processed_name):
+            size = os.path.getsize(file_path)
+            # only whole records, the converter may be writing the last one
+            end = size - size % itemsize
+            start = offsets.get(file_path, 0)
+            if end > start:
+                with open(file_path, "rb") as f:
+                    f.seek(start)
+                    records = np.fromfile(
+                        f, dtype=publisher.dtype, count=(end - start) // itemsize
+                    )
+                publisher.publish(records)
+                offsets[file_path] = end
+        if stopping:
+            return
+        time.sleep(POLL_INTERVAL)
+
+
+def open_stream(yaml_dict: Dict[str, Any]) -> StreamPublisher:
+    """Publisher of the live stream of a scan, None if not asked for."""
+    if not yaml_dict.get("live_stream"):
+        return None
+    if not binary_output(yaml_dict):
+        print("The live stream needs binary output, not published.")
+        return None
+    return StreamPublisher(
+        stream_name(yaml_dict),
+        yaml_record_dtype(yaml_dict),
+        yaml_dict.get("stream_slots", STREAM_SLOTS),
+        yaml_dict.get("stream_chunk", STREAM_CHUNK),
+    )
+
+
+def monitor(yaml_dict: Dict[str, Any], period: float = 1.0) -> None:
+    """Print the rate of the live stream of a scan until it is closed, waiting
+    for the scan to open it."""
+    name = stream_name(yaml_dict)
+    consumer = None
+    while consumer is None:
+        try:
+            consumer = StreamConsumer(name)
+        except FileNotFoundError:
+            print(f"Waiting for the live stream '{name}'...")
+            time.sleep(5 * period)
+    time_field = [name for name in consumer.dtype.names if name.startswith("time")][0]
+    count = 0
+    last_print = time.time()
+    try:
+        for chunk in consumer.chunks():
+            events = chunk.records.size
+            if consumer.valid(chunk):
+                count += events
+            if time.time() - last_print >= period:
+                print(
+                    f"{count / (time.time() - last_print):.0f} events/s, "
+                    f"last time {int(chunk.records[time_field][-1]) / 1e12:.3f} s, "
+                    f"{consumer.dropped} chunks dropped"
+                )
+                count = 0
+                last_print = time.time()
+    finally:
+        consumer.close()
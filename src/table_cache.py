@@ -0,0 +1,52 @@
+import hashlib
+import os
+import threading
+from typing import Callable, Dict
+
+import numpy as np
+
+CACHE_SUFFIX = ".npz"  # compiled tables, next to their source file
+# entries of a cache identifying the source it was compiled from
+SOURCE_KEYS = ["source_mtime", "source_sha256"]
+
+
+def _file_hash(file_path: str) -> str:
+    with open(file_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _save(
+    cache_file: str, tables: Dict[str, np.ndarray], mtime: float, sha256: str
+) -> None:
+    # private to the writer (conversions run in parallel), np.savez adds .npz
+    tmp_file = (
+        f"{cache_file[: -len(CACHE_SUFFIX)]}.{os.getpid()}.{threading.get_ident()}"
+        f".tmp{CACHE_SUFFIX}"
+    )
+    np.savez(tmp_file, source_mtime=mtime, source_sha256=sha256, **tables)
+    os.replace(tmp_file, cache_file)
+
+
+def load_cached_tables(
+    source_file: str, compile_tables: Callable[[str], Dict[str, np.ndarray]]
+) -> Dict[str, np.ndarray]:
+    """Arrays compiled from a source file by `compile_tables`, cached next to
+    it in <source_file>.npz.
+
+    The cache is used while the source keeps its mtime or its content (sha256).
+    """
+    cache_file = source_file + CACHE_SUFFIX
+    mtime = os.path.getmtime(source_file)
+    if os.path.isfile(cache_file):
+        with np.load(cache_file) as cache:
+            cached = dict(cache)
+        tables = {key: value for key, value in cached.items() if key not in SOURCE_KEYS}
+        if float(cached["source_mtime"]) == mtime:
+            return tables
+        # touched but maybe not changed
+        if str(cached["source_sha256"]) == _file_hash(source_file):
+            _save(cache_file, tables, mtime, str(cached["source_sha256"]))
+            return tables
+    tables = compile_tables(source_file)
+    _save(cache_file, tables, mtime, _file_hash(source_file))
+    return tables
@@ -0,0 +1,154 @@
+import glob
+import io
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from src.records import DATA_EXTENSION, yaml_record_dtype
+from src.settings import Commands
+
+TEXT_CHUNK = 32 << 20  # bytes of text parsed at a time
+ROWS_SUFFIX = "_rows.json"
+
+
+def text_files(processed_name: str) -> List[str]:
+    """Text files of a processed run: the output name itself, or its parts
+    <name>_<n> when split, sorted by part number."""
+    pattern = re.compile(re.escape(processed_name) + r"(_(\d+))?$")
+    matches = [
+        (match, path)
+        for path in glob.glob(glob.escape(processed_name) + "*")
+        for match in [pattern.fullmatch(path)]
+        if match and os.path.isfile(path)
+    ]
+    return [
+        path for match, path in sorted(matches, key=lambda m: int(m[0].group(2) or -1))
+    ]
+
+
+def parse_text(data: bytes, dtype: np.dtype) -> np.ndarray:
+    """Records of whole lines of text, one record per line with the columns
+    in the order of the dtype fields.
+
+    The lines are parsed by the C parser of np.loadtxt straight into the
+    record fields, integers as such (times in ps do not fit a double).
+    """
+    if not data.strip():
+        return np.empty(0, dtype=dtype)
+    return np.loadtxt(io.BytesIO(data), dtype=dtype, ndmin=1)
+
+
+def chunk_ranges(size: int, chunk_bytes: int = TEXT_CHUNK) -> List[Tuple[int, int]]:
+    """Byte ranges splitting a file for parallel parsing."""
+    return [
+        (start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)
+    ]
+
+
+def _read_lines(path: str, start: int, end: int) -> bytes:
+    """Lines starting in [start, end) of a text file: the line cut at `start`
+    belongs to the previous range, the line cut at `end` is read to its end."""
+    with open(path, "rb") as f:
+        if start > 0:
+            f.seek(start - 1)
+            data = f.read(end - start + 1)
+            # skip the rest of the line begun before the range
+            data = data[data.find(b"\n") + 1 :] if b"\n" in data else b""
+        else:
+            data = f.read(end)
+        if data and not data.endswith(b"\n"):
+            rest = b""
+            while True:
+                block = f.read(1 << 16)
+                newline = block.find(b"\n")
+                if newline >= 0:
+                    rest += block[: newline + 1]
+                    break
+                rest += block
+                if not block:
+                    break
+            data += rest
+    return data
+
+
+def _parse_range(path: str, start: int, end: int, dtype_descr: list) -> np.ndarray:
+    dtype = np.dtype([tuple(field) for field in dtype_descr])
+    return parse_text(_read_lines(path, start, end), dtype)
+
+
+def convert_text_files(
+    text_paths: List[str],
+    dtype: np.dtype,
+    workers: int = None,
+    chunk_bytes: int = TEXT_CHUNK,
+) -> List[Dict[str, Any]]:
+    """Convert text files to packed binary records (<text file>.ldat), parsing
+    the chunks of all the files in parallel.
+
+    Returns, per file, the byte offset in the text and the first row in the
+    binary output of every chunk.
+    """
+    tasks = [
+        (path, start, end)
+        for path in text_paths
+        for start, end in chunk_ranges(os.path.getsize(path), chunk_bytes)
+    ]
+    files = {
+        path: {"text": path, "path": path + DATA_EXTENSION, "records": 0, "chunks": []}
+        for path in text_paths
+    }
+    outputs = {path: open(path + DATA_EXTENSION + ".tmp", "wb") for path in text_paths}
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # results come back in task order, so every file is written in order
+            results = pool.map(
+                _parse_range,
+                [path for path, _, _ in tasks],
+                [start for _, start, _ in tasks],
+                [end for _, _, end in tasks],
+                [dtype.descr] * len(tasks),
+            )
+            for (path, start, _), records in zip(tasks, results):
+                entry = files[path]
+                entry["chunks"].append([start, entry["records"], int(records.size)])
+                entry["records"] += int(records.size)
+                records.tofile(outputs[path])
+    finally:
+        for output in outputs.values():
+            output.close()
+    for path in text_paths:
+        os.replace(path + DATA_EXTENSION + ".tmp", path + DATA_EXTENSION)
+    return list(files.values())
+
+
+def convert_text_run(
+    petsys_commands: Commands,
+    full_out_name: str,
+    out_directory: str = None,
+    workers: int = None,
+) -> None:
+    """Convert the text output of a processed run to the binary records read by
+    the rest of the analysis, with a row index <processed name>_rows.json.
+
+    The index refers to the records as converted, before any decimation.
+    """
+    yaml_dict = petsys_commands.dictionary
+    if yaml_dict["data_format"] != "txt" or not yaml_dict.get("text_to_binary"):
+        return
+    processed_name = petsys_commands.processed_name(full_out_name, out_directory)
+    dtype = yaml_record_dtype(yaml_dict)
+    files = convert_text_files(
+        text_files(processed_name), dtype, workers or yaml_dict.get("text_workers")
+    )
+    index_path = processed_name + ROWS_SUFFIX
+    with open(index_path + ".tmp", "w") as f:
+        json.dump({"dtype": dtype.descr, "files": files}, f)
+    os.replace(index_path + ".tmp", index_path)
+    print(
+        f"Text output converted: {sum(f['records'] for f in files)} records "
+        f"in {len(files)} files"
+    )
@@ -0,0 +1,137 @@
+import json
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+
+from src.records import binary_output, data_files, time_fields, yaml_record_dtype
+from src.settings import Commands
+
+INDEX_BLOCK = 1 << 16  # records per index block
+INDEX_SUFFIX = "_index.json"
+PS_PER_S = 1e12  # PETsys times are in ps
+
+
+def _file_index(file_path: str, dtype: np.dtype, time_field: str) -> Dict[str, Any]:
+    """Time range, count and byte offset of every block of a binary file."""
+    records = np.memmap(file_path, dtype=dtype, mode="r")
+    blocks = []
+    is_sorted = True
+    last_time = None
+    for start in range(0, records.size, INDEX_BLOCK):
+        times = np.asarray(records[time_field][start : start + INDEX_BLOCK])
+        is_sorted &= bool(np.all(times[1:] >= times[:-1]))
+        if last_time is not None:
+            is_sorted &= bool(times[0] >= last_time)
+        last_time = times[-1]
+        blocks.append(
+            [int(times.min()), int(times.max()), times.size, start * dtype.itemsize]
+        )
+    return {
+        "path": file_path,
+        "records": int(records.size),
+        "sorted": is_sorted,
+        "t_min": min((b[0] for b in blocks), default=None),
+        "t_max": max((b[1] for b in blocks), default=None),
+        "blocks": blocks,
+    }
+
+
+def build_index(processed_name: str, dtype: np.dtype) -> str:
+    """Index the binary files of a processed run and return the index path."""
+    time_field = time_fields(dtype)[0]
+    files = [
+        _file_index(file_path, dtype, time_field)
+        for file_path in data_files(processed_name)
+        if os.path.getsize(file_path) > 0
+    ]
+    index = {
+        "dtype": dtype.descr,
+        "time_field": time_field,
+        # time order of the split files, whatever their names
+        "files": sorted(files, key=lambda f: f["t_min"]),
+    }
+    index_path = processed_name + INDEX_SUFFIX
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(index_path + ".tmp", index_path)
+    return index_path
+
+
+def index_run(
+    petsys_commands: Commands, full_out_name: str, out_directory: str = None
+) -> None:
+    """Index the processed binary output of a run."""
+    yaml_dict = petsys_commands.dictionary
+    if not binary_output(yaml_dict):
+        return
+    build_index(
+        petsys_commands.processed_name(full_out_name, out_directory),
+        yaml_record_dtype(yaml_dict),
+    )
+
+
+class TimeIndex:
+    """Time-range access to the (split) binary output of a processed run.
+
+    Times are seconds from the first event of the run.
+    """
+
+    def __init__(self, index_path: str) -> None:
+        with open(index_path) as f:
+            index = json.load(f)
+        self.dtype = np.dtype([tuple(field) for field in index["dtype"]])
+        self.time_field = index["time_field"]
+        self.files = index["files"]
+        self.t0 = min((f["t_min"] for f in self.files), default=0)
+
+    @classmethod
+    def for_run(
+        cls, petsys_commands: Commands, full_out_name: str, out_directory: str = None
+    ) -> "TimeIndex":
+        processed_name = petsys_commands.processed_name(full_out_name, out_directory)
+        return cls(processed_name + INDEX_SUFFIX)
+
+    def duration(self) -> float:
+        """Seconds between the first and the last event of the run."""
+        t_max = max((f["t_max"] for f in self.files), default=self.t0)
+        return (t_max - self.t0) / PS_PER_S
+
+    def count(self, t_start: float, t_end: float) -> int:
+        """Upper bound of the records in [t_start, t_end) from the block index."""
+        start = self.t0 + t_start * PS_PER_S
+        end = self.t0 + t_end * PS_PER_S
+        return sum(
+            block[2]
+            for f in self.files
+            for block in f["blocks"]
+            if block[1] >= start and block[0] < end
+        )
+
+    def select(self, t_start: float, t_end: float) -> List[np.ndarray]:
+        """Records in [t_start, t_end), one array per file holding some.
+
+        Only the blocks overlapping the range are read. For time sorted files
+        (the converter output) the arrays are views of a memory map, nothing
+        is copied; unsorted files are filtered into a copy.
+        """
+        start = self.t0 + t_start * PS_PER_S
+        end = self.t0 + t_end * PS_PER_S
+        selection = []
+        for f in self.files:
+            blocks = [b for b in f["blocks"] if b[1] >= start and b[0] < end]
+            if not blocks:
+                continue
+            first = blocks[0][3] // self.dtype.itemsize
+            last = blocks[-1][3] // self.dtype.itemsize + blocks[-1][2]
+            records = np.memmap(f["path"], dtype=self.dtype, mode="r")[first:last]
+            times = records[self.time_field]
+            if f["sorted"]:
+                lo = np.searchsorted(times, start, side="left")
+                hi = np.searchsorted(times, end, side="left")
+                records = records[lo:hi]
+            else:
+                records = records[(times >= start) & (times < end)]
+            if records.size:
+                selection.append(records)
+        return selection
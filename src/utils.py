@@ -2,22 +2,33 @@ from typing import List
 from termcolor import colored
 
 
+def format_duration(seconds: float) -> str:
+    """Format a duration in seconds as H:MM:SS."""
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{int(hours)}:{int(minutes):02d}:{int(seconds):02d}"
+
+
 def estimate_remaining_time(
     iteration_times: List[float],
     total_iterations: int,
     current_iteration: int,
     string_process: str,
-) -> None:
+    extra_remaining_time: float = 0.0,
+    parallel: int = 1,
+) -> float:
     # Calculate the average time per iteration so far
     avg_time_per_iteration = sum(iteration_times) / len(iteration_times)
 
-    # Estimate the remaining time
+    # Estimate the remaining time, plus any predicted time not measured per iteration (e.g. motion)
+    # with `parallel` iterations running at the same time
     remaining_iterations = total_iterations - current_iteration
-    estimated_remaining_time = avg_time_per_iteration * remaining_iterations
+    estimated_remaining_time = (
+        avg_time_per_iteration * remaining_iterations / parallel + extra_remaining_time
+    )
 
-    hours, remainder = divmod(estimated_remaining_time, 3600)
-    minutes, seconds = divmod(remainder, 60)
-    time_string = f"Estimated remaining time for {string_process}: {int(hours)}:{int(minutes):02d}:{int(seconds):02d}"
+    time_string = f"Estimated remaining time for {string_process}: {format_duration(estimated_remaining_time)}"
     colored_string = colored(time_string, "green")
 
     print(colored_string)
+    return estimated_remaining_time
@@ -0,0 +1,302 @@
+import json
+import os
+import socket
+import threading
+import time
+from typing import Any, Dict, List
+
+from src.archive import Archiver
+from src.calibration import calibrate_run
+from src.decimate import decimate_run
+from src.multiplex import demultiplex_run
+from src.output import OutputManager
+from src.time_index import index_run
+from src.settings import Commands
+from src.text_records import convert_text_run
+
+LEASE_TIMEOUT = 120  # seconds without heartbeat after which a worker is considered dead
+HEARTBEAT_PERIOD = 20  # seconds between lease renewals of a running conversion
+MAX_ATTEMPTS = 3  # conversions of a run before it is marked as failed
+POLL_INTERVAL = 10  # seconds between checks for dead leases once the queue is empty
+
+
+def worker_id() -> str:
+    """Identifier of this worker, unique across the hosts sharing the queue."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _write_json(file_path: str, content: Any) -> None:
+    # temporary file private to the worker, several may write the same file
+    tmp_path = f"{file_path}.{worker_id()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(content, f, indent=1)
+    os.replace(tmp_path, file_path)
+
+
+class WorkQueue:
+    """Conversion jobs of a scan shared through the file system.
+
+    Every run is a job file. A worker owns a job while its lease file exists
+    and is renewed (mtime) every HEARTBEAT_PERIOD; leases older than
+    LEASE_TIMEOUT belong to dead workers and are broken, so the job is retried
+    up to MAX_ATTEMPTS times. Lease creation is exclusive (O_EXCL), so a run is
+    never converted twice by live workers.
+    """
+
+    def __init__(self, queue_dir: str) -> None:
+        self.queue_dir = queue_dir
+        with open(os.path.join(queue_dir, "queue.json")) as f:
+            queue_info = json.load(f)
+        self.yaml_dict = queue_info["yaml_dict"]
+        self.log_file = queue_info["log_file"]
+
+    @classmethod
+    def create(
+        cls,
+        queue_dir: str,
+        yaml_dict: Dict[str, Any],
+        log_file: str,
+        split_time: float,
+    ) -> "WorkQueue":
+        """Create the queue with one job per run of the scan log."""
+        with open(log_file) as f:
+            next(f)  # Skip the header
+            file_dirs = [line.split("\t")[0].strip() for line in f]
+        os.makedirs(queue_dir, exist_ok=True)
+        output_manager = OutputManager(yaml_dict)
+        for index, file_dir in enumerate(file_dirs):
+            job_id = f"{index:06d}"
+            job_path = os.path.join(queue_dir, job_id + ".job")
+            if os.path.exists(job_path):
+                continue  # keep the state of a queue created before
+            _write_json(
+                job_path,
+                {
+                    "id": job_id,
+                    "file_dir": file_dir,
+                    "split_time": split_time,
+                    "processed_directory": output_manager.processed_directory(index),
+                },
+            )
+        _write_json(
+            os.path.join(queue_dir, "queue.json"),
+            {"yaml_dict": yaml_dict, "log_file": log_file},
+        )
+        print(f"Queued {len(file_dirs)} runs in {queue_dir}")
+        return cls(queue_dir)
+
+    def _path(self, job_id: str, extension: str) -> str:
+        return os.path.join(self.queue_dir, job_id + extension)
+
+    def job_ids(self) -> List[str]:
+        return sorted(f[:-4] for f in os.listdir(self.queue_dir) if f.endswith(".job"))
+
+    def load_job(self, job_id: str) -> Dict[str, Any]:
+        with open(self._path(job_id, ".job")) as f:
+            return json.load(f)
+
+    def attempts(self, job_id: str) -> int:
+        """Number of times the job has been claimed."""
+        try:
+            with open(self._path(job_id, ".attempts")) as f:
+                return len(f.readlines())
+        except FileNotFoundError:
+            return 0
+
+    def is_finished(self, job_id: str) -> bool:
+        return os.path.exists(self._path(job_id, ".done")) or os.path.exists(
+            self._path(job_id, ".failed")
+        )
+
+    def unfinished(self) -> int:
+        """Jobs neither done nor failed, including the ones being converted."""
+        return sum(not self.is_finished(job_id) for job_id in self.job_ids())
+
+    def _break_dead_lease(self, job_id: str, worker: str) -> bool:
+        """Remove the lease of a dead worker, return False if the lease is alive."""
+        lease = self._path(job_id, ".lease")
+        try:
+            if time.time() - os.path.getmtime(lease) < LEASE_TIMEOUT:
+                return False
+            # only one worker wins the rename
+            stale = f"{lease}.{worker}.stale"
+            os.rename(lease, stale)
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
+        if time.time() - os.path.getmtime(stale) < LEASE_TIMEOUT:
+            # the lease was renewed in between, give it back
+            try:
+                os.link(stale, lease)
+            except FileExistsError:
+                pass
+            os.remove(stale)
+            return False
+        os.remove(stale)
+        print(f"Lease of job {job_id} expired, its worker is gone")
+        return True
+
+    def claim(self, worker: str) -> Dict[str, Any]:
+        """Take the lease of the next pending job, None if there is none."""
+        for job_id in self.job_ids():
+            if self.is_finished(job_id):
+                continue
+            if os.path.exists(self._path(job_id, ".lease")):
+                if not self._break_dead_lease(job_id, worker):
+                    continue
+            if self.attempts(job_id) >= MAX_ATTEMPTS:
+                _write_json(
+                    self._path(job_id, ".failed"),
+                    {"attempts": self.attempts(job_id), "time": time.time()},
+                )
+                print(f"Job {job_id} failed {MAX_ATTEMPTS} times, giving up")
+                continue
+            try:
+                fd = os.open(
+                    self._path(job_id, ".lease"), os.O_CREAT | os.O_EXCL | os.O_WRONLY
+                )
+            except FileExistsError:
+                continue  # claimed by another worker meanwhile
+            with os.fdopen(fd, "w") as f:
+                f.write(worker + "\n")
+            if self.is_finished(job_id):
+                # finished between the check and the lease
+                os.remove(self._path(job_id, ".lease"))
+                continue
+            with open(self._path(job_id, ".attempts"), "a") as f:
+                f.write(f"{worker}\t{time.time()}\n")
+            return self.load_job(job_id)
+        return None
+
+    def heartbeat(self, job_id: str) -> None:
+        """Renew the lease of a running job."""
+        try:
+            os.utime(self._path(job_id, ".lease"))
+        except FileNotFoundError:
+            print(f"Lease of job {job_id} lost, another worker may convert it")
+
+    def complete(self, job_id: str, worker: str, success: bool, seconds: float) -> None:
+        """Record a finished conversion and release the lease.
+
+        A failed conversion is released for a retry.
+        """
+        if success:
+            _write_json(
+                self._path(job_id, ".done"),
+                {"worker": worker, "seconds": seconds, "time": time.time()},
+            )
+        try:
+            os.remove(self._path(job_id, ".lease"))
+        except FileNotFoundError:
+            pass
+
+    def write_record(self) -> str:
+        """Write the conversion state of every run next to the scan log."""
+        record_file = os.path.splitext(self.log_file)[0] + "_processed.tsv"
+        tmp_path = f"{record_file}.{worker_id()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("file_name\tstatus\tworker\tseconds\tattempts\n")
+            for job_id in self.job_ids():
+                job = self.load_job(job_id)
+                status, worker, seconds = "pending", "", ""
+                if os.path.exists(self._path(job_id, ".done")):
+                    with open(self._path(job_id, ".done")) as done:
+                        done_info = json.load(done)
+                    status = "done"
+                    worker = done_info["worker"]
+                    seconds = f"{done_info['seconds']:.1f}"
+                elif os.path.exists(self._path(job_id, ".failed")):
+                    status = "failed"
+                f.write(
+                    f"{job['file_dir']}\t{status}\t{worker}\t{seconds}\t{self.attempts(job_id)}\n"
+                )
+        os.replace(tmp_path, record_file)
+        return record_file
+
+
+class Heartbeat:
+    """Renew the lease of a job in the background while it is converted."""
+
+    def __init__(self, work_queue: WorkQueue, job_id: str) -> None:
+        self.work_queue = work_queue
+        self.job_id = job_id
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self.stop.wait(HEARTBEAT_PERIOD):
+            self.work_queue.heartbeat(self.job_id)
+
+    def __enter__(self) -> "Heartbeat":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop.set()
+        self.thread.join()
+
+
+def run_worker(queue_dir: str) -> None:
+    """Convert the runs of a queue until none is left."""
+    work_queue = WorkQueue(queue_dir)
+    petsys_commands = Commands(work_queue.yaml_dict)
+    yaml_dict = work_queue.yaml_dict
+    # raw files archived by a previous conversion are listed in its manifest
+    archiver = Archiver(
+        yaml_dict,
+        os.path.abspath(
+            os.path.join(
+                yaml_dict["out_directory"], yaml_dict["out_name"] + "_archive.json"
+            )
+        ),
+    )
+    worker = worker_id()
+    current_dir = os.getcwd()
+    os.chdir(work_queue.yaml_dict["petsys_directory"])
+    print(f"Worker {worker} draining {queue_dir}")
+    converted = 0
+    try:
+        while True:
+            job = work_queue.claim(worker)
+            if job is None:
+                if work_queue.unfinished() == 0:
+                    break
+                # other workers hold the remaining jobs, wait in case they die
+                time.sleep(POLL_INTERVAL)
+                continue
+            start_time = time.time()
+            # the lease is renewed until the processed output is final, the
+            # steps after the conversion rewrite it in place
+            with Heartbeat(work_queue, job["id"]):
+                archiver.restore(job["file_dir"])
+                success = petsys_commands.process_data(
+                    job["file_dir"],
+                    split_time=job["split_time"],
+                    out_directory=job["processed_directory"],
+                )
+                if success:
+                    convert_text_run(
+                        petsys_commands, job["file_dir"], job["processed_directory"]
+                    )
+                    # calibrated before the energy_window of the decimation
+                    calibrate_run(
+                        petsys_commands, job["file_dir"], job["processed_directory"]
+                    )
+                    decimate_run(
+                        petsys_commands, job["file_dir"], job["processed_directory"]
+                    )
+                    index_run(
+                        petsys_commands, job["file_dir"], job["processed_directory"]
+                    )
+                    demultiplex_run(
+                        petsys_commands, job["file_dir"], job["processed_directory"]
+                    )
+            if not success:
+                print(f"Conversion of {job['file_dir']} failed, it will be retried.")
+            work_queue.complete(job["id"], worker, success, time.time() - start_time)
+            converted += success
+    finally:
+        os.chdir(current_dir)
+    record_file = work_queue.write_record()
+    print(f"Worker {worker} converted {converted} runs, record in {record_file}")
@@ -0,0 +1,41 @@
+import os
+
+from src.archive import Archiver
+
+RAW_EXTENSIONS = [".rawf", ".idxf"]
+PROCESSED_EXTENSIONS = [".ldat", "_index.json", "_rows.json"]
+
+
+def _write(file_path: str) -> bytes:
+    content = os.urandom(500)
+    with open(file_path, "wb") as f:
+        f.write(content)
+    return content
+
+
+def test_restore_raw_files_and_processed_output(tmp_path):
+    file_dir = str(tmp_path / "scan_0")
+    processed_name = str(tmp_path / "processed" / "scan_0_coincCompact")
+    os.makedirs(os.path.dirname(processed_name))
+    raw_files = [file_dir + extension for extension in RAW_EXTENSIONS]
+    processed_files = [processed_name + extension for extension in PROCESSED_EXTENSIONS]
+    contents = {
+        file_path: _write(file_path) for file_path in raw_files + processed_files
+    }
+
+    manifest_path = str(tmp_path / "scan_archive.json")
+    archiver = Archiver({"archive": "all"}, manifest_path)
+    archiver.submit(file_dir, processed_files)
+    archiver.close()
+    assert not any(os.path.exists(file_path) for file_path in contents)
+
+    # a later command reads the archive from its own archiver
+    archiver = Archiver({"archive": "all"}, manifest_path)
+    archiver.restore(file_dir)
+    assert all(os.path.exists(file_path) for file_path in raw_files)
+    assert not any(os.path.exists(file_path) for file_path in processed_files)
+    archiver.restore_processed(processed_name)
+    for file_path, content in contents.items():
+        with open(file_path, "rb") as f:
+            assert f.read() == content
+    assert archiver.manifest == {}
@@ -0,0 +1,77 @@
+import numpy as np
+
+from src import coincidence
+from src.coincidence import CoincidenceRules, build_coincidences
+from src.records import record_dtype
+
+SINGLES_DTYPE = record_dtype("singles", True)
+OUT_DTYPE = record_dtype("coincidence", True)
+NUM_ASICS = 2
+WINDOW_NS = 1.0
+
+
+def _singles(count: int, seed: int = 3) -> np.ndarray:
+    """Time ordered singles, a few of them within a window of each other."""
+    rng = np.random.default_rng(seed)
+    singles = np.zeros(count, dtype=SINGLES_DTYPE)
+    singles["time"] = np.cumsum(rng.integers(1, 600, count))
+    singles["energy"] = rng.uniform(0, 50, count)
+    # 4 detectors of NUM_ASICS ASICs
+    singles["channel_id"] = rng.integers(0, 4 * NUM_ASICS * 64, count)
+    return singles
+
+
+def _brute_force(singles: np.ndarray) -> list:
+    window = WINDOW_NS * coincidence.PS_PER_NS
+    detectors = singles["channel_id"] // 64 // NUM_ASICS
+    return [
+        (int(singles["time"][i]), int(singles["time"][j]))
+        for i in range(singles.size)
+        for j in range(i + 1, singles.size)
+        if singles["time"][j] - singles["time"][i] <= window
+        and detectors[i] != detectors[j]
+    ]
+
+
+def _pairs(chunks) -> list:
+    coincidences = np.concatenate(
+        list(
+            build_coincidences(
+                chunks, OUT_DTYPE, CoincidenceRules(NUM_ASICS), WINDOW_NS
+            )
+        )
+    )
+    return list(zip(coincidences["time1"].tolist(), coincidences["time2"].tolist()))
+
+
+def test_chunked_pairs_equal_brute_force():
+    singles = _singles(400)
+    expected = _brute_force(singles)
+    assert len(expected) > 50
+    for chunk_records in [1, 2, 5, 17, 400]:
+        chunks = [
+            singles[start : start + chunk_records]
+            for start in range(0, singles.size, chunk_records)
+        ]
+        assert _pairs(chunks) == expected
+
+
+def test_pairs_across_files(tmp_path, monkeypatch):
+    singles = _singles(300)
+    # the files are read in the order of their first time, not of their name
+    paths = []
+    for index, part in enumerate(np.array_split(singles, 3)):
+        paths.append(str(tmp_path / f"part_{2 - index}.ldat"))
+        part.tofile(paths[-1])
+    monkeypatch.setattr(coincidence, "CHUNK_RECORDS", 7)
+    chunks = coincidence._read_singles(sorted(paths), SINGLES_DTYPE)
+    assert _pairs(chunks) == _brute_force(singles)
+
+
+def test_rules_reject_same_detector_pairs():
+    singles = np.zeros(4, dtype=SINGLES_DTYPE)
+    # channels 0 and 64 are on detector 0, channel 128 on detector 1
+    singles["channel_id"] = [0, 64, 0, 128]
+    rules = CoincidenceRules(NUM_ASICS)
+    first, second = np.array([0, 2]), np.array([1, 3])
+    assert rules.accept(singles, first, second).tolist() == [False, True]
@@ -0,0 +1,62 @@
+import numpy as np
+
+from src import decimate
+from src.records import record_dtype
+
+GROUP_DTYPE = record_dtype("group", False)
+
+
+def _groups(count: int, seed: int = 1) -> np.ndarray:
+    """Hits of `count` groups of 1 to 5 hits."""
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(1, 6, count)
+    records = np.zeros(sizes.sum(), dtype=GROUP_DTYPE)
+    records["mh_n"] = np.repeat(sizes, sizes)
+    records["mh_j"] = np.arange(sizes.sum()) - np.repeat(
+        np.cumsum(sizes) - sizes, sizes
+    )
+    records["time"] = np.cumsum(rng.integers(1, 1000, sizes.sum()))
+    records["energy"] = rng.uniform(0, 50, sizes.sum())
+    records["channel_id"] = rng.integers(0, 4096, sizes.sum())
+    return records
+
+
+def _decimate(tmp_path, records, chunk_records, monkeypatch, **kwargs):
+    monkeypatch.setattr(decimate, "CHUNK_RECORDS", chunk_records)
+    in_path, out_path = str(tmp_path / "in.ldat"), str(tmp_path / "out.ldat")
+    records.tofile(in_path)
+    read, kept = decimate.decimate_file(in_path, out_path, GROUP_DTYPE, **kwargs)
+    assert read == records.size
+    selected = np.fromfile(out_path, dtype=GROUP_DTYPE)
+    assert selected.size == kept
+    return selected
+
+
+def _complete_groups(records: np.ndarray) -> bool:
+    first_hits = np.flatnonzero(records["mh_j"] == 0)
+    sizes = np.diff(np.append(first_hits, records.size))
+    return first_hits[:1].tolist() in [[], [0]] and np.array_equal(
+        sizes, records["mh_n"][first_hits]
+    )
+
+
+def test_group_selection_does_not_depend_on_chunking(tmp_path, monkeypatch):
+    records = _groups(2000)
+    kwargs = {"fraction": 30, "seed": 7, "energy_window": (5.0, 45.0)}
+    reference = _decimate(tmp_path, records, records.size, monkeypatch, **kwargs)
+    assert 0 < reference.size < records.size
+    assert _complete_groups(reference)
+    for chunk_records in [1, 3, 7, 64, 1000]:
+        selected = _decimate(tmp_path, records, chunk_records, monkeypatch, **kwargs)
+        assert np.array_equal(selected, reference)
+
+
+def test_group_kept_or_dropped_whole():
+    records = _groups(500)
+    mask = decimate.keep_mask(records, 100, energy_window=(5.0, 45.0))
+    groups = np.cumsum(records["mh_j"] == 0) - 1
+    inside = (records["energy"] >= 5.0) & (records["energy"] <= 45.0)
+    for group in range(groups[-1] + 1):
+        hits = groups == group
+        # one hit out of the window drops the whole group
+        assert np.all(mask[hits] == np.all(inside[hits]))
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+from src.executor import TaskGraph
+
+
+class Recorder:
+    """Start and end order of the tasks of a graph."""
+
+    def __init__(self) -> None:
+        self.events = []
+        self.lock = threading.Lock()
+
+    def task(self, name: str, seconds: float = 0.0, error: Exception = None):
+        def run() -> None:
+            with self.lock:
+                self.events.append(("start", name))
+            time.sleep(seconds)
+            with self.lock:
+                self.events.append(("end", name))
+            if error is not None:
+                raise error
+
+        return run
+
+    def index(self, event: str, name: str) -> int:
+        return self.events.index((event, name))
+
+    def started(self) -> set:
+        return {name for event, name in self.events if event == "start"}
+
+
+def test_dependencies_finish_before_their_dependents_start():
+    recorder = Recorder()
+    graph = TaskGraph()
+    graph.add("move", recorder.task("move", 0.05))
+    graph.add("settings", recorder.task("settings", 0.02))
+    graph.add("settle", recorder.task("settle"), after=["settings"])
+    # a dependency never added counts as done
+    graph.add("acquire", recorder.task("acquire"), after=["move", "settle", "log"])
+    graph.run()
+
+    assert recorder.started() == {"move", "settings", "settle", "acquire"}
+    assert recorder.index("end", "settings") < recorder.index("start", "settle")
+    for dependency in ["move", "settle"]:
+        assert recorder.index("end", dependency) < recorder.index("start", "acquire")
+    # independent tasks run at the same time
+    assert recorder.index("start", "settings") < recorder.index("end", "move")
+
+
+def test_first_error_is_raised_and_stops_the_graph():
+    recorder = Recorder()
+    graph = TaskGraph()
+    graph.add("fail", recorder.task("fail", error=ValueError("bias not set")))
+    graph.add("slow", recorder.task("slow", 0.2))
+    graph.add("after_fail", recorder.task("after_fail"), after=["fail"])
+    graph.add("after_slow", recorder.task("after_slow"), after=["slow"])
+    with pytest.raises(ValueError, match="bias not set"):
+        graph.run()
+
+    # the running task was waited for, nothing was started after the error
+    assert ("end", "slow") in recorder.events
+    assert recorder.started() == {"fail", "slow"}
+
+
+def test_cyclic_dependencies_are_rejected():
+    graph = TaskGraph()
+    graph.add("a", lambda: None, after=["b"])
+    graph.add("b", lambda: None, after=["a"])
+    with pytest.raises(AssertionError, match="Cyclic"):
+        graph.run()
+
+
+def test_task_added_twice_is_rejected():
+    graph = TaskGraph()
+    graph.add("a", lambda: None)
+    with pytest.raises(AssertionError):
+        graph.add("a", lambda: None)
@@ -0,0 +1,34 @@
+import pytest
+
+from src.motor_control import trapezoidal_move_time
+
+MAX_SPEED = 1000.0  # steps/s
+ACCELERATION = 500.0  # steps/s^2, the ramps take 2000 steps in total
+
+
+def test_no_move_takes_no_time():
+    assert trapezoidal_move_time(0, MAX_SPEED, ACCELERATION) == 0.0
+
+
+def test_short_move_follows_a_triangular_profile():
+    # 250 steps accelerating for 1 s, 250 decelerating, max speed not reached
+    assert trapezoidal_move_time(500, MAX_SPEED, ACCELERATION) == pytest.approx(2.0)
+
+
+def test_long_move_cruises_at_max_speed():
+    # 2 s ramping up and 2 s down, and 3000 steps (3 s) at max speed
+    assert trapezoidal_move_time(5000, MAX_SPEED, ACCELERATION) == pytest.approx(7.0)
+
+
+def test_profiles_meet_at_the_ramp_length():
+    ramp_steps = MAX_SPEED**2 / ACCELERATION
+    assert trapezoidal_move_time(ramp_steps, MAX_SPEED, ACCELERATION) == pytest.approx(
+        trapezoidal_move_time(ramp_steps + 1e-6, MAX_SPEED, ACCELERATION)
+    )
+
+
+def test_direction_does_not_change_the_time():
+    for steps in [300, 4000]:
+        assert trapezoidal_move_time(
+            -steps, MAX_SPEED, ACCELERATION
+        ) == trapezoidal_move_time(steps, MAX_SPEED, ACCELERATION)
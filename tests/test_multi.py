@@ -0,0 +1,97 @@
+import json
+import os
+import stat
+
+import yaml
+
+from src.multi import MULTI_STATUS_FILE, load_systems, run_systems
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# fake DAQ: writes a small run and the directory it was started in
+FAKE_ACQUIRE = """#!/bin/bash
+while [ $# -gt 0 ]; do case $1 in -o) out=$2; shift;; esac; shift; done
+head -c 20000 /dev/zero > $out.rawf
+printf "0\\t20000\\t0\\t0\\n" > $out.idxf
+pwd > $out.cwd
+echo "all events were lost for 0 (  0.0%) frames"
+"""
+
+
+def _fake_system(base: str, name: str) -> str:
+    """Petsys and config directories of a fake system, returns its YAML."""
+    petsys_directory = os.path.join(base, name, "petsys") + "/"
+    config_directory = os.path.join(base, name, "config") + "/"
+    os.makedirs(petsys_directory)
+    os.makedirs(config_directory)
+    acquire = os.path.join(petsys_directory, "acquire_sipm_data")
+    with open(acquire, "w") as f:
+        f.write(FAKE_ACQUIRE)
+    os.chmod(acquire, os.stat(acquire).st_mode | stat.S_IEXEC)
+    with open(config_directory + "config.ini", "w") as f:
+        f.write("[main]\ndisc_settings_table = %CDIR%/disc_settings.tsv\n")
+    with open(config_directory + "bias_settings.tsv", "w") as f:
+        f.write("#portID\tslaveID\tslotID\tchannelID\tOffset\t")
+        f.write("Pre-breakdown\tBreakdown\tOvervoltage\n")
+        f.write("0\t0\t0\t0\t0.75\t40.0\t50.0\t3.0\n")
+    with open(config_directory + "disc_settings.tsv", "w") as f:
+        f.write("#portID\tslaveID\tchipID\tchannelID\tvth_t1\tvth_t2\tvth_e\n")
+        f.write("0\t0\t0\t0\t20\t17\t1\n")
+    yaml_dict = {
+        "petsys_directory": petsys_directory,
+        "config_directory": config_directory,
+        "out_directory": os.path.join(base, name, "out") + "/",
+        "out_name": name,
+        "bias_file": os.path.join(ROOT, "test_data", "bias_map_corrected.csv"),
+        "FEM": "FEM128",
+        "FEBD": "FEBD1k",
+        "BIAS_board": "BIAS_16P",
+        "COM_port": "",
+        "flag_motor": False,
+        "ref_det_febd": -1,
+        "ref_det_ths": [30, 15, 12],
+        "ref_det_volt": [30.0, 37.5, 3.0],
+        "prebreak_voltage": 40.0,
+        "break_voltage": 50.0,
+        "over_voltage": [4.0],
+        "vth_t1": [10],
+        "vth_t2": [17],
+        "vth_e": [1],
+        "iterations": 1,
+        "time_between_iterations": 0.0,
+        "time": 0.1,
+        "mode": "qdc",
+        "hw_trigger": False,
+        "data_type": "coincidence",
+        "data_format": "binary",
+        "data_compact": True,
+        "fraction": 100,
+        "hits": 64,
+        "split_time": -1.0,
+    }
+    yaml_file = os.path.join(base, name + ".yaml")
+    with open(yaml_file, "w") as f:
+        yaml.safe_dump(yaml_dict, f)
+    return yaml_file
+
+
+def test_run_systems_with_fake_daq(tmp_path, monkeypatch):
+    base = str(tmp_path)
+    monkeypatch.chdir(base)
+    systems = load_systems([_fake_system(base, "sysA"), _fake_system(base, "sysB")])
+
+    assert run_systems(systems, "acquire", period=0.2)
+
+    for system in systems:
+        assert system.state() == "done"
+        (point,) = system.plan.points
+        # every system ran its DAQ in its own petsys_directory
+        with open(point.file_dir + ".cwd") as f:
+            cwd = f.read().strip()
+        assert os.path.samefile(cwd, system.yaml_dict["petsys_directory"])
+    with open(os.path.join(base, MULTI_STATUS_FILE)) as f:
+        status = json.load(f)
+    assert status["total_points"] == 2
+    # the raw data of both systems (and their index files)
+    assert status["bytes_written"] >= 2 * 20000
+    assert status["systems_running"] == 0
@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# seconds to import the command-line entry point, it took ~0.55 s when it
+# loaded pandas and numpy and ~0.03 s without them
+IMPORT_BUDGET = 0.25
+HEAVY_MODULES = ["pandas", "numpy", "serial"]
+
+
+def _import_cli() -> dict:
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "import src.cli\n"
+        "seconds = time.perf_counter() - start\n"
+        f"print(json.dumps({{'seconds': seconds, 'loaded': "
+        f"[m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def test_cli_does_not_import_heavy_modules():
+    assert _import_cli()["loaded"] == []
+
+
+def test_cli_import_time():
+    # best of a few runs, to be robust to a busy machine
+    seconds = min(_import_cli()["seconds"] for _ in range(3))
+    assert seconds < IMPORT_BUDGET, f"src.cli took {seconds:.3f} s to import"
@@ -0,0 +1,29 @@
+import os
+
+import numpy as np
+
+from src.table_cache import load_cached_tables
+
+
+def test_tables_compiled_again_only_when_the_source_changes(tmp_path):
+    source = str(tmp_path / "table.tsv")
+    with open(source, "w") as f:
+        f.write("1 2 3\n")
+    compiled = []
+
+    def compile_tables(file_path: str) -> dict:
+        compiled.append(file_path)
+        return {"values": np.loadtxt(file_path)}
+
+    first = load_cached_tables(source, compile_tables)
+    assert list(first) == ["values"]
+    # touched but not changed: the cache is kept
+    os.utime(source, (0, 0))
+    second = load_cached_tables(source, compile_tables)
+    assert np.array_equal(second["values"], first["values"])
+    assert len(compiled) == 1
+    with open(source, "w") as f:
+        f.write("4 5 6\n")
+    os.utime(source, (1, 1))
+    assert load_cached_tables(source, compile_tables)["values"].tolist() == [4, 5, 6]
+    assert len(compiled) == 2
@@ -0,0 +1,176 @@
+import glob
+import json
+import os
+import stat
+import subprocess
+import sys
+import time
+
+from src.archive import compress_file
+from src.work_queue import LEASE_TIMEOUT, MAX_ATTEMPTS, WorkQueue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 8
+RECORD_BYTES = 32  # compact coincidence record
+
+# fake converter: fails unless the raw files of the run were restored
+FAKE_CONVERT = """#!/bin/bash
+while [ $# -gt 0 ]; do case $1 in -i) in=$2; shift;; -o) out=$2; shift;; esac; shift; done
+[ -f $in.rawf ] || exit 1
+sleep 0.1
+head -c 3200 /dev/zero > $out.ldat
+"""
+# a worker polling the queue quickly, not to wait for the other one
+WORKER = (
+    "import sys\n"
+    "from src import work_queue\n"
+    "work_queue.POLL_INTERVAL = 0.1\n"
+    "work_queue.run_worker(sys.argv[1])\n"
+)
+
+
+def _queue_yaml(base: str) -> dict:
+    petsys_directory = os.path.join(base, "petsys") + "/"
+    os.makedirs(petsys_directory)
+    convert = os.path.join(petsys_directory, "convert_raw_to_coincidence")
+    with open(convert, "w") as f:
+        f.write(FAKE_CONVERT)
+    os.chmod(convert, os.stat(convert).st_mode | stat.S_IEXEC)
+    return {
+        "petsys_directory": petsys_directory,
+        "config_directory": os.path.join(base, "config") + "/",
+        "out_directory": os.path.join(base, "out") + "/",
+        "out_name": "scan",
+        "data_type": "coincidence",
+        "data_format": "binary",
+        "data_compact": True,
+        "fraction": 100,
+        "hits": 64,
+        "time": 0.1,
+    }
+
+
+def _archived_scan(yaml_dict: dict) -> str:
+    """Scan log of RUNS runs whose raw files are archived, returns its path."""
+    out_directory = yaml_dict["out_directory"]
+    os.makedirs(out_directory)
+    manifest = {}
+    log_file = os.path.join(out_directory, "scan.log")
+    with open(log_file, "w") as log:
+        log.write("file_name\n")
+        for index in range(RUNS):
+            file_dir = os.path.join(out_directory, f"scan_{index}")
+            log.write(file_dir + "\n")
+            for extension in [".rawf", ".idxf"]:
+                with open(file_dir + extension, "wb") as f:
+                    f.write(os.urandom(1000))
+                manifest[file_dir + extension] = compress_file(
+                    file_dir + extension, "lzma"
+                )
+    with open(os.path.join(out_directory, "scan_archive.json"), "w") as f:
+        json.dump(manifest, f)
+    return log_file
+
+
+def _queue(base: str, runs: int) -> WorkQueue:
+    """Queue of `runs` runs, none of them acquired."""
+    log_file = os.path.join(base, "scan.log")
+    with open(log_file, "w") as f:
+        f.write("file_name\n")
+        for index in range(runs):
+            f.write(os.path.join(base, f"scan_{index}") + "\n")
+    yaml_dict = {"out_directory": base, "out_name": "scan"}
+    return WorkQueue.create(os.path.join(base, "queue"), yaml_dict, log_file, -1.0)
+
+
+def _age(work_queue: WorkQueue, job_id: str) -> str:
+    """Age the lease of a job past LEASE_TIMEOUT, as if its worker died."""
+    lease = os.path.join(work_queue.queue_dir, job_id + ".lease")
+    expired = time.time() - LEASE_TIMEOUT - 1
+    os.utime(lease, (expired, expired))
+    return lease
+
+
+def test_claim_is_exclusive(tmp_path):
+    work_queue = _queue(str(tmp_path), 2)
+    first = work_queue.claim("worker-a")
+    second = WorkQueue(work_queue.queue_dir).claim("worker-b")
+    assert {first["id"], second["id"]} == {"000000", "000001"}
+    # both leases are alive
+    assert work_queue.claim("worker-c") is None
+    assert work_queue.unfinished() == 2
+
+
+def test_expired_lease_is_broken_and_retried(tmp_path):
+    work_queue = _queue(str(tmp_path), 1)
+    job = work_queue.claim("worker-a")
+    work_queue.heartbeat(job["id"])
+    assert work_queue.claim("worker-b") is None
+    _age(work_queue, job["id"])
+    assert work_queue.claim("worker-b")["id"] == job["id"]
+    assert work_queue.attempts(job["id"]) == 2
+    work_queue.complete(job["id"], "worker-b", True, 1.0)
+    assert work_queue.unfinished() == 0
+    assert work_queue.claim("worker-c") is None
+
+
+def test_lease_renewed_while_broken_is_given_back(tmp_path, monkeypatch):
+    work_queue = _queue(str(tmp_path), 1)
+    job = work_queue.claim("worker-a")
+    lease = _age(work_queue, job["id"])
+    rename = os.rename
+
+    def renewed_rename(src: str, dst: str) -> None:
+        # the heartbeat of worker-a lands between the age check and the rename
+        os.utime(src)
+        rename(src, dst)
+
+    monkeypatch.setattr(os, "rename", renewed_rename)
+    assert not work_queue._break_dead_lease(job["id"], "worker-b")
+    monkeypatch.setattr(os, "rename", rename)
+    assert os.path.exists(lease)
+    assert [f for f in os.listdir(work_queue.queue_dir) if f.endswith(".stale")] == []
+    assert work_queue.claim("worker-b") is None
+    assert work_queue.attempts(job["id"]) == 1
+
+
+def test_job_failed_after_max_attempts(tmp_path):
+    work_queue = _queue(str(tmp_path), 1)
+    for attempt in range(MAX_ATTEMPTS):
+        job = work_queue.claim(f"worker-{attempt}")
+        assert job["id"] == "000000"
+        _age(work_queue, job["id"])
+    assert work_queue.claim("worker-last") is None
+    assert os.path.exists(os.path.join(work_queue.queue_dir, "000000.failed"))
+    assert not os.path.exists(os.path.join(work_queue.queue_dir, "000000.lease"))
+    assert work_queue.unfinished() == 0
+
+
+def test_two_workers_restore_and_convert_one_queue(tmp_path):
+    yaml_dict = _queue_yaml(str(tmp_path))
+    log_file = _archived_scan(yaml_dict)
+    queue_dir = str(tmp_path / "queue")
+    work_queue = WorkQueue.create(queue_dir, yaml_dict, log_file, -1.0)
+
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-c", WORKER, queue_dir],
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+        )
+        for _ in range(2)
+    ]
+    assert [worker.wait(timeout=60) for worker in workers] == [0, 0]
+
+    assert work_queue.unfinished() == 0
+    for job_id in work_queue.job_ids():
+        assert os.path.exists(os.path.join(queue_dir, job_id + ".done"))
+        assert work_queue.attempts(job_id) == 1
+    out_directory = yaml_dict["out_directory"]
+    assert len(glob.glob(os.path.join(out_directory, "*.rawf"))) == RUNS
+    assert len(glob.glob(os.path.join(out_directory, "*.ldat"))) == RUNS
+    # the restores of both workers reached the shared manifest
+    with open(os.path.join(out_directory, "scan_archive.json")) as f:
+        assert json.load(f) == {}
+    assert glob.glob(os.path.join(out_directory, "*.tmp")) == []
+    assert glob.glob(os.path.join(out_directory, "*.lock")) == []